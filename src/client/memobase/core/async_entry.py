@@ -109,6 +109,20 @@ class AsyncMemoBaseClient:
         r = unpack_response(await self._client.delete(f"/users/{user_id}"))
         return True
 
+    async def insert_many(self, blobs: list[tuple[str, Blob]]) -> list[str]:
+        r = unpack_response(
+            await self._client.post(
+                "/blobs/insert_many",
+                json={
+                    "blobs": [
+                        {"user_id": user_id, **blob_data.to_request()}
+                        for user_id, blob_data in blobs
+                    ]
+                },
+            )
+        )
+        return r.data["ids"]
+
     async def close(self):
         await self._client.aclose()
 
@@ -134,6 +148,11 @@ class AsyncUser:
         )
         return r.data["id"]
 
+    async def insert_many(self, blobs: list[Blob]) -> list[str]:
+        return await self.project_client.insert_many(
+            [(self.user_id, blob_data) for blob_data in blobs]
+        )
+
     async def get(self, blob_id: str) -> Blob:
         r = unpack_response(
             await self.project_client.client.get(f"/blobs/{self.user_id}/{blob_id}")
@@ -105,6 +105,20 @@ class MemoBaseClient:
         r = unpack_response(self._client.delete(f"/users/{user_id}"))
         return True
 
+    def insert_many(self, blobs: list[tuple[str, Blob]]) -> list[str]:
+        r = unpack_response(
+            self._client.post(
+                "/blobs/insert_many",
+                json={
+                    "blobs": [
+                        {"user_id": user_id, **blob_data.to_request()}
+                        for user_id, blob_data in blobs
+                    ]
+                },
+            )
+        )
+        return r.data["ids"]
+
 
 @dataclass
 class User:
@@ -121,6 +135,11 @@ class User:
         )
         return r.data["id"]
 
+    def insert_many(self, blobs: list[Blob]) -> list[str]:
+        return self.project_client.insert_many(
+            [(self.user_id, blob_data) for blob_data in blobs]
+        )
+
     def get(self, blob_id: str) -> Blob:
         r = unpack_response(
             self.project_client.client.get(f"/blobs/{self.user_id}/{blob_id}")
@@ -37,6 +37,20 @@ def test_blob_get_all(api_client):
     a.delete_user(u)
 
 
+def test_blob_insert_many(api_client):
+    a = api_client
+    u1 = a.add_user()
+    u2 = a.add_user()
+    blob = DocBlob(content="test", fields={"1": "fool"})
+
+    ids = a.insert_many([(u1, blob), (u2, blob), (u1, blob)])
+    assert len(ids) == 3
+    assert len(a.get_user(u1).get_all(BlobType.doc)) == 2
+    assert len(a.get_user(u2).insert_many([blob, blob])) == 2
+    a.delete_user(u1)
+    a.delete_user(u2)
+
+
 def test_flush_curd_client(api_client):
     mb = api_client
     uid = mb.add_user({"me": "test"})
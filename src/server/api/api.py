@@ -12,7 +12,8 @@ from memobase_server.connectors import (
     init_redis_pool,
 )
 from memobase_server import api_layer
-from memobase_server.env import LOG
+from memobase_server.env import LOG, CONFIG
+from memobase_server.workers import start_background_workers, stop_background_workers
 from memobase_server.llms.embeddings import check_embedding_sanity
 from uvicorn.config import LOGGING_CONFIG
 from api_docs import API_X_CODE_DOCS
@@ -22,8 +23,14 @@ from api_docs import API_X_CODE_DOCS
 async def lifespan(app: FastAPI):
     init_redis_pool()
     await check_embedding_sanity()
+    # Without background flushing, only the idle buffer sweeper runs here
+    start_background_workers(
+        CONFIG.flush_worker_num if CONFIG.buffer_flush_in_background else 0,
+        listen_auth=True,
+    )
     LOG.info(f"Start Memobase Server {memobase_server.__version__} 🖼️")
     yield
+    await stop_background_workers()
     await close_connection()
 
 
@@ -165,6 +172,13 @@ router.post(
 )(api_layer.blob.insert_blob)
 
 
+router.post(
+    "/blobs/insert_many",
+    tags=["blob"],
+    openapi_extra=API_X_CODE_DOCS["POST /blobs/insert_many"],
+)(api_layer.blob.insert_many_blobs)
+
+
 router.get(
     "/blobs/{user_id}/{blob_id}",
     tags=["blob"],
@@ -214,6 +228,11 @@ router.post(
     openapi_extra=API_X_CODE_DOCS["POST /users/buffer/{user_id}/{buffer_type}"],
 )(api_layer.buffer.flush_buffer)
 
+router.get(
+    "/users/buffer/jobs/{user_id}/{job_id}",
+    tags=["buffer"],
+)(api_layer.buffer.get_flush_job)
+
 router.get(
     "/users/event/{user_id}",
     tags=["event"],
@@ -530,6 +530,35 @@ if err != nil {
     ]
 }
 
+API_X_CODE_DOCS["POST /blobs/insert_many"] = {
+    "x-code-samples": [
+        {
+            "lang": "Python",
+            "source": """# To use the Python SDK, install the package:
+# pip install memobase
+
+from memobase import Memobase
+from memobase import ChatBlob
+
+client = Memobase(project_url='PROJECT_URL', api_key='PROJECT_TOKEN')
+
+b = ChatBlob(messages=[
+    {
+        "role": "user",
+        "content": "Hi, I'm here again"
+    },
+    {
+        "role": "assistant",
+        "content": "Hi, Gus! How can I help you?"
+    }
+])
+bids = client.insert_many([(uid1, b), (uid2, b)])
+""",
+            "label": "Python",
+        },
+    ]
+}
+
 API_X_CODE_DOCS["GET /blobs/{user_id}/{blob_id}"] = {
     "x-code-samples": [
         {
@@ -0,0 +1,99 @@
+"""Mixed insert/context load against a running Memobase server.
+
+Run it against the same deployment before and after a change, e.g.:
+
+    python benchmarks/api_load.py --url http://localhost:8019 --token secret
+"""
+
+import time
+import random
+import asyncio
+import argparse
+import statistics
+import httpx
+
+MESSAGES = [
+    {"role": "user", "content": "Hi, I'm Gus, I just moved to Seattle for a new job"},
+    {"role": "assistant", "content": "Welcome to Seattle! What do you do?"},
+]
+
+
+async def run_client(
+    client: httpx.AsyncClient,
+    user_ids: list[str],
+    insert_ratio: float,
+    deadline: float,
+    latencies: dict[str, list[float]],
+    errors: list[str],
+):
+    while time.perf_counter() < deadline:
+        user_id = random.choice(user_ids)
+        kind = "insert" if random.random() < insert_ratio else "context"
+        start = time.perf_counter()
+        if kind == "insert":
+            r = await client.post(
+                f"/blobs/insert/{user_id}",
+                json={"blob_type": "chat", "blob_data": {"messages": MESSAGES}},
+            )
+        else:
+            r = await client.get(f"/users/context/{user_id}")
+        latencies[kind].append(time.perf_counter() - start)
+        if r.status_code != 200 or r.json()["errno"] != 0:
+            errors.append(r.text)
+
+
+def report(name: str, values: list[float], duration: float):
+    if not values:
+        return
+    values = sorted(values)
+    p95 = values[int(len(values) * 0.95) - 1] if len(values) >= 20 else values[-1]
+    print(
+        f"{name:>8}: {len(values) / duration:8.1f} req/s, "
+        f"p50 {statistics.median(values) * 1000:7.1f}ms, p95 {p95 * 1000:7.1f}ms"
+    )
+
+
+async def main(args):
+    async with httpx.AsyncClient(
+        base_url=f"{args.url.rstrip('/')}/api/v1",
+        headers={"Authorization": f"Bearer {args.token}"},
+        timeout=60,
+        limits=httpx.Limits(max_connections=args.concurrency),
+    ) as client:
+        user_ids = []
+        for _ in range(args.users):
+            r = await client.post("/users", json={})
+            user_ids.append(r.json()["data"]["id"])
+
+        latencies = {"insert": [], "context": []}
+        errors = []
+        deadline = time.perf_counter() + args.duration
+        await asyncio.gather(
+            *[
+                run_client(
+                    client, user_ids, args.insert_ratio, deadline, latencies, errors
+                )
+                for _ in range(args.concurrency)
+            ]
+        )
+
+        report("insert", latencies["insert"], args.duration)
+        report("context", latencies["context"], args.duration)
+        report("total", latencies["insert"] + latencies["context"], args.duration)
+        print(f"errors: {len(errors)}")
+        if errors:
+            print(errors[0])
+
+        for user_id in user_ids:
+            await client.delete(f"/users/{user_id}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:8019")
+    parser.add_argument("--token", default="secret")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--insert-ratio", type=float, default=0.5)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,106 @@
+"""Event search latency and recall of the HNSW index on synthetic users.
+
+Inserts one user per size with random embeddings, then compares the exact
+scan (index scans disabled) with the HNSW search at several ef_search:
+
+    python benchmarks/event_search.py --sizes 10000 100000 1000000
+"""
+
+import time
+import uuid
+import argparse
+from datetime import timedelta
+import statistics
+import numpy as np
+from sqlalchemy import text, insert, select, delete, func
+from memobase_server.env import CONFIG
+from memobase_server.connectors import Session
+from memobase_server.models.database import User, UserEvent, DEFAULT_PROJECT_ID
+
+
+def create_user_with_events(size: int, batch_size: int = 5000) -> str:
+    with Session() as session:
+        user = User(additional_fields=None, project_id=DEFAULT_PROJECT_ID)
+        session.add(user)
+        session.commit()
+        user_id = user.id
+        for start in range(0, size, batch_size):
+            vectors = np.random.randn(
+                min(batch_size, size - start), CONFIG.embedding_dim
+            ).astype(np.float32)
+            session.execute(
+                insert(UserEvent),
+                [
+                    {
+                        "id": uuid.uuid4(),
+                        "user_id": user_id,
+                        "project_id": DEFAULT_PROJECT_ID,
+                        "event_data": {"profile_delta": []},
+                        "embedding": v,
+                    }
+                    for v in vectors
+                ],
+            )
+            session.commit()
+        session.execute(text("ANALYZE user_events"))
+        session.commit()
+    return user_id
+
+
+def search(user_id: str, query: np.ndarray, topk: int, settings: list[str]):
+    distance = UserEvent.embedding.cosine_distance(query)
+    stmt = (
+        select(UserEvent.id)
+        .where(
+            UserEvent.user_id == user_id, UserEvent.project_id == DEFAULT_PROJECT_ID
+        )
+        .where(UserEvent.created_at > func.now() - timedelta(days=21))
+        .order_by(distance)
+        .limit(topk)
+    )
+    with Session() as session:
+        for s in settings:
+            session.execute(text(s))
+        start = time.perf_counter()
+        ids = [r.id for r in session.execute(stmt)]
+        return time.perf_counter() - start, ids
+
+
+def main(args):
+    for size in args.sizes:
+        print(f"== {size} events")
+        user_id = create_user_with_events(size)
+        queries = np.random.randn(args.queries, CONFIG.embedding_dim).astype(
+            np.float32
+        )
+        exact = [
+            search(user_id, q, args.topk, ["SET LOCAL enable_indexscan = off"])
+            for q in queries
+        ]
+        print(
+            f"{'exact':>14}: p50 {statistics.median(t for t, _ in exact) * 1000:8.2f}ms"
+        )
+        for ef in args.ef_search:
+            runs = [
+                search(user_id, q, args.topk, [f"SET LOCAL hnsw.ef_search = {ef}"])
+                for q in queries
+            ]
+            recall = statistics.mean(
+                len(set(ids) & set(exact_ids)) / max(len(exact_ids), 1)
+                for (_, ids), (_, exact_ids) in zip(runs, exact)
+            )
+            print(
+                f"{f'ef_search={ef}':>14}: p50 {statistics.median(t for t, _ in runs) * 1000:8.2f}ms, recall@{args.topk} {recall:.3f}"
+            )
+        with Session() as session:
+            session.execute(delete(User).where(User.id == user_id))
+            session.commit()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--topk", type=int, default=10)
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[40, 100, 200])
+    main(parser.parse_args())
@@ -4,7 +4,7 @@ import traceback
 
 from ..controllers import full as controllers
 
-from ..env import LOG, TelemetryKeyName
+from ..env import LOG, CONFIG, TelemetryKeyName
 from ..models.response import CODE
 from ..models.utils import Promise
 from ..models import response as res
@@ -22,19 +22,9 @@ async def insert_blob(
         capture_int_key, TelemetryKeyName.insert_blob_request, project_id=project_id
     )
 
-    p = await controllers.billing.get_project_billing(project_id)
+    p = await controllers.billing.check_project_token_left(project_id)
     if not p.ok():
         return p.to_response(res.IdResponse)
-    billing = p.data()
-
-    if billing.token_left is not None and billing.token_left < 0:
-        return Promise.reject(
-            CODE.SERVICE_UNAVAILABLE,
-            f"Your project reaches Memobase token limit, "
-            f"Left: {billing.token_left}, this project used: {billing.project_token_cost_month}. "
-            f"Your quota will be refilled on {billing.next_refill_at}. "
-            "\nhttps://www.memobase.io/pricing for more information.",
-        ).to_response(res.IdResponse)
 
     try:
         p = await controllers.blob.insert_blob(user_id, project_id, blob_data)
@@ -62,11 +52,75 @@ async def insert_blob(
     return res.BlobInsertResponse(
         data={
             **p.data().model_dump(),
-            "chat_results": pb.data(),
+            **pb.data().model_dump(),
         }
     )
 
 
+async def insert_many_blobs(
+    request: Request,
+    insert_request: res.BlobInsertManyRequest = Body(
+        ..., description="The blobs to insert"
+    ),
+    background_tasks: BackgroundTasks = BackgroundTasks(),
+) -> res.BlobInsertManyResponse:
+    project_id = request.state.memobase_project_id
+    blobs = insert_request.blobs
+    background_tasks.add_task(
+        capture_int_key,
+        TelemetryKeyName.insert_blob_request,
+        value=len(blobs),
+        project_id=project_id,
+    )
+    if len(blobs) > CONFIG.max_insert_many_blobs:
+        return Promise.reject(
+            CODE.BAD_REQUEST,
+            f"Too many blobs in one request ({len(blobs)} > {CONFIG.max_insert_many_blobs})",
+        ).to_response(res.BlobInsertManyResponse)
+
+    p = await controllers.billing.check_project_token_left(project_id)
+    if not p.ok():
+        return p.to_response(res.BlobInsertManyResponse)
+
+    try:
+        p = await controllers.blob.insert_blobs(project_id, blobs)
+        if not p.ok():
+            return p.to_response(res.BlobInsertManyResponse)
+        inserted = p.data()
+        user_blobs: dict[str, list] = {}
+        for blob, (bid, blob_parsed) in zip(blobs, inserted):
+            user_blobs.setdefault(str(blob.user_id), []).append((bid, blob_parsed))
+
+        chat_results, flush_job_ids = [], []
+        for user_id, this_blobs in user_blobs.items():
+            pb = await controllers.buffer.insert_blobs_to_buffer(
+                user_id, project_id, this_blobs
+            )
+            if not pb.ok():
+                return pb.to_response(res.BlobInsertManyResponse)
+            chat_results.extend(pb.data().chat_results)
+            flush_job_ids.extend(pb.data().flush_job_ids)
+    except Exception as e:
+        LOG.error(f"Error inserting blobs: {e}, {traceback.format_exc()}")
+        return Promise.reject(
+            CODE.INTERNAL_SERVER_ERROR, f"Error inserting blobs: {e}"
+        ).to_response(res.BlobInsertManyResponse)
+
+    background_tasks.add_task(
+        capture_int_key,
+        TelemetryKeyName.insert_blob_success_request,
+        value=len(blobs),
+        project_id=project_id,
+    )
+    return res.BlobInsertManyResponse(
+        data=res.BlobInsertManyData(
+            ids=[bid for bid, _ in inserted],
+            chat_results=chat_results,
+            flush_job_ids=flush_job_ids,
+        )
+    )
+
+
 async def get_blob(
     request: Request,
     user_id: str = Path(..., description="The ID of the user"),
@@ -1,9 +1,9 @@
 import os
 import time
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Receive, Scope, Send
 from fastapi.responses import JSONResponse
 
-from ..env import ProjectStatus
 from ..models.database import DEFAULT_PROJECT_ID
 from ..models.utils import Promise
 from ..telemetry import (
@@ -12,11 +12,7 @@ from ..telemetry import (
     HistogramMetricName,
 )
 from ..models.response import BaseResponse, CODE
-from ..auth.token import (
-    parse_project_id,
-    check_project_secret,
-    get_project_status,
-)
+from ..auth.token import parse_project_id, check_project_token
 
 
 PATH_MAPPINGS = [
@@ -31,7 +27,13 @@ PATH_MAPPINGS = [
 ]
 
 
-class AuthMiddleware(BaseHTTPMiddleware):
+class AuthMiddleware:
+    """Pure ASGI, requests and responses are passed through without wrapping
+    their bodies like `BaseHTTPMiddleware`."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
     def normalize_path(self, path: str) -> str:
         """Remove dynamic path parameters to get normalized path for metrics"""
         if not path.startswith("/api"):
@@ -43,68 +45,75 @@ class AuthMiddleware(BaseHTTPMiddleware):
 
         return path
 
-    async def dispatch(self, request, call_next):
-        if not request.url.path.startswith("/api"):
-            return await call_next(request)
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not scope["path"].startswith("/api"):
+            return await self.app(scope, receive, send)
+        path = scope["path"]
 
-        if request.url.path.startswith("/api/v1/healthcheck"):
+        if path.startswith("/api/v1/healthcheck"):
             telemetry_manager.increment_counter_metric(
                 CounterMetricName.HEALTHCHECK,
                 1,
             )
-            return await call_next(request)
+            return await self.app(scope, receive, send)
 
-        auth_token = request.headers.get("Authorization")
+        auth_token = Headers(scope=scope).get("Authorization")
         if not auth_token or not auth_token.startswith("Bearer "):
-            return JSONResponse(
-                status_code=CODE.UNAUTHORIZED.value,
-                content=BaseResponse(
-                    errno=CODE.UNAUTHORIZED.value,
-                    errmsg=f"Unauthorized access to {request.url.path}. You have to provide a valid Bearer token.",
-                ).model_dump(),
+            return await self.unauthorized(
+                scope,
+                receive,
+                send,
+                f"Unauthorized access to {path}. You have to provide a valid Bearer token.",
             )
         auth_token = (auth_token.split(" ")[1]).strip()
         is_root = self.is_valid_root(auth_token)
-        request.state.is_memobase_root = is_root
-        request.state.memobase_project_id = DEFAULT_PROJECT_ID
+        # Read by the handlers as request.state
+        state = scope.setdefault("state", {})
+        state["is_memobase_root"] = is_root
+        state["memobase_project_id"] = DEFAULT_PROJECT_ID
         if not is_root:
             p = await self.parse_project_token(auth_token)
             if not p.ok():
-                return JSONResponse(
-                    status_code=CODE.UNAUTHORIZED.value,
-                    content=BaseResponse(
-                        errno=CODE.UNAUTHORIZED.value,
-                        errmsg=f"Unauthorized access to {request.url.path}. {p.msg()}",
-                    ).model_dump(),
+                return await self.unauthorized(
+                    scope,
+                    receive,
+                    send,
+                    f"Unauthorized access to {path}. {p.msg()}",
                 )
-            request.state.memobase_project_id = p.data()
+            state["memobase_project_id"] = p.data()
         # await capture_int_key(TelemetryKeyName.has_request)
 
-        normalized_path = self.normalize_path(request.url.path)
-
+        normalized_path = self.normalize_path(path)
+        attributes = {
+            "project_id": state["memobase_project_id"],
+            "path": normalized_path,
+            "method": scope["method"],
+        }
         telemetry_manager.increment_counter_metric(
             CounterMetricName.REQUEST,
             1,
-            {
-                "project_id": request.state.memobase_project_id,
-                "path": normalized_path,
-                "method": request.method,
-            },
+            attributes,
         )
 
         start_time = time.time()
-        response = await call_next(request)
-
-        telemetry_manager.record_histogram_metric(
-            HistogramMetricName.REQUEST_LATENCY_MS,
-            (time.time() - start_time) * 1000,
-            {
-                "project_id": request.state.memobase_project_id,
-                "path": normalized_path,
-                "method": request.method,
-            },
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            telemetry_manager.record_histogram_metric(
+                HistogramMetricName.REQUEST_LATENCY_MS,
+                (time.time() - start_time) * 1000,
+                attributes,
+            )
+
+    async def unauthorized(self, scope: Scope, receive: Receive, send: Send, msg: str):
+        response = JSONResponse(
+            status_code=CODE.UNAUTHORIZED.value,
+            content=BaseResponse(
+                errno=CODE.UNAUTHORIZED.value,
+                errmsg=msg,
+            ).model_dump(),
         )
-        return response
+        await response(scope, receive, send)
 
     def is_valid_root(self, token: str) -> bool:
         access_token = os.getenv("ACCESS_TOKEN")
@@ -117,14 +126,7 @@ class AuthMiddleware(BaseHTTPMiddleware):
         if not p.ok():
             return Promise.reject(CODE.UNAUTHORIZED, "Invalid project id format")
         project_id = p.data()
-        p = await check_project_secret(project_id, token)
-        if not p.ok():
-            return p
-        if not p.data():
-            return Promise.reject(CODE.UNAUTHORIZED, "Wrong secret key")
-        p = await get_project_status(project_id)
+        p = await check_project_token(project_id, token)
         if not p.ok():
             return p
-        if p.data() == ProjectStatus.suspended:
-            return Promise.reject(CODE.FORBIDDEN, "Your project is suspended!")
         return Promise.resolve(project_id)
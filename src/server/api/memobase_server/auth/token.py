@@ -1,13 +1,24 @@
+import time
+import asyncio
+import hmac
+from collections import OrderedDict
 from hashlib import sha256
 from datetime import datetime
 from random import random
 from typing import Tuple
 from uuid import uuid4
+from ..env import CONFIG, LOG, ProjectStatus
 from ..models.utils import Promise
 from ..models.response import CODE
 from ..connectors import get_redis_client
 from ..controllers import project
 
+# Publish a project id here after changing its secret or status
+AUTH_INVALIDATE_CHANNEL = "memobase::auth::invalidate"
+
+# project_id -> (expire_at, sha256 of the secret, status), least recently used first
+_LOCAL_PROJECT_AUTH: OrderedDict[str, tuple[float, bytes, str]] = OrderedDict()
+
 
 def parse_project_id(secret_key: str) -> Promise[str]:
     if not secret_key.startswith("sk-"):
@@ -27,7 +38,7 @@ def project_status_redis_key(project_id: str) -> str:
     return f"memobase::auth::project_status::{project_id}"
 
 
-async def check_project_secret(project_id: str, secret_key: str) -> Promise[bool]:
+async def get_project_secret(project_id: str) -> Promise[str]:
     async with get_redis_client() as client:
         secret = await client.get(token_redis_key(project_id))
         if secret is None:
@@ -36,7 +47,7 @@ async def check_project_secret(project_id: str, secret_key: str) -> Promise[bool
                 return Promise.reject(CODE.UNAUTHORIZED, "Your project is not exists!")
             secret = p.data()
             await client.set(token_redis_key(project_id), secret, ex=None)
-    return Promise.resolve(secret == secret_key)
+    return Promise.resolve(secret)
 
 
 async def get_project_status(project_id: str) -> Promise[str]:
@@ -51,3 +62,80 @@ async def get_project_status(project_id: str) -> Promise[str]:
                 project_status_redis_key(project_id), status.strip(), ex=60 * 60
             )
     return Promise.resolve(status)
+
+
+def _secret_digest(secret: str) -> bytes:
+    return sha256(secret.encode()).digest()
+
+
+async def check_project_token(project_id: str, secret_key: str) -> Promise[None]:
+    """Check the secret and the status of the project.
+
+    Served from memory for `auth_local_cache_ttl` seconds, entries are
+    dropped earlier when the project is invalidated through
+    `AUTH_INVALIDATE_CHANNEL`.
+    """
+    now = time.monotonic()
+    local = _LOCAL_PROJECT_AUTH.get(project_id)
+    if local is not None and local[0] > now:
+        _LOCAL_PROJECT_AUTH.move_to_end(project_id)
+        _, secret_digest, status = local
+    else:
+        secret_p, status_p = await asyncio.gather(
+            get_project_secret(project_id), get_project_status(project_id)
+        )
+        if not secret_p.ok():
+            return secret_p
+        if not status_p.ok():
+            return status_p
+        secret_digest, status = _secret_digest(secret_p.data()), status_p.data()
+        if CONFIG.auth_local_cache_size > 0:
+            _LOCAL_PROJECT_AUTH[project_id] = (
+                now + CONFIG.auth_local_cache_ttl,
+                secret_digest,
+                status,
+            )
+            _LOCAL_PROJECT_AUTH.move_to_end(project_id)
+            while len(_LOCAL_PROJECT_AUTH) > CONFIG.auth_local_cache_size:
+                _LOCAL_PROJECT_AUTH.popitem(last=False)
+    if not hmac.compare_digest(secret_digest, _secret_digest(secret_key)):
+        return Promise.reject(CODE.UNAUTHORIZED, "Wrong secret key")
+    if status == ProjectStatus.suspended:
+        return Promise.reject(CODE.FORBIDDEN, "Your project is suspended!")
+    return Promise.resolve(None)
+
+
+def drop_local_project_auth(project_id: str | None = None):
+    """Drop the cached auth of a project, or of all projects"""
+    if project_id is None:
+        _LOCAL_PROJECT_AUTH.clear()
+    else:
+        _LOCAL_PROJECT_AUTH.pop(project_id, None)
+
+
+async def invalidate_project_auth(project_id: str):
+    """Call after changing the secret or status of a project, every process
+    reloads them on its next request of the project."""
+    drop_local_project_auth(project_id)
+    async with get_redis_client() as client:
+        await client.delete(
+            token_redis_key(project_id), project_status_redis_key(project_id)
+        )
+        await client.publish(AUTH_INVALIDATE_CHANNEL, project_id)
+
+
+async def listen_project_auth_invalidation(stop_event: asyncio.Event):
+    """Drop the cached auth of the projects published to
+    `AUTH_INVALIDATE_CHANNEL`, until `stop_event` is set."""
+    async with get_redis_client() as client:
+        async with client.pubsub() as pubsub:
+            await pubsub.subscribe(AUTH_INVALIDATE_CHANNEL)
+            # Entries cached while not subscribed may have missed their message
+            drop_local_project_auth()
+            while not stop_event.is_set():
+                message = await pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=1.0
+                )
+                if message is not None:
+                    LOG.info(f"Invalidate the auth of project {message['data']}")
+                    drop_local_project_auth(message["data"])
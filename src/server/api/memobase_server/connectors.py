@@ -3,10 +3,12 @@ import asyncio
 import redis.exceptions
 import redis.asyncio as redis
 from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.exc import OperationalError
 from uuid import uuid4
-from .env import LOG
+from .env import LOG, CONFIG
 from .models.database import REG, Project, UserEvent
 
 DATABASE_URL = os.getenv("DATABASE_URL")
@@ -24,18 +26,30 @@ LOG.info(f"Project ID: {PROJECT_ID}")
 LOG.info(f"Database URL: {DATABASE_URL}")
 LOG.info(f"Redis URL: {REDIS_URL}")
 
-# Create an engine
+# Create an engine, only table creation and scripts use it
 DB_ENGINE = create_engine(
     DATABASE_URL,
-    pool_size=50,  # Reasonable default, adjust based on your needs
-    max_overflow=30,  # Allow 10 connections beyond pool_size
+    pool_size=5,
+    max_overflow=5,
     pool_recycle=600,  # Recycle connections after 10 minutes
     pool_pre_ping=True,  # Verify connections before using
     pool_timeout=30,  # Wait up to 30 seconds for available connection
 )
+# Controllers run on the event loop, they query through asyncpg
+ASYNC_DB_ENGINE = create_async_engine(
+    make_url(DATABASE_URL).set(drivername="postgresql+asyncpg"),
+    pool_size=CONFIG.async_db_pool_size,
+    max_overflow=CONFIG.async_db_max_overflow,
+    pool_recycle=600,
+    pool_pre_ping=True,
+    pool_timeout=30,
+)
 REDIS_POOL = None
+REDIS_BINARY_POOL = None
 
 Session = sessionmaker(bind=DB_ENGINE)
+# Objects stay readable after commit, expired attributes can't lazy load in async
+AsyncSession = async_sessionmaker(bind=ASYNC_DB_ENGINE, expire_on_commit=False)
 
 
 def create_tables():
@@ -73,14 +87,18 @@ async def redis_health_check() -> bool:
 
 async def close_connection():
     DB_ENGINE.dispose()
+    await ASYNC_DB_ENGINE.dispose()
     if REDIS_POOL is not None:
         await REDIS_POOL.aclose()
+    if REDIS_BINARY_POOL is not None:
+        await REDIS_BINARY_POOL.aclose()
     LOG.info("Connections closed")
 
 
 def init_redis_pool():
-    global REDIS_POOL
+    global REDIS_POOL, REDIS_BINARY_POOL
     REDIS_POOL = redis.ConnectionPool.from_url(REDIS_URL, decode_responses=True)
+    REDIS_BINARY_POOL = redis.ConnectionPool.from_url(REDIS_URL)
 
 
 def get_redis_client() -> redis.Redis:
@@ -90,6 +108,14 @@ def get_redis_client() -> redis.Redis:
         return redis.Redis.from_url(REDIS_URL, decode_responses=True)
 
 
+def get_redis_binary_client() -> redis.Redis:
+    """A client returning raw bytes, for binary values like embeddings"""
+    if REDIS_BINARY_POOL is not None:
+        return redis.Redis(connection_pool=REDIS_BINARY_POOL)
+    else:
+        return redis.Redis.from_url(REDIS_URL)
+
+
 if __name__ == "__main__":
 
     async def main():
@@ -1,3 +1,6 @@
+import time
+from collections import defaultdict
+from sqlalchemy import update, select
 from pydantic import ValidationError
 from ..models.utils import Promise
 from ..models.database import (
@@ -6,8 +9,8 @@ from ..models.database import (
     next_month_first_day,
 )
 from ..models.response import CODE, IdData, IdsData, UserProfilesData, BillingData
-from ..connectors import Session
-from ..telemetry.capture_key import get_int_key, capture_int_key
+from ..connectors import AsyncSession, get_redis_client
+from ..telemetry.capture_key import get_int_keys, capture_int_keys
 from ..env import (
     LOG,
     CONFIG,
@@ -18,26 +21,134 @@ from ..env import (
 )
 from datetime import datetime, date
 
+# project_id -> (expire_at, snapshot)
+_LOCAL_BILLING_SNAPSHOTS: dict[str, tuple[float, BillingData]] = {}
+# project_id -> [input_tokens, output_tokens], written by `flush_token_billing`
+_PENDING_TOKEN_COSTS: dict[str, list[int]] = defaultdict(lambda: [0, 0])
+
+# Only decrement a live snapshot, a missing one is rebuilt from the DB
+DECR_SNAPSHOT_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+if redis.call('HEXISTS', KEYS[1], 'token_left') == 1 then
+    redis.call('HINCRBY', KEYS[1], 'token_left', -tonumber(ARGV[1]))
+end
+redis.call('HINCRBY', KEYS[1], 'project_token_cost_month', ARGV[1])
+return 1
+"""
+
+
+def billing_snapshot_key(project_id: str) -> str:
+    return f"memobase::billing_snapshot::{project_id}"
+
+
+async def get_project_billing_snapshot(project_id: str) -> Promise[BillingData]:
+    """A short-lived billing snapshot for the quota checks on the hot path.
+
+    Served from memory, then Redis, then `get_project_billing`. LLM costs
+    decrement the snapshot, so the quota can only be overshot by the costs
+    of other processes within `billing_local_cache_ttl` plus
+    `billing_flush_interval`.
+    """
+    now = time.monotonic()
+    local = _LOCAL_BILLING_SNAPSHOTS.get(project_id)
+    if local is not None and local[0] > now:
+        return Promise.resolve(local[1])
+
+    key = billing_snapshot_key(project_id)
+    async with get_redis_client() as redis_client:
+        cached = await redis_client.hgetall(key)
+        if cached:
+            billing_data = BillingData(
+                token_left=(
+                    int(cached["token_left"]) if "token_left" in cached else None
+                ),
+                next_refill_at=cached.get("next_refill_at") or None,
+                project_token_cost_month=int(cached["project_token_cost_month"]),
+            )
+        else:
+            p = await get_project_billing(project_id)
+            if not p.ok():
+                return p
+            billing_data = p.data()
+            mapping = {
+                "project_token_cost_month": billing_data.project_token_cost_month,
+                "next_refill_at": (
+                    billing_data.next_refill_at.isoformat()
+                    if billing_data.next_refill_at
+                    else ""
+                ),
+            }
+            if billing_data.token_left is not None:
+                mapping["token_left"] = billing_data.token_left
+            async with redis_client.pipeline(transaction=True) as pipe:
+                pipe.hset(key, mapping=mapping)
+                pipe.expire(key, CONFIG.billing_cache_ttl)
+                await pipe.execute()
+    _LOCAL_BILLING_SNAPSHOTS[project_id] = (
+        now + CONFIG.billing_local_cache_ttl,
+        billing_data,
+    )
+    return Promise.resolve(billing_data)
+
+
+def decrease_local_billing_snapshot(project_id: str, tokens: int):
+    local = _LOCAL_BILLING_SNAPSHOTS.get(project_id)
+    if local is None:
+        return
+    billing_data = local[1]
+    _LOCAL_BILLING_SNAPSHOTS[project_id] = (
+        local[0],
+        billing_data.model_copy(
+            update={
+                "token_left": (
+                    billing_data.token_left - tokens
+                    if billing_data.token_left is not None
+                    else None
+                ),
+                "project_token_cost_month": billing_data.project_token_cost_month
+                + tokens,
+            }
+        ),
+    )
+
+
+async def check_project_token_left(project_id: str) -> Promise[None]:
+    p = await get_project_billing_snapshot(project_id)
+    if not p.ok():
+        return p
+    billing = p.data()
+
+    if billing.token_left is not None and billing.token_left < 0:
+        return Promise.reject(
+            CODE.SERVICE_UNAVAILABLE,
+            f"Your project reaches Memobase token limit, "
+            f"Left: {billing.token_left}, this project used: {billing.project_token_cost_month}. "
+            f"Your quota will be refilled on {billing.next_refill_at}. "
+            "\nhttps://www.memobase.io/pricing for more information.",
+        )
+    return Promise.resolve(None)
+
 
 async def get_project_billing(project_id: str) -> Promise[BillingData]:
-    with Session() as session:
-        billing = (
-            session.query(ProjectBilling)
+    async with AsyncSession() as session:
+        billing = await session.scalar(
+            select(Billing)
+            .join(ProjectBilling, ProjectBilling.billing_id == Billing.id)
             .filter(ProjectBilling.project_id == project_id)
-            .first()
+            .limit(1)
         )
         if billing is None:
             return await fallback_billing_data(project_id)
             # return Promise.reject(CODE.NOT_FOUND, "Billing not found").to_response(
             #     BillingData
             # )
-        billing = billing.billing
 
-        this_month_token_costs_in = await get_int_key(
-            TelemetryKeyName.llm_input_tokens, project_id, in_month=True
-        )
-        this_month_token_costs_out = await get_int_key(
-            TelemetryKeyName.llm_output_tokens, project_id, in_month=True
+        this_month_token_costs_in, this_month_token_costs_out = await get_int_keys(
+            [TelemetryKeyName.llm_input_tokens, TelemetryKeyName.llm_output_tokens],
+            project_id,
+            in_month=True,
         )
         usage_left_this_billing = billing.usage_left
 
@@ -53,7 +164,7 @@ async def get_project_billing(project_id: str) -> Promise[BillingData]:
 
             billing.next_refill_at = next_month_first_day()
             billing.usage_left = usage_left_this_billing
-            session.commit()
+            await session.commit()
     billing_data = BillingData(
         token_left=usage_left_this_billing,
         next_refill_at=next_refill_date,
@@ -65,11 +176,10 @@ async def get_project_billing(project_id: str) -> Promise[BillingData]:
 async def fallback_billing_data(project_id: str) -> Promise[BillingData]:
     from .project import get_project_status
 
-    this_month_token_costs_in = await get_int_key(
-        TelemetryKeyName.llm_input_tokens, project_id, in_month=True
-    )
-    this_month_token_costs_out = await get_int_key(
-        TelemetryKeyName.llm_output_tokens, project_id, in_month=True
+    this_month_token_costs_in, this_month_token_costs_out = await get_int_keys(
+        [TelemetryKeyName.llm_input_tokens, TelemetryKeyName.llm_output_tokens],
+        project_id,
+        in_month=True,
     )
 
     this_month_token_costs = this_month_token_costs_in + this_month_token_costs_out
@@ -106,23 +216,81 @@ async def fallback_billing_data(project_id: str) -> Promise[BillingData]:
 async def project_cost_token_billing(
     project_id: str, input_tokens: int, output_tokens: int
 ) -> Promise[None]:
-    await capture_int_key(
-        TelemetryKeyName.llm_input_tokens, input_tokens, project_id=project_id
-    )
-    await capture_int_key(
-        TelemetryKeyName.llm_output_tokens, output_tokens, project_id=project_id
-    )
-    with Session() as session:
-        _billing = (
-            session.query(ProjectBilling)
-            .filter(ProjectBilling.project_id == project_id)
-            .one_or_none()
+    """Record the LLM token costs of a project.
+
+    Costs are only accumulated in this process, `flush_token_billing` writes
+    them to Redis and the DB every `billing_flush_interval` seconds.
+    """
+    costs = _PENDING_TOKEN_COSTS[project_id]
+    costs[0] += input_tokens
+    costs[1] += output_tokens
+    decrease_local_billing_snapshot(project_id, input_tokens + output_tokens)
+    return Promise.resolve(None)
+
+
+async def flush_token_billing() -> Promise[None]:
+    """Write the accumulated token costs to the DB, the telemetry counters
+    and the Redis snapshots.
+
+    The DB decrement is authoritative and written first, if it fails the
+    costs are put back for the next flush. The counters retry on their own,
+    and a failed snapshot decrement is only logged: the snapshot expires and
+    is rebuilt from the counters.
+    """
+    if not _PENDING_TOKEN_COSTS:
+        return Promise.resolve(None)
+    pending = dict(_PENDING_TOKEN_COSTS)
+    _PENDING_TOKEN_COSTS.clear()
+
+    try:
+        async with AsyncSession() as session:
+            for project_id, costs in pending.items():
+                # Atomic decrement, concurrent flushes never lose each other's costs
+                await session.execute(
+                    update(Billing)
+                    .where(
+                        Billing.id.in_(
+                            select(ProjectBilling.billing_id).where(
+                                ProjectBilling.project_id == project_id
+                            )
+                        ),
+                        Billing.usage_left.is_not(None),
+                    )
+                    .values(usage_left=Billing.usage_left - sum(costs))
+                )
+            await session.commit()
+    except Exception as e:
+        # The transaction applied nothing, retry all the costs in the next flush
+        for project_id, (input_tokens, output_tokens) in pending.items():
+            costs = _PENDING_TOKEN_COSTS[project_id]
+            costs[0] += input_tokens
+            costs[1] += output_tokens
+        LOG.error(f"Failed to flush token billing: {e}")
+        return Promise.reject(
+            CODE.SERVICE_UNAVAILABLE, f"Failed to flush token billing: {e}"
+        )
+
+    telemetry_values = {}
+    for project_id, (input_tokens, output_tokens) in pending.items():
+        telemetry_values[(TelemetryKeyName.llm_input_tokens, project_id)] = (
+            input_tokens
+        )
+        telemetry_values[(TelemetryKeyName.llm_output_tokens, project_id)] = (
+            output_tokens
         )
-        if _billing is None:
-            return Promise.reject(CODE.NOT_FOUND, "Billing not found")
-        billing = _billing.billing
+    await capture_int_keys(telemetry_values)
 
-        if billing.usage_left is not None:
-            billing.usage_left -= input_tokens + output_tokens
-            session.commit()
+    try:
+        async with get_redis_client() as redis_client:
+            decr_script = redis_client.register_script(DECR_SNAPSHOT_SCRIPT)
+            async with redis_client.pipeline(transaction=False) as pipe:
+                for project_id, costs in pending.items():
+                    await decr_script(
+                        keys=[billing_snapshot_key(project_id)],
+                        args=[sum(costs)],
+                        client=pipe,
+                    )
+                await pipe.execute()
+    except Exception as e:
+        LOG.warning(f"Failed to decrease billing snapshots: {e}")
     return Promise.resolve(None)
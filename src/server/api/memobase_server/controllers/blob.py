@@ -1,9 +1,12 @@
+import uuid
 import pydantic
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import insert, select, delete
 from ..models.utils import Promise
 from ..models.database import GeneralBlob, DEFAULT_PROJECT_ID
-from ..models.response import CODE, BlobData, IdData
-from ..models.blob import ChatBlob, DocBlob, BlobType
-from ..connectors import Session
+from ..models.response import CODE, BlobData, IdData, UserBlobData
+from ..models.blob import ChatBlob, DocBlob, BlobType, Blob
+from ..connectors import AsyncSession
 
 
 async def insert_blob(user_id: str, project_id: str, blob: BlobData) -> Promise[IdData]:
@@ -11,7 +14,7 @@ async def insert_blob(user_id: str, project_id: str, blob: BlobData) -> Promise[
         blob_parsed = blob.to_blob()
     except pydantic.ValidationError as e:
         return Promise.reject(CODE.BAD_REQUEST, f"Unable to parse blob: {e}")
-    with Session() as session:
+    async with AsyncSession() as session:
         blob_db = GeneralBlob(
             blob_type=blob_parsed.type,
             blob_data=blob_parsed.get_blob_data(),
@@ -20,17 +23,52 @@ async def insert_blob(user_id: str, project_id: str, blob: BlobData) -> Promise[
             project_id=project_id,
         )
         session.add(blob_db)
-        session.commit()
+        await session.commit()
         b_id = blob_db.id
     return Promise.resolve(IdData(id=b_id))
 
 
+async def insert_blobs(
+    project_id: str, blobs: list[UserBlobData]
+) -> Promise[list[tuple[str, Blob]]]:
+    """Insert blobs of one or many users with a single multi-row INSERT.
+
+    Return the (blob_id, parsed blob) pairs in the request order.
+    """
+    parsed_blobs = []
+    for i, blob in enumerate(blobs):
+        try:
+            parsed_blobs.append(blob.to_blob())
+        except pydantic.ValidationError as e:
+            return Promise.reject(CODE.BAD_REQUEST, f"Unable to parse blob {i}: {e}")
+    # Rows of one INSERT share the same now(), keep the request order explicitly
+    now = datetime.now(timezone.utc)
+    rows = [
+        {
+            "id": uuid.uuid4(),
+            "created_at": now + timedelta(microseconds=i),
+            "blob_type": str(blob_parsed.type),
+            "blob_data": blob_parsed.get_blob_data(),
+            "additional_fields": blob_parsed.fields,
+            "user_id": blob.user_id,
+            "project_id": project_id,
+        }
+        for i, (blob, blob_parsed) in enumerate(zip(blobs, parsed_blobs))
+    ]
+    async with AsyncSession() as session:
+        await session.execute(insert(GeneralBlob), rows)
+        await session.commit()
+    return Promise.resolve(
+        [(row["id"], blob_parsed) for row, blob_parsed in zip(rows, parsed_blobs)]
+    )
+
+
 async def get_blob(user_id: str, project_id: str, blob_id: str) -> Promise[BlobData]:
-    with Session() as session:
-        blob_db = (
-            session.query(GeneralBlob)
-            .filter_by(id=blob_id, user_id=user_id, project_id=project_id)
-            .one_or_none()
+    async with AsyncSession() as session:
+        blob_db = await session.scalar(
+            select(GeneralBlob).filter_by(
+                id=blob_id, user_id=user_id, project_id=project_id
+            )
         )
         if not blob_db:
             return Promise.reject(
@@ -47,15 +85,12 @@ async def get_blob(user_id: str, project_id: str, blob_id: str) -> Promise[BlobD
 
 
 async def remove_blob(user_id: str, project_id: str, blob_id: str) -> Promise[None]:
-    with Session() as session:
-        blob_db = (
-            session.query(GeneralBlob)
-            .filter_by(id=blob_id, user_id=user_id, project_id=project_id)
-            .one_or_none()
+    async with AsyncSession() as session:
+        # Its buffer is removed by the FK cascade
+        await session.execute(
+            delete(GeneralBlob).filter_by(
+                id=blob_id, user_id=user_id, project_id=project_id
+            )
         )
-        if not blob_db:
-            return Promise.resolve(None)
-        else:
-            session.delete(blob_db)
-            session.commit()
+        await session.commit()
     return Promise.resolve(None)
@@ -1,51 +1,113 @@
-from sqlalchemy import func
-from pydantic import BaseModel
+from uuid import UUID, uuid4
+from datetime import timedelta
+from sqlalchemy import func, insert, update, select, delete, exists, or_, Row
+from sqlalchemy.orm import aliased
 from ..env import CONFIG, LOG
 from ..utils import (
     get_blob_token_size,
     pack_blob_from_db,
-    seconds_from_now,
-    user_id_lock,
+    user_lock,
 )
 from ..models.utils import Promise
-from ..models.response import CODE, ChatModalResponse
+from ..models.response import CODE, ChatModalResponse, BufferInsertData
 from ..models.database import BufferZone, GeneralBlob
 from ..models.blob import BlobType, Blob
-from ..connectors import Session
+from ..connectors import AsyncSession
 from .modal import BLOBS_PROCESS
+from .flush_job import enqueue_flush_job
+from .buffer_summary import (
+    buffer_lock,
+    get_buffer_summary,
+    incr_buffer_summary,
+    reset_buffer_summary,
+)
 
 
-@user_id_lock("insert_blob_to_buffer")
 async def insert_blob_to_buffer(
     user_id: str, project_id: str, blob_id: str, blob_data: Blob
-) -> Promise[list[ChatModalResponse]]:
-    results = []
-    p = await detect_buffer_idle_or_not(user_id, project_id, blob_data.type)
-    if not p.ok():
-        return p
-    if p.data() is not None:
-        results.append(p.data())
-    with Session() as session:
-        buffer = BufferZone(
-            user_id=user_id,
-            blob_id=blob_id,
-            blob_type=blob_data.type,
-            token_size=get_blob_token_size(blob_data),
-            project_id=project_id,
+) -> Promise[BufferInsertData]:
+    return await insert_blobs_to_buffer(user_id, project_id, [(blob_id, blob_data)])
+
+
+async def insert_blobs_to_buffer(
+    user_id: str, project_id: str, blobs: list[tuple[str, Blob]]
+) -> Promise[BufferInsertData]:
+    """Buffer blobs of one user, the buffer is only evaluated once per blob type.
+
+    Inserts only hold the buffer lock for the insert itself, never while a
+    flush runs. The buffers are flushed in the order of their `seq`.
+    """
+    results = BufferInsertData()
+    blobs_by_type: dict[BlobType, list[tuple[str, Blob]]] = {}
+    for blob_id, blob_data in blobs:
+        blobs_by_type.setdefault(blob_data.type, []).append((blob_id, blob_data))
+
+    for blob_type, type_blobs in blobs_by_type.items():
+        p = await detect_buffer_idle_or_not(user_id, project_id, blob_type)
+        if not p.ok():
+            return p
+        if p.data():
+            p = await flush_or_enqueue(user_id, project_id, blob_type, results)
+            if not p.ok():
+                return p
+        rows = [
+            {
+                "id": uuid4(),
+                "user_id": user_id,
+                "blob_id": blob_id,
+                "blob_type": str(blob_type),
+                "token_size": get_blob_token_size(blob_data),
+                "project_id": project_id,
+            }
+            for blob_id, blob_data in type_blobs
+        ]
+        async with buffer_lock(user_id, project_id, blob_type):
+            async with AsyncSession() as session:
+                await session.execute(insert(BufferZone), rows)
+                await session.commit()
+
+            p = await incr_buffer_summary(
+                user_id,
+                project_id,
+                blob_type,
+                sum(r["token_size"] for r in rows),
+                blob_count=len(rows),
+            )
+        if not p.ok():
+            return p
+        p = await detect_buffer_full_or_not(
+            user_id, project_id, blob_type, buffer_size=p.data()
         )
-        session.add(buffer)
-        session.commit()
+        if not p.ok():
+            return p
+        if p.data():
+            p = await flush_or_enqueue(user_id, project_id, blob_type, results)
+            if not p.ok():
+                return p
+    return Promise.resolve(results)
+
 
-    p = await detect_buffer_full_or_not(user_id, project_id, blob_data.type)
+async def flush_or_enqueue(
+    user_id: str, project_id: str, blob_type: BlobType, results: BufferInsertData
+) -> Promise[None]:
+    if CONFIG.buffer_flush_in_background:
+        p = await enqueue_flush_job(user_id, project_id, blob_type)
+        if not p.ok():
+            return p
+        if p.data().id not in results.flush_job_ids:
+            results.flush_job_ids.append(p.data().id)
+        return Promise.resolve(None)
+    # Don't wait for a running flush, the buffers it didn't claim stay full
+    # and are flushed by the next insert
+    p = await flush_buffer(user_id, project_id, blob_type, wait=False)
     if not p.ok():
         return p
     if p.data() is not None:
-        results.append(p.data())
-    return Promise.resolve(results)
+        results.chat_results.append(p.data())
+    return Promise.resolve(None)
 
 
-# If there're ongoing insert, wait for them to finish then flush
-@user_id_lock("insert_blob_to_buffer")
+# Committed inserts are counted in by the claim, waits for a running flush
 async def wait_insert_done_then_flush(
     user_id: str, project_id: str, blob_type: BlobType
 ) -> Promise[list[ChatModalResponse]]:
@@ -60,89 +122,166 @@ async def wait_insert_done_then_flush(
 async def get_buffer_capacity(
     user_id: str, project_id: str, blob_type: BlobType
 ) -> Promise[int]:
-    with Session() as session:
-        buffer_count = (
-            session.query(BufferZone)
-            .filter_by(user_id=user_id, blob_type=str(blob_type), project_id=project_id)
-            .count()
-        )
-    return Promise.resolve(buffer_count)
+    p = await get_buffer_summary(user_id, project_id, blob_type)
+    if not p.ok():
+        return p
+    return Promise.resolve(p.data().blob_count)
 
 
 async def detect_buffer_full_or_not(
-    user_id: str, project_id: str, blob_type: BlobType
-) -> Promise[ChatModalResponse | None]:
-    with Session() as session:
-        # 1. if buffer size reach maximum, flush it
-        buffer_size = (
-            session.query(func.sum(BufferZone.token_size))
-            .filter_by(user_id=user_id, blob_type=str(blob_type), project_id=project_id)
-            .scalar()
-        )
-        if buffer_size and buffer_size > CONFIG.max_chat_blob_buffer_token_size:
-            LOG.info(
-                f"Flush {blob_type} buffer for user {user_id} due to reach maximum token size({buffer_size} > {CONFIG.max_chat_blob_buffer_token_size})"
-            )
-            p = await flush_buffer(user_id, project_id, blob_type)
+    user_id: str, project_id: str, blob_type: BlobType, buffer_size: int = None
+) -> Promise[bool]:
+    # 1. if buffer size reach maximum, flush it
+    if buffer_size is None:
+        p = await get_buffer_summary(user_id, project_id, blob_type, rebuild=True)
+        if not p.ok():
             return p
-    return Promise.resolve(None)
+        buffer_size = p.data().token_size
+    if buffer_size > CONFIG.max_chat_blob_buffer_token_size:
+        LOG.info(
+            f"Flush {blob_type} buffer for user {user_id} due to reach maximum token size({buffer_size} > {CONFIG.max_chat_blob_buffer_token_size})"
+        )
+        return Promise.resolve(True)
+    return Promise.resolve(False)
 
 
 async def detect_buffer_idle_or_not(
     user_id: str, project_id: str, blob_type: BlobType
-) -> Promise[ChatModalResponse | None]:
-    with Session() as session:
-        # if buffer is idle for a long time, flush it
-        last_buffer_update = (
-            session.query(func.max(BufferZone.created_at))
-            .filter_by(user_id=user_id, blob_type=str(blob_type), project_id=project_id)
-            .scalar()
+) -> Promise[bool]:
+    # if buffer is idle for a long time, flush it
+    p = await get_buffer_summary(user_id, project_id, blob_type, rebuild=True)
+    if not p.ok():
+        return p
+    if p.data().is_idle():
+        LOG.info(
+            f"Flush {blob_type} buffer for user {user_id} due to idle for a long time"
         )
-        if (
-            last_buffer_update
-            and seconds_from_now(last_buffer_update) > CONFIG.buffer_flush_interval
-        ):
-            LOG.info(
-                f"Flush {blob_type} buffer for user {user_id} due to idle for a long time"
-            )
-            p = await flush_buffer(user_id, project_id, blob_type)
-            return p
-    return Promise.resolve(None)
+        return Promise.resolve(True)
+    return Promise.resolve(False)
 
 
-async def flush_buffer(
+async def get_idle_buffers(limit: int) -> Promise[list[Row]]:
+    """Find the (user_id, project_id, blob_type) buffers that got no insert for
+    `buffer_flush_interval`, oldest first.
+    """
+    idle_before = func.now() - timedelta(seconds=CONFIG.buffer_flush_interval)
+    newer = aliased(BufferZone)
+    stmt = (
+        select(BufferZone.user_id, BufferZone.project_id, BufferZone.blob_type)
+        .where(
+            BufferZone.flush_id.is_(None),
+            BufferZone.created_at < idle_before,
+            ~exists().where(
+                newer.user_id == BufferZone.user_id,
+                newer.project_id == BufferZone.project_id,
+                newer.blob_type == BufferZone.blob_type,
+                newer.flush_id.is_(None),
+                newer.created_at >= idle_before,
+            ),
+        )
+        .group_by(BufferZone.user_id, BufferZone.project_id, BufferZone.blob_type)
+        .order_by(func.min(BufferZone.created_at))
+        .limit(limit)
+    )
+    async with AsyncSession() as session:
+        idle_buffers = (await session.execute(stmt)).all()
+    return Promise.resolve(idle_buffers)
+
+
+async def claim_buffer(
     user_id: str, project_id: str, blob_type: BlobType
+) -> Promise[tuple[UUID, list[Row]]]:
+    """Atomically mark the unclaimed buffers of this user with a new flush id.
+
+    Concurrent claims never return the same rows: Postgres re-checks the WHERE
+    clause after waiting on row locks. Claims older than `flush_job_timeout`
+    belong to a dead flush and can be taken over. The claim and the summary
+    reset hold the buffer lock, so a summary rebuild can't count the claimed
+    buffers back in. Return the buffers in insert order.
+    """
+    flush_id = uuid4()
+    stale_before = func.now() - timedelta(seconds=CONFIG.flush_job_timeout)
+    stmt = (
+        update(BufferZone)
+        .where(
+            BufferZone.user_id == user_id,
+            BufferZone.project_id == project_id,
+            BufferZone.blob_type == str(blob_type),
+            or_(
+                BufferZone.flush_id.is_(None),
+                BufferZone.updated_at < stale_before,
+            ),
+        )
+        .values(flush_id=flush_id)
+        .returning(
+            BufferZone.id,
+            BufferZone.blob_id,
+            BufferZone.token_size,
+            BufferZone.seq,
+        )
+    )
+    async with buffer_lock(user_id, project_id, blob_type):
+        async with AsyncSession() as session:
+            blob_buffers = (await session.execute(stmt)).all()
+            await session.commit()
+        # The claimed buffers left the summary, rebuild it on the next insert
+        await reset_buffer_summary(user_id, project_id, blob_type)
+    blob_buffers = sorted(blob_buffers, key=lambda b: b.seq)
+    return Promise.resolve((flush_id, blob_buffers))
+
+
+async def flush_buffer(
+    user_id: str, project_id: str, blob_type: BlobType, wait: bool = True
 ) -> Promise[ChatModalResponse]:
-    # FIXME: parallel calling will cause duplicated flush
+    """Claim and process the buffers of this user.
+
+    The flushes of a user run one at a time, so their profile updates don't
+    interleave. Without `wait`, return None if another flush is running.
+    """
     if blob_type not in BLOBS_PROCESS:
         return Promise.reject(CODE.BAD_REQUEST, f"Blob type {blob_type} not supported")
-    with Session() as session:
-        blob_buffers_trans = session.query(BufferZone).filter_by(
-            user_id=user_id, blob_type=str(blob_type), project_id=project_id
-        )
-
-        # Move this outside try-finally to ensure we have the data before proceeding
-        blob_buffers = blob_buffers_trans.order_by(BufferZone.created_at).all()
-        if not blob_buffers:
-            LOG.info(f"No {blob_type} buffer to flush for user {user_id}")
+    async with user_lock(
+        user_id, project_id, "flush_buffer", blocking=wait
+    ) as acquired:
+        if not acquired:
+            LOG.info(f"Another {blob_type} flush is running for user {user_id}")
             return Promise.resolve(None)
+        return await flush_claimed_buffer(user_id, project_id, blob_type)
 
-        blob_ids = [b.blob_id for b in blob_buffers]
-        total_token_size = sum(b.token_size for b in blob_buffers)
-        LOG.info(
-            f"Flush {blob_type} buffer for user {user_id} with {len(blob_buffers)} blobs and total token size({total_token_size})"
-        )
+
+async def flush_claimed_buffer(
+    user_id: str, project_id: str, blob_type: BlobType
+) -> Promise[ChatModalResponse]:
+    p = await claim_buffer(user_id, project_id, blob_type)
+    if not p.ok():
+        return p
+    flush_id, blob_buffers = p.data()
+    if not blob_buffers:
+        LOG.info(f"No {blob_type} buffer to flush for user {user_id}")
+        return Promise.resolve(None)
+
+    blob_ids = [b.blob_id for b in blob_buffers]
+    total_token_size = sum(b.token_size for b in blob_buffers)
+    LOG.info(
+        f"Flush {blob_type} buffer for user {user_id} with {len(blob_buffers)} blobs and total token size({total_token_size})"
+    )
 
     try:
-        with Session() as session:
+        async with AsyncSession() as session:
             # Get and process blob data
             blob_data = (
-                session.query(GeneralBlob.created_at, GeneralBlob.blob_data)
-                .filter(
-                    GeneralBlob.id.in_(blob_ids), GeneralBlob.project_id == project_id
+                await session.execute(
+                    select(
+                        GeneralBlob.id, GeneralBlob.created_at, GeneralBlob.blob_data
+                    ).filter(
+                        GeneralBlob.id.in_(blob_ids),
+                        GeneralBlob.project_id == project_id,
+                    )
                 )
-                .all()
-            )
+            ).all()
+            # In the insert order of the claimed buffers
+            insert_order = {blob_id: i for i, blob_id in enumerate(blob_ids)}
+            blob_data = sorted(blob_data, key=lambda bd: insert_order[bd.id])
             blobs = [pack_blob_from_db(bd, blob_type) for bd in blob_data]
 
         # Process blobs first (moved outside the session)
@@ -156,23 +295,28 @@ async def flush_buffer(
         raise e
 
     finally:
-        with Session() as session:
+        async with AsyncSession() as session:
             try:
                 # Delete buffers and blobs regardless of processing outcome
-
-                session.query(BufferZone).filter_by(
-                    user_id=user_id, blob_type=str(blob_type), project_id=project_id
-                ).delete(synchronize_session=False)
+                # Only the claimed buffers, inserts may land while processing
+                await session.execute(
+                    delete(BufferZone).where(
+                        BufferZone.flush_id == flush_id,
+                        BufferZone.project_id == project_id,
+                    )
+                )
                 if blob_type == BlobType.chat and not CONFIG.persistent_chat_blobs:
-                    session.query(GeneralBlob).filter(
-                        GeneralBlob.id.in_(blob_ids),
-                        GeneralBlob.project_id == project_id,
-                    ).delete(synchronize_session=False)
-                session.commit()
+                    await session.execute(
+                        delete(GeneralBlob).where(
+                            GeneralBlob.id.in_(blob_ids),
+                            GeneralBlob.project_id == project_id,
+                        )
+                    )
+                await session.commit()
                 LOG.info(
                     f"Flushed {blob_type} buffer(size: {len(blob_buffers)}) for user {user_id}"
                 )
             except Exception as e:
-                session.rollback()
+                await session.rollback()
                 LOG.error(f"Error while deleting buffers/blobs: {e}")
                 raise e
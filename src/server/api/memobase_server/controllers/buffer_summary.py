@@ -0,0 +1,164 @@
+import time
+from dataclasses import dataclass
+from sqlalchemy import func, select
+from ..env import CONFIG
+from ..utils import user_lock
+from ..models.utils import Promise
+from ..models.database import BufferZone
+from ..models.blob import BlobType
+from ..connectors import AsyncSession, get_redis_client
+
+BUFFER_SUMMARY_TTL = 60 * 60 * 24 * 7  # 7 days
+# The buffer lock is only held for a few queries, never for a flush
+BUFFER_LOCK_TIMEOUT = 10
+BUFFER_LOCK_BLOCKING_TIMEOUT = 10
+
+# Only touch an existing summary. A missing one is rebuilt from the DB on the
+# next read with `rebuild`, so an increment racing with a reset is dropped
+# instead of creating a summary that only counts part of the buffer.
+INCR_SUMMARY_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return nil
+end
+redis.call('HINCRBY', KEYS[1], 'token_size', ARGV[1])
+redis.call('HINCRBY', KEYS[1], 'blob_count', ARGV[2])
+redis.call('HSET', KEYS[1], 'last_insert_at', ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return redis.call('HGET', KEYS[1], 'token_size')
+"""
+
+
+@dataclass
+class BufferSummary:
+    token_size: int = 0
+    blob_count: int = 0
+    last_insert_at: float | None = None
+
+    def is_idle(self) -> bool:
+        return (
+            self.blob_count > 0
+            and self.last_insert_at is not None
+            and time.time() - self.last_insert_at > CONFIG.buffer_flush_interval
+        )
+
+    def is_full(self) -> bool:
+        return self.token_size > CONFIG.max_chat_blob_buffer_token_size
+
+
+def buffer_summary_key(user_id: str, project_id: str, blob_type: BlobType) -> str:
+    return f"memobase::buffer_summary::{project_id}::{user_id}::{blob_type}"
+
+
+def buffer_lock(user_id: str, project_id: str, blob_type: BlobType):
+    """Serialize the changes to the buffer of one user with its summary: an
+    insert and its increment, a claim and its reset, and summary rebuilds."""
+    return user_lock(
+        user_id,
+        project_id,
+        f"buffer::{blob_type}",
+        lock_timeout=BUFFER_LOCK_TIMEOUT,
+        blocking_timeout=BUFFER_LOCK_BLOCKING_TIMEOUT,
+    )
+
+
+async def load_buffer_summary_from_db(
+    user_id: str, project_id: str, blob_type: BlobType
+) -> BufferSummary:
+    async with AsyncSession() as session:
+        token_size, blob_count, last_insert_at = (
+            await session.execute(
+                select(
+                    func.coalesce(func.sum(BufferZone.token_size), 0),
+                    func.count(BufferZone.id),
+                    func.max(BufferZone.created_at),
+                ).where(
+                    BufferZone.user_id == user_id,
+                    BufferZone.blob_type == str(blob_type),
+                    BufferZone.project_id == project_id,
+                    BufferZone.flush_id.is_(None),
+                )
+            )
+        ).one()
+    return BufferSummary(
+        token_size=int(token_size),
+        blob_count=int(blob_count),
+        last_insert_at=last_insert_at.timestamp() if last_insert_at else None,
+    )
+
+
+async def read_buffer_summary(
+    user_id: str, project_id: str, blob_type: BlobType
+) -> BufferSummary | None:
+    async with get_redis_client() as redis_client:
+        cached = await redis_client.hgetall(
+            buffer_summary_key(user_id, project_id, blob_type)
+        )
+    if not cached:
+        return None
+    last_insert_at = cached.get("last_insert_at")
+    return BufferSummary(
+        token_size=int(cached.get("token_size", 0)),
+        blob_count=int(cached.get("blob_count", 0)),
+        last_insert_at=float(last_insert_at) if last_insert_at else None,
+    )
+
+
+async def get_buffer_summary(
+    user_id: str, project_id: str, blob_type: BlobType, rebuild: bool = False
+) -> Promise[BufferSummary]:
+    """Read the running buffer summary, fallback to the DB when it's missing.
+
+    With `rebuild`, the DB read is cached under the buffer lock, so no insert
+    or claim lands between the DB read and the cache write. Callers must not
+    hold the buffer lock themselves.
+    """
+    summary = await read_buffer_summary(user_id, project_id, blob_type)
+    if summary is not None:
+        return Promise.resolve(summary)
+    if not rebuild:
+        summary = await load_buffer_summary_from_db(user_id, project_id, blob_type)
+        return Promise.resolve(summary)
+    async with buffer_lock(user_id, project_id, blob_type):
+        # Another rebuild may have finished while waiting for the lock
+        summary = await read_buffer_summary(user_id, project_id, blob_type)
+        if summary is not None:
+            return Promise.resolve(summary)
+        summary = await load_buffer_summary_from_db(user_id, project_id, blob_type)
+        mapping = {
+            "token_size": summary.token_size,
+            "blob_count": summary.blob_count,
+        }
+        if summary.last_insert_at is not None:
+            mapping["last_insert_at"] = summary.last_insert_at
+        key = buffer_summary_key(user_id, project_id, blob_type)
+        async with get_redis_client() as redis_client:
+            async with redis_client.pipeline(transaction=True) as pipe:
+                pipe.hset(key, mapping=mapping)
+                pipe.expire(key, BUFFER_SUMMARY_TTL)
+                await pipe.execute()
+    return Promise.resolve(summary)
+
+
+async def incr_buffer_summary(
+    user_id: str,
+    project_id: str,
+    blob_type: BlobType,
+    token_size: int,
+    blob_count: int = 1,
+) -> Promise[int | None]:
+    """Count new buffers in, return the new total token size if tracked"""
+    async with get_redis_client() as redis_client:
+        incr_script = redis_client.register_script(INCR_SUMMARY_SCRIPT)
+        total = await incr_script(
+            keys=[buffer_summary_key(user_id, project_id, blob_type)],
+            args=[token_size, blob_count, time.time(), BUFFER_SUMMARY_TTL],
+        )
+    return Promise.resolve(int(total) if total is not None else None)
+
+
+async def reset_buffer_summary(
+    user_id: str, project_id: str, blob_type: BlobType
+) -> Promise[None]:
+    async with get_redis_client() as redis_client:
+        await redis_client.delete(buffer_summary_key(user_id, project_id, blob_type))
+    return Promise.resolve(None)
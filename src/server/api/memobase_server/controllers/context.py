@@ -1,12 +1,28 @@
+import asyncio
 from ..models.utils import Promise
-from ..models.response import ContextData, OpenAICompatibleMessage
+from ..models.response import (
+    ContextData,
+    OpenAICompatibleMessage,
+    ProfileData,
+    UserEventsData,
+)
 from ..prompts.chat_context_pack import CONTEXT_PROMPT_PACK
-from ..utils import get_encoded_tokens, event_str_repr
+from ..utils import event_str_repr
 from ..env import CONFIG, LOG
-from .project import get_project_profile_config
-from .profile import get_user_profiles, truncate_profiles
+from .project_config import get_project_config
+from .profile import get_user_profiles, truncate_profiles, profile_data_token_size
 from .post_process.profile import filter_profiles_with_chats
-from .event import get_user_events, search_user_events, truncate_events
+from .event import (
+    get_user_events,
+    search_user_events,
+    truncate_events,
+    user_event_token_size,
+)
+
+
+# Events fetched for the context before the token budget is known, the ones
+# over the budget left by the profiles are truncated
+CONTEXT_EVENT_TOPK = 20
 
 
 async def get_user_context(
@@ -22,45 +38,41 @@ async def get_user_context(
     chats: list[OpenAICompatibleMessage],
     event_similarity_threshold: float,
 ) -> Promise[ContextData]:
+    """Pack the profiles and events of the user into the context prompt.
+
+    The profiles and the events are fetched concurrently, the events get the
+    tokens left by the profiles once both are done.
+    """
     assert 0 < profile_event_ratio <= 1, "profile_event_ratio must be between 0 and 1"
     max_profile_token_size = int(max_token_size * profile_event_ratio)
-    # max_event_token_size = max_token_size - max_profile_token_size
-
-    p = await get_project_profile_config(project_id)
-    if not p.ok():
-        return p
-    profile_config = p.data()
-    use_language = profile_config.language or CONFIG.language
-    context_prompt_func = CONTEXT_PROMPT_PACK[use_language]
-
-    p = await get_user_profiles(user_id, project_id)
-    if not p.ok():
-        return p
-    total_profiles = p.data()
-    if max_profile_token_size > 0:
-        if chats:
-            p = await filter_profiles_with_chats(
-                project_id,
-                total_profiles,
-                chats,
-                only_topics=only_topics,
-                # max_filter_num=topk,
-            )
-            if p.ok():
-                total_profiles.profiles = p.data()
-        user_profiles = total_profiles
-        use_profiles = await truncate_profiles(
-            user_profiles,
-            prefer_topics=prefer_topics,
-            only_topics=only_topics,
-            max_token_size=max_profile_token_size,
-            max_subtopic_size=max_subtopic_size,
-            topic_limits=topic_limits,
-        )
-        if not use_profiles.ok():
-            return use_profiles
-        use_profiles = use_profiles.data().profiles
 
+    config_p, profiles_p, events_p = await asyncio.gather(
+        get_project_config(project_id),
+        get_context_profiles(
+            user_id,
+            project_id,
+            max_profile_token_size,
+            prefer_topics,
+            only_topics,
+            max_subtopic_size,
+            topic_limits,
+            chats,
+        ),
+        get_context_events(
+            user_id,
+            project_id,
+            require_event_summary,
+            chats,
+            event_similarity_threshold,
+        ),
+    )
+    if not config_p.ok():
+        return config_p
+    context_prompt_func = CONTEXT_PROMPT_PACK[config_p.data().language]
+    if not profiles_p.ok():
+        return profiles_p
+    use_profiles = profiles_p.data()
+    if len(use_profiles):
         profile_section = "- " + "\n- ".join(
             [
                 f"{p.attributes.get('topic')}::{p.attributes.get('sub_topic')}: {p.content}"
@@ -70,42 +82,92 @@ async def get_user_context(
     else:
         profile_section = ""
 
-    profile_section_tokens = len(get_encoded_tokens(profile_section))
+    # Sum the stored token sizes, plus about one token for each "- " bullet
+    profile_section_tokens = sum(
+        profile_data_token_size(p) + 1 for p in use_profiles
+    )
     max_event_token_size = max_token_size - profile_section_tokens
     if max_event_token_size <= 0:
         return Promise.resolve(
             ContextData(context=context_prompt_func(profile_section, ""))
         )
 
-    # max 40 events, then truncate to max_event_token_size
-    if chats and CONFIG.enable_event_embedding:
-        search_query = chats[-1].content
-        p = await search_user_events(
-            user_id,
-            project_id,
-            query=search_query,
-            topk=20,
-            similarity_threshold=event_similarity_threshold,
-        )
-    else:
-        p = await get_user_events(
-            user_id,
-            project_id,
-            topk=20,
-            need_summary=require_event_summary,
-        )
-    if not p.ok():
-        return p
-    user_events = p.data()
-    p = await truncate_events(user_events, max_event_token_size)
+    if not events_p.ok():
+        return events_p
+    p = await truncate_events(events_p.data(), max_event_token_size)
     if not p.ok():
         return p
     user_events = p.data()
     event_section = "\n---\n".join([event_str_repr(ed) for ed in user_events.events])
-    event_section_tokens = len(get_encoded_tokens(event_section))
+    event_section_tokens = sum(
+        user_event_token_size(ed) for ed in user_events.events
+    )
     LOG.info(
         f"Retrived {len(use_profiles)} profiles({profile_section_tokens} tokens), {len(user_events.events)} events({event_section_tokens} tokens)"
     )
     return Promise.resolve(
         ContextData(context=context_prompt_func(profile_section, event_section))
     )
+
+
+async def get_context_profiles(
+    user_id: str,
+    project_id: str,
+    max_profile_token_size: int,
+    prefer_topics: list[str],
+    only_topics: list[str],
+    max_subtopic_size: int,
+    topic_limits: dict[str, int],
+    chats: list[OpenAICompatibleMessage],
+) -> Promise[list[ProfileData]]:
+    if max_profile_token_size <= 0:
+        return Promise.resolve([])
+    p = await get_user_profiles(user_id, project_id)
+    if not p.ok():
+        return p
+    user_profiles = p.data()
+    if chats:
+        p = await filter_profiles_with_chats(
+            user_id,
+            project_id,
+            user_profiles,
+            chats,
+            only_topics=only_topics,
+            # max_filter_num=topk,
+        )
+        if p.ok():
+            user_profiles.profiles = p.data()
+    p = await truncate_profiles(
+        user_profiles,
+        prefer_topics=prefer_topics,
+        only_topics=only_topics,
+        max_token_size=max_profile_token_size,
+        max_subtopic_size=max_subtopic_size,
+        topic_limits=topic_limits,
+    )
+    if not p.ok():
+        return p
+    return Promise.resolve(p.data().profiles)
+
+
+async def get_context_events(
+    user_id: str,
+    project_id: str,
+    require_event_summary: bool,
+    chats: list[OpenAICompatibleMessage],
+    event_similarity_threshold: float,
+) -> Promise[UserEventsData]:
+    if chats and CONFIG.enable_event_embedding:
+        return await search_user_events(
+            user_id,
+            project_id,
+            query=chats[-1].content,
+            topk=CONTEXT_EVENT_TOPK,
+            similarity_threshold=event_similarity_threshold,
+        )
+    return await get_user_events(
+        user_id,
+        project_id,
+        topk=CONTEXT_EVENT_TOPK,
+        need_summary=require_event_summary,
+    )
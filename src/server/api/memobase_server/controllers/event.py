@@ -2,12 +2,12 @@ from pydantic import ValidationError
 from ..models.database import UserEvent
 from ..models.response import UserEventData, UserEventsData, EventData
 from ..models.utils import Promise, CODE
-from ..connectors import Session
-from ..utils import get_encoded_tokens, event_str_repr, event_embedding_str
+from ..connectors import AsyncSession
+from ..utils import event_embedding_str, event_token_size
 
 from ..llms.embeddings import get_embedding
 from datetime import timedelta
-from sqlalchemy import desc, select
+from sqlalchemy import select, delete, text, true
 from sqlalchemy.sql import func
 from ..env import LOG, CONFIG
 
@@ -18,15 +18,17 @@ async def get_user_events(
     topk: int = 10,
     need_summary: bool = False,
 ) -> Promise[UserEventsData]:
-    with Session() as session:
-        query = session.query(UserEvent).filter_by(
-            user_id=user_id, project_id=project_id
-        )
+    async with AsyncSession() as session:
+        query = select(UserEvent).filter_by(user_id=user_id, project_id=project_id)
         if need_summary:
             query = query.filter(
                 UserEvent.event_data.contains({"event_tip": None}).is_(False)
             ).filter(UserEvent.event_data.has_key("event_tip"))
-        user_events = query.order_by(UserEvent.created_at.desc()).limit(topk).all()
+        user_events = (
+            await session.scalars(
+                query.order_by(UserEvent.created_at.desc()).limit(topk)
+            )
+        ).all()
         if user_events is None:
             return Promise.reject(
                 CODE.NOT_FOUND,
@@ -38,6 +40,7 @@ async def get_user_events(
                 "event_data": ue.event_data,
                 "created_at": ue.created_at,
                 "updated_at": ue.updated_at,
+                "token_size": ue.token_size,
             }
             for ue in user_events
         ]
@@ -54,7 +57,7 @@ async def truncate_events(
     c_tokens = 0
     truncated_results = []
     for r in events.events:
-        c_tokens += len(get_encoded_tokens(event_str_repr(r)))
+        c_tokens += user_event_token_size(r)
         if c_tokens > max_token_size:
             break
         truncated_results.append(r)
@@ -62,6 +65,12 @@ async def truncate_events(
     return Promise.resolve(events)
 
 
+def user_event_token_size(event: UserEventData) -> int:
+    if event.token_size is not None:
+        return event.token_size
+    return event_token_size(event.event_data)
+
+
 async def append_user_event(
     user_id: str, project_id: str, event_data: dict
 ) -> Promise[str]:
@@ -96,15 +105,16 @@ async def append_user_event(
     else:
         embedding = [None]
 
-    with Session() as session:
+    async with AsyncSession() as session:
         user_event = UserEvent(
             user_id=user_id,
             project_id=project_id,
             event_data=validated_event.model_dump(),
             embedding=embedding[0],
+            token_size=event_token_size(validated_event),
         )
         session.add(user_event)
-        session.commit()
+        await session.commit()
         eid = user_event.id
     return Promise.resolve(eid)
 
@@ -112,19 +122,18 @@ async def append_user_event(
 async def delete_user_event(
     user_id: str, project_id: str, event_id: str
 ) -> Promise[None]:
-    with Session() as session:
-        user_event = (
-            session.query(UserEvent)
-            .filter_by(user_id=user_id, project_id=project_id, id=event_id)
-            .first()
+    async with AsyncSession() as session:
+        result = await session.execute(
+            delete(UserEvent).filter_by(
+                user_id=user_id, project_id=project_id, id=event_id
+            )
         )
-        if user_event is None:
+        if result.rowcount == 0:
             return Promise.reject(
                 CODE.NOT_FOUND,
                 f"User event {event_id} not found",
             )
-        session.delete(user_event)
-        session.commit()
+        await session.commit()
     return Promise.resolve(None)
 
 
@@ -139,11 +148,11 @@ async def update_user_event(
             f"Invalid event data: {str(e)}",
         )
     need_to_update = {k: v for k, v in event_data.items() if v is not None}
-    with Session() as session:
-        user_event = (
-            session.query(UserEvent)
-            .filter_by(user_id=user_id, project_id=project_id, id=event_id)
-            .first()
+    async with AsyncSession() as session:
+        user_event = await session.scalar(
+            select(UserEvent).filter_by(
+                user_id=user_id, project_id=project_id, id=event_id
+            )
         )
         if user_event is None:
             return Promise.reject(
@@ -154,7 +163,8 @@ async def update_user_event(
         new_events.update(need_to_update)
 
         user_event.event_data = new_events
-        session.commit()
+        user_event.token_size = event_token_size(EventData(**new_events))
+        await session.commit()
     return Promise.resolve(None)
 
 
@@ -180,39 +190,73 @@ async def search_user_events(
         return query_embeddings
     query_embedding = query_embeddings.data()[0]
 
-    stmt = (
+    # Take the k nearest first so the planner can walk the HNSW index, the
+    # similarity threshold only filters those k. Materialized, so the
+    # threshold doesn't make an iterative scan look for more candidates
+    distance = UserEvent.embedding.cosine_distance(query_embedding)
+    nearest = (
         select(
-            UserEvent,
-            (1 - UserEvent.embedding.cosine_distance(query_embedding)).label(
-                "similarity"
-            ),
+            UserEvent.id,
+            UserEvent.event_data,
+            UserEvent.created_at,
+            UserEvent.updated_at,
+            UserEvent.token_size,
+            distance.label("distance"),
         )
         .where(UserEvent.user_id == user_id, UserEvent.project_id == project_id)
         .where(UserEvent.created_at > func.now() - timedelta(days=time_range_in_days))
-        .where(
-            (1 - UserEvent.embedding.cosine_distance(query_embedding))
-            > similarity_threshold
-        )
-        .order_by(desc("similarity"))
+        .order_by(distance)
         .limit(topk)
+        .cte("nearest")
+        .prefix_with("MATERIALIZED")
+    )
+    passed = (
+        select(nearest)
+        .where(1 - nearest.c.distance > similarity_threshold)
+        .subquery()
+    )
+    candidates = (
+        select(func.count().label("candidates")).select_from(nearest).subquery()
+    )
+    # One row with the candidate count even if none passes the threshold
+    stmt = (
+        select(candidates.c.candidates, passed)
+        .select_from(candidates.outerjoin(passed, true()))
+        .order_by(passed.c.distance)
     )
 
-    with Session() as session:
-        # Use .all() instead of .scalars().all() to get both columns
-        result = session.execute(stmt).all()
-        user_events: list[UserEventData] = []
-        for row in result:
-            user_event: UserEvent = row[0]  # UserEvent object
-            similarity: float = row[1]  # similarity value
-            user_events.append(
-                UserEventData(
-                    id=user_event.id,
-                    event_data=user_event.event_data,
-                    created_at=user_event.created_at,
-                    updated_at=user_event.updated_at,
-                    similarity=similarity,
+    async with AsyncSession() as session:
+        await session.execute(
+            text(f"SET LOCAL hnsw.ef_search = {int(CONFIG.event_search_ef_search)}")
+        )
+        if CONFIG.event_search_iterative_scan is not None:
+            await session.execute(
+                text(
+                    f"SET LOCAL hnsw.iterative_scan = {CONFIG.event_search_iterative_scan}"
                 )
             )
+        result = (await session.execute(stmt)).all()
+        if (
+            CONFIG.event_search_iterative_scan is None
+            and result[0].candidates < topk
+        ):
+            # Without iterative scan, the user filter drops candidates after
+            # the scan of the index shared by all users. Rank the user's
+            # events exactly
+            await session.execute(text("SET LOCAL enable_indexscan = off"))
+            result = (await session.execute(stmt)).all()
+        user_events: list[UserEventData] = [
+            UserEventData(
+                id=row.id,
+                event_data=row.event_data,
+                created_at=row.created_at,
+                updated_at=row.updated_at,
+                similarity=1 - row.distance,
+                token_size=row.token_size,
+            )
+            for row in result
+            if row.id is not None
+        ]
 
         # Create UserEventsData with the events
         user_events_data = UserEventsData(events=user_events)
@@ -0,0 +1,190 @@
+import uuid
+from datetime import timedelta
+from sqlalchemy import select, update, or_, and_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql import func
+from ..env import CONFIG, LOG, FlushJobStatus
+from ..models.utils import Promise
+from ..models.response import CODE, IdData, FlushJobData, ChatModalResponse
+from ..models.database import BufferFlushJob
+from ..models.blob import BlobType
+from ..connectors import AsyncSession
+
+
+async def enqueue_flush_job(
+    user_id: str, project_id: str, blob_type: BlobType
+) -> Promise[IdData]:
+    """Queue a flush of the buffer, or return the job already pending for it.
+
+    A pending job will flush everything in the buffer once it starts, so
+    there is no need to queue another one. The unique index on pending jobs
+    keeps concurrent enqueues to one job.
+    """
+    job_id = uuid.uuid4()
+    async with AsyncSession() as session:
+        inserted_id = await session.scalar(
+            insert(BufferFlushJob)
+            .values(
+                id=job_id,
+                user_id=user_id,
+                project_id=project_id,
+                blob_type=str(blob_type),
+                status=FlushJobStatus.pending,
+                attempts=0,
+            )
+            .on_conflict_do_nothing(
+                index_elements=["user_id", "project_id", "blob_type"],
+                index_where=BufferFlushJob.status == FlushJobStatus.pending,
+            )
+            .returning(BufferFlushJob.id)
+        )
+        if inserted_id is None:
+            pending_job_id = await session.scalar(
+                select(BufferFlushJob.id)
+                .filter_by(
+                    user_id=user_id,
+                    project_id=project_id,
+                    blob_type=str(blob_type),
+                    status=FlushJobStatus.pending,
+                )
+                .limit(1)
+            )
+            if pending_job_id is not None:
+                return Promise.resolve(IdData(id=pending_job_id))
+            # The pending job was claimed in between, queue ours
+            return await enqueue_flush_job(user_id, project_id, blob_type)
+        await session.commit()
+    LOG.info(f"Enqueue {blob_type} flush job {job_id} for user {user_id}")
+    return Promise.resolve(IdData(id=job_id))
+
+
+async def claim_flush_job() -> Promise[dict | None]:
+    """Pick the oldest runnable job and mark it as processing.
+
+    Jobs stuck in processing for longer than `flush_job_timeout` are treated as
+    abandoned by a dead worker and can be claimed again. Retried jobs wait
+    until their `run_after`.
+    """
+    async with AsyncSession() as session:
+        stale_before = func.now() - timedelta(seconds=CONFIG.flush_job_timeout)
+        job = await session.scalar(
+            select(BufferFlushJob)
+            .filter(
+                or_(
+                    and_(
+                        BufferFlushJob.status == FlushJobStatus.pending,
+                        or_(
+                            BufferFlushJob.run_after.is_(None),
+                            BufferFlushJob.run_after <= func.now(),
+                        ),
+                    ),
+                    and_(
+                        BufferFlushJob.status == FlushJobStatus.processing,
+                        BufferFlushJob.updated_at < stale_before,
+                    ),
+                )
+            )
+            .order_by(BufferFlushJob.created_at)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        )
+        if job is None:
+            return Promise.resolve(None)
+        if job.attempts >= CONFIG.flush_job_max_attempts:
+            job.status = FlushJobStatus.failed
+            job.error = f"Job exceeds max attempts({CONFIG.flush_job_max_attempts})"
+            await session.commit()
+            return Promise.resolve(None)
+        job.status = FlushJobStatus.processing
+        job.attempts += 1
+        claimed = {
+            "id": job.id,
+            "user_id": job.user_id,
+            "project_id": job.project_id,
+            "blob_type": BlobType(job.blob_type),
+        }
+        await session.commit()
+    return Promise.resolve(claimed)
+
+
+async def finish_flush_job(
+    job_id: str,
+    project_id: str,
+    result: ChatModalResponse | None = None,
+    error: str | None = None,
+) -> Promise[None]:
+    async with AsyncSession() as session:
+        job = await session.scalar(
+            select(BufferFlushJob).filter_by(id=job_id, project_id=project_id)
+        )
+        if job is None:
+            return Promise.reject(CODE.NOT_FOUND, f"Flush job {job_id} not found")
+        if error is not None:
+            job.status = FlushJobStatus.failed
+            job.error = error
+        else:
+            job.status = FlushJobStatus.done
+            job.result = result.model_dump(mode="json") if result else None
+        await session.commit()
+    return Promise.resolve(None)
+
+
+async def retry_flush_job(job_id: str, project_id: str) -> Promise[None]:
+    """Put a job blocked by another flush of the user back to pending, to be
+    claimed again after `flush_job_retry_delay`.
+
+    Nothing failed, so the claim doesn't count as an attempt.
+    """
+    async with AsyncSession() as session:
+        job = await session.scalar(
+            select(BufferFlushJob).filter_by(id=job_id, project_id=project_id)
+        )
+        if job is None:
+            return Promise.reject(CODE.NOT_FOUND, f"Flush job {job_id} not found")
+        job.status = FlushJobStatus.pending
+        job.attempts = max(job.attempts - 1, 0)
+        job.run_after = func.now() + timedelta(seconds=CONFIG.flush_job_retry_delay)
+        try:
+            await session.commit()
+        except IntegrityError:
+            # Another job of the buffer is pending and flushes it in our place
+            await session.rollback()
+            await session.execute(
+                update(BufferFlushJob)
+                .filter_by(id=job_id, project_id=project_id)
+                .values(status=FlushJobStatus.done)
+            )
+            await session.commit()
+            LOG.info(f"Flush job {job_id} is superseded by a pending job")
+    return Promise.resolve(None)
+
+
+async def get_flush_job(
+    user_id: str, project_id: str, job_id: str
+) -> Promise[FlushJobData]:
+    async with AsyncSession() as session:
+        job = await session.scalar(
+            select(BufferFlushJob).filter_by(
+                id=job_id, user_id=user_id, project_id=project_id
+            )
+        )
+        if job is None:
+            return Promise.reject(
+                CODE.NOT_FOUND, f"Flush job {job_id} of user {user_id} not found"
+            )
+        return Promise.resolve(
+            FlushJobData(
+                id=job.id,
+                blob_type=job.blob_type,
+                status=job.status,
+                chat_results=(
+                    ([job.result] if job.result else [])
+                    if job.status == FlushJobStatus.done
+                    else None
+                ),
+                error=job.error,
+                created_at=job.created_at,
+                updated_at=job.updated_at,
+            )
+        )
@@ -6,3 +6,5 @@ from . import project
 from . import event
 from . import context
 from . import billing
+from . import flush_job
+from . import buffer_summary
@@ -10,9 +10,8 @@ from ....prompts.utils import (
     parse_string_into_profiles,
     parse_string_into_merge_action,
 )
-from ....prompts.profile_init_utils import read_out_profile_config, UserProfileTopic
 from ...profile import get_user_profiles
-from ...project import get_project_profile_config
+from ...project_config import get_project_config
 
 # from ...project impor
 from .types import FactResponse, PROMPTS
@@ -36,27 +35,15 @@ async def extract_topics(
     if not p.ok():
         return p
     profiles = p.data().profiles
-    p = await get_project_profile_config(project_id)
+    p = await get_project_config(project_id)
     if not p.ok():
         return p
-    project_profiles = p.data()
-    USE_LANGUAGE = project_profiles.language or CONFIG.language
-    STRICT_MODE = (
-        project_profiles.profile_strict_mode
-        if project_profiles.profile_strict_mode is not None
-        else CONFIG.profile_strict_mode
-    )
-
-    project_profiles_slots = read_out_profile_config(
-        project_profiles, PROMPTS[USE_LANGUAGE]["profile"].CANDIDATE_PROFILE_TOPICS
-    )
-    if STRICT_MODE:
-        allowed_topic_subtopics = set()
-        for p in project_profiles_slots:
-            for st in p.sub_topics:
-                allowed_topic_subtopics.add(
-                    (attribute_unify(p.topic), attribute_unify(st["name"]))
-                )
+    project_config = p.data()
+    project_profiles = project_config.config
+    USE_LANGUAGE = project_config.language
+    STRICT_MODE = project_config.strict_mode
+    project_profiles_slots = project_config.profile_slots
+    allowed_topic_subtopics = project_config.allowed_topic_subtopics
 
     if len(profiles):
         already_topics_subtopics = set(
@@ -92,8 +79,8 @@ async def extract_topics(
             user_memo,
             strict_mode=STRICT_MODE,
         ),
-        system_prompt=PROMPTS[USE_LANGUAGE]["doc_extract"].get_prompt(
-            PROMPTS[USE_LANGUAGE]["profile"].get_prompt(project_profiles_slots)
+        system_prompt=project_config.system_prompt(
+            PROMPTS[USE_LANGUAGE]["doc_extract"], project_config.profile_topics_prompt
         ),
         temperature=0.2,  # precise
         **PROMPTS[USE_LANGUAGE]["doc_extract"].get_kwargs(),
@@ -114,6 +101,7 @@ async def extract_topics(
                 "fact_attributes": [],
                 "profiles": profiles,
                 "config": project_profiles,
+                "project_config": project_config,
                 "total_profiles": project_profiles_slots,
             }
         )
@@ -146,6 +134,7 @@ async def extract_topics(
             "fact_attributes": fact_attributes,
             "profiles": profiles,
             "config": project_profiles,
+            "project_config": project_config,
             "total_profiles": project_profiles_slots,
         }
     )
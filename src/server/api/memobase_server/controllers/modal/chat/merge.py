@@ -6,6 +6,7 @@ from ....env import ProfileConfig, ContanstTable
 from ....llms import llm_complete
 from ....prompts.utils import (
     parse_string_into_merge_action,
+    parse_string_into_merge_actions,
 )
 from ....prompts.profile_init_utils import UserProfileTopic
 from ....types import SubTopic
@@ -38,12 +39,25 @@ async def merge_or_valid_new_memos(
         "update_delta": [],
         "before_profiles": profiles,
     }
-    tasks = []
+    facts = []
     for f_c, f_a in zip(fact_contents, fact_attributes):
-        task = handle_profile_merge_or_valid(
+        if skip_validation(f_a, config, RUNTIME_MAPS, DEFINE_MAPS):
+            LOG.info(f"Skip validation: {merge_key(f_a)}")
+            profile_session_results["add"].append(
+                {
+                    "content": f_c,
+                    "attributes": f_a,
+                }
+            )
+            continue
+        facts.append((f_a, f_c))
+
+    batch_size = max(CONFIG.profile_merge_batch_size, 1)
+    tasks = []
+    for i in range(0, len(facts), batch_size):
+        task = handle_profile_merge_batch(
             project_id,
-            f_a,
-            f_c,
+            facts[i : i + batch_size],
             config,
             RUNTIME_MAPS,
             DEFINE_MAPS,
@@ -54,51 +68,144 @@ async def merge_or_valid_new_memos(
     return Promise.resolve(profile_session_results)
 
 
-async def handle_profile_merge_or_valid(
-    project_id: str,
+def merge_key(profile_attributes: dict) -> tuple[str, str]:
+    return (
+        profile_attributes[ContanstTable.topic],
+        profile_attributes[ContanstTable.sub_topic],
+    )
+
+
+def skip_validation(
     profile_attributes: dict,
-    profile_content: str,
     config: ProfileConfig,
     profile_runtime_maps: dict[tuple[str, str], ProfileData],
     profile_define_maps: dict[tuple[str, str], SubTopic],
-    session_merge_validate_results: MergeAddResult,
-) -> Promise[None]:
-    KEY = (
-        profile_attributes[ContanstTable.topic],
-        profile_attributes[ContanstTable.sub_topic],
-    )
-    USE_LANGUAGE = config.language or CONFIG.language
+) -> bool:
+    KEY = merge_key(profile_attributes)
     PROFILE_VALIDATE_MODE = (
         config.profile_validate_mode
         if config.profile_validate_mode is not None
         else CONFIG.profile_validate_mode
     )
-    runtime_profile = profile_runtime_maps.get(KEY, None)
     define_sub_topic = profile_define_maps.get(KEY, SubTopic(name=""))
-
-    if (
+    return (
         not PROFILE_VALIDATE_MODE
         and not define_sub_topic.validate_value
-        and runtime_profile is None
-    ):
-        LOG.info(f"Skip validation: {KEY}")
-        session_merge_validate_results["add"].append(
-            {
-                "content": profile_content,
-                "attributes": profile_attributes,
-            }
+        and KEY not in profile_runtime_maps
+    )
+
+
+def merge_input_args(
+    profile_attributes: dict,
+    profile_content: str,
+    profile_runtime_maps: dict[tuple[str, str], ProfileData],
+    profile_define_maps: dict[tuple[str, str], SubTopic],
+) -> dict:
+    KEY = merge_key(profile_attributes)
+    runtime_profile = profile_runtime_maps.get(KEY, None)
+    define_sub_topic = profile_define_maps.get(KEY, SubTopic(name=""))
+    return {
+        "topic": KEY[0],
+        "subtopic": KEY[1],
+        "old_memo": runtime_profile.content if runtime_profile else None,
+        "new_memo": profile_content,
+        "update_instruction": define_sub_topic.update_description,  # maybe none
+        "topic_description": define_sub_topic.description,  # maybe none
+    }
+
+
+async def handle_profile_merge_batch(
+    project_id: str,
+    facts: list[tuple[dict, str]],
+    config: ProfileConfig,
+    profile_runtime_maps: dict[tuple[str, str], ProfileData],
+    profile_define_maps: dict[tuple[str, str], SubTopic],
+    session_merge_validate_results: MergeAddResult,
+) -> Promise[None]:
+    """Merge several facts with one LLM call.
+
+    Falls back to one call per fact if the batched call fails or its response
+    can't be parsed, so one bad response doesn't drop the whole batch.
+    """
+
+    async def merge_one_by_one() -> Promise[None]:
+        await asyncio.gather(
+            *[
+                handle_profile_merge_or_valid(
+                    project_id,
+                    f_a,
+                    f_c,
+                    config,
+                    profile_runtime_maps,
+                    profile_define_maps,
+                    session_merge_validate_results,
+                )
+                for f_a, f_c in facts
+            ]
         )
         return Promise.resolve(None)
 
+    if len(facts) == 1:
+        return await merge_one_by_one()
+
+    USE_LANGUAGE = config.language or CONFIG.language
+    r = await llm_complete(
+        project_id,
+        PROMPTS[USE_LANGUAGE]["merge"].get_batch_input(
+            [
+                merge_input_args(f_a, f_c, profile_runtime_maps, profile_define_maps)
+                for f_a, f_c in facts
+            ]
+        ),
+        system_prompt=PROMPTS[USE_LANGUAGE]["merge"].get_batch_prompt(),
+        temperature=0.2,  # precise
+        **PROMPTS[USE_LANGUAGE]["merge"].get_batch_kwargs(),
+    )
+    if not r.ok():
+        LOG.warning(
+            f"Failed to merge {len(facts)} facts in one call, merge them one by one: {r.msg()}"
+        )
+        return await merge_one_by_one()
+    update_responses: list[UpdateResponse] | None = parse_string_into_merge_actions(
+        r.data(), len(facts)
+    )
+    if update_responses is None or any(
+        u["action"] not in ("UPDATE", "ABORT") for u in update_responses
+    ):
+        LOG.warning(
+            f"Failed to parse batched merge actions, merge {len(facts)} facts one by one: {r.data()}"
+        )
+        return await merge_one_by_one()
+    for (f_a, f_c), update_response in zip(facts, update_responses):
+        apply_merge_action(
+            f_a,
+            f_c,
+            profile_runtime_maps.get(merge_key(f_a), None),
+            update_response,
+            session_merge_validate_results,
+        )
+    return Promise.resolve(None)
+
+
+async def handle_profile_merge_or_valid(
+    project_id: str,
+    profile_attributes: dict,
+    profile_content: str,
+    config: ProfileConfig,
+    profile_runtime_maps: dict[tuple[str, str], ProfileData],
+    profile_define_maps: dict[tuple[str, str], SubTopic],
+    session_merge_validate_results: MergeAddResult,
+) -> Promise[None]:
+    USE_LANGUAGE = config.language or CONFIG.language
     r = await llm_complete(
         project_id,
         PROMPTS[USE_LANGUAGE]["merge"].get_input(
-            KEY[0],
-            KEY[1],
-            runtime_profile.content if runtime_profile else None,
-            profile_content,
-            update_instruction=define_sub_topic.update_description,  # maybe none
-            topic_description=define_sub_topic.description,  # maybe none
+            **merge_input_args(
+                profile_attributes,
+                profile_content,
+                profile_runtime_maps,
+                profile_define_maps,
+            )
         ),
         system_prompt=PROMPTS[USE_LANGUAGE]["merge"].get_prompt(),
         temperature=0.2,  # precise
@@ -113,6 +220,23 @@ async def handle_profile_merge_or_valid(
         return Promise.reject(
             CODE.SERVER_PARSE_ERROR, "Failed to parse merge action of Memobase"
         )
+    return apply_merge_action(
+        profile_attributes,
+        profile_content,
+        profile_runtime_maps.get(merge_key(profile_attributes), None),
+        update_response,
+        session_merge_validate_results,
+    )
+
+
+def apply_merge_action(
+    profile_attributes: dict,
+    profile_content: str,
+    runtime_profile: ProfileData | None,
+    update_response: UpdateResponse,
+    session_merge_validate_results: MergeAddResult,
+) -> Promise[None]:
+    KEY = merge_key(profile_attributes)
     if update_response["action"] == "UPDATE":
         if runtime_profile is None:
             session_merge_validate_results["add"].append(
@@ -3,7 +3,7 @@ from collections import defaultdict
 from .types import MergeAddResult, PROMPTS, AddProfile
 from ....prompts.profile_init_utils import get_specific_subtopics
 from ....prompts.utils import parse_string_into_subtopics, attribute_unify
-from ....models.utils import Promise
+from ....models.utils import Promise, CODE
 from ....models.response import ProfileData
 from ....env import CONFIG, LOG, ProfileConfig, ContanstTable
 from ....llms import llm_complete
@@ -14,7 +14,26 @@ async def organize_profiles(
     profile_options: MergeAddResult,
     config: ProfileConfig,
 ) -> Promise[None]:
-    profiles = profile_options["before_profiles"]
+    p = await plan_organize_profiles(
+        project_id, profile_options["before_profiles"], config
+    )
+    if not p.ok():
+        return p
+    new_profiles, delete_profile_ids = p.data()
+    apply_organized_profiles(profile_options, new_profiles, delete_profile_ids)
+    return Promise.resolve(None)
+
+
+async def plan_organize_profiles(
+    project_id: str,
+    profiles: list[ProfileData],
+    config: ProfileConfig,
+) -> Promise[tuple[list[AddProfile], list[str]]]:
+    """Re-organize the topics with too many sub topics.
+
+    Return the new profiles and the ids of the profiles they replace, without
+    touching the merge results.
+    """
     USE_LANGUAGE = config.language or CONFIG.language
     STRICT_MODE = (
         config.profile_strict_mode
@@ -31,7 +50,7 @@ async def organize_profiles(
             need_to_organize_topics[topic] = group
 
     if not len(need_to_organize_topics):
-        return Promise.resolve(None)
+        return Promise.resolve(([], []))
     ps = await asyncio.gather(
         *[
             organize_profiles_by_topic(project_id, group, USE_LANGUAGE)
@@ -40,7 +59,9 @@ async def organize_profiles(
     )
     if not all([p.ok() for p in ps]):
         errmsg = "\n".join([p.msg() for p in ps if not p.ok()])
-        return Promise.reject(f"Failed to organize profiles: {errmsg}")
+        return Promise.reject(
+            CODE.SERVICE_UNAVAILABLE, f"Failed to organize profiles: {errmsg}"
+        )
 
     delete_profile_ids = []
     for gs in need_to_organize_topics.values():
@@ -49,10 +70,17 @@ async def organize_profiles(
     for p in ps:
         new_profiles.extend(p.data())
 
+    return Promise.resolve((new_profiles, delete_profile_ids))
+
+
+def apply_organized_profiles(
+    profile_options: MergeAddResult,
+    new_profiles: list[AddProfile],
+    delete_profile_ids: list[str],
+):
     profile_options["add"].extend(new_profiles)
     profile_options["add"] = deduplicate_profiles(profile_options["add"])
     profile_options["delete"].extend(delete_profile_ids)
-    return Promise.resolve(None)
 
 
 async def organize_profiles_by_topic(
@@ -109,7 +137,8 @@ async def organize_profiles_by_topic(
     ]
     if len(reorganized_profiles) == 0:
         return Promise.reject(
-            "Failed to organize profiles, left profiles is 0 so maybe it's the LLM error"
+            CODE.SERVICE_UNAVAILABLE,
+            "Failed to organize profiles, left profiles is 0 so maybe it's the LLM error",
         )
     # forcing the number of subtopics to be less than max_profile_subtopics // 2 + 1
     reorganized_profiles = reorganized_profiles[: CONFIG.max_profile_subtopics // 2 + 1]
@@ -1,5 +1,5 @@
 import asyncio
-from ....models.utils import Promise
+from ....models.utils import Promise, CODE
 from ....env import CONFIG, LOG
 from ....utils import get_blob_str, get_encoded_tokens, truncate_string
 from ....llms import llm_complete
@@ -19,7 +19,7 @@ async def re_summary(
     update_tasks = [summary_memo(project_id, up) for up in update_profile]
     ps = await asyncio.gather(*update_tasks)
     if not all([p.ok() for p in ps]):
-        return Promise.reject("Failed to re-summary profiles")
+        return Promise.reject(CODE.SERVICE_UNAVAILABLE, "Failed to re-summary profiles")
     return Promise.resolve(None)
 
 
@@ -4,7 +4,7 @@ from ....env import LOG, ProfileConfig
 from ....models.blob import Blob
 from ....models.utils import Promise
 from ....models.response import IdsData, ChatModalResponse
-from ...profile import add_user_profiles, update_user_profiles, delete_user_profiles
+from ...profile import apply_profile_changes
 from ...event import append_user_event
 from ..chat.extract import extract_topics
 from ..chat.merge import merge_or_valid_new_memos
@@ -74,18 +74,18 @@ async def process_blobs(
         LOG.error(f"Failed to re-summary profiles: {p.msg()}")
 
     # 数据库提交
-    p = await exe_user_profile_add(user_id, project_id, profile_options)
-    if not p.ok():
-        return p
-    add_profile_ids = p.data().ids
-    p = await exe_user_profile_update(user_id, project_id, profile_options)
-    if not p.ok():
-        return p
-    update_profile_ids = p.data().ids
-    p = await exe_user_profile_delete(user_id, project_id, profile_options)
+    p = await apply_profile_changes(
+        user_id,
+        project_id,
+        profile_options["add"],
+        profile_options["update"],
+        profile_options["delete"],
+    )
     if not p.ok():
         return p
-    delete_profile_ids = p.data().ids
+    add_profile_ids, update_profile_ids, delete_profile_ids = [
+        ids.ids for ids in p.data()
+    ]
     return Promise.resolve(
         ChatModalResponse(
             event_id= str(uuid.uuid4()),
@@ -111,47 +111,3 @@ async def handle_session_event(
     if not p.ok():
         return p
     return Promise.resolve(p.data().id)
-
-
-async def exe_user_profile_add(
-    user_id: str, project_id: str, profile_options: MergeAddResult
-) -> Promise[IdsData]:
-    if not len(profile_options["add"]):
-        return Promise.resolve(IdsData(ids=[]))
-    p = await add_user_profiles(
-        user_id,
-        project_id,
-        [ap["content"] for ap in profile_options["add"]],
-        [ap["attributes"] for ap in profile_options["add"]],
-    )
-    if not p.ok():
-        return p
-    return p
-
-
-async def exe_user_profile_update(
-    user_id: str, project_id: str, profile_options: MergeAddResult
-) -> Promise[IdsData]:
-    if not len(profile_options["update"]):
-        return Promise.resolve(IdsData(ids=[]))
-    p = await update_user_profiles(
-        user_id,
-        project_id,
-        [up["profile_id"] for up in profile_options["update"]],
-        [up["content"] for up in profile_options["update"]],
-        [up["attributes"] for up in profile_options["update"]],
-    )
-    if not p.ok():
-        return p
-    return p
-
-
-async def exe_user_profile_delete(
-    user_id: str, project_id: str, profile_options: MergeAddResult
-) -> Promise[IdsData]:
-    if not profile_options["delete"]:
-        return Promise.resolve(IdsData(ids=[]))
-    p = await delete_user_profiles(user_id, project_id, profile_options["delete"])
-    if not p.ok():
-        return p
-    return p
\ No newline at end of file
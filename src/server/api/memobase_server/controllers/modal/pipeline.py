@@ -0,0 +1,81 @@
+import time
+import asyncio
+import traceback
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+from ...env import LOG
+from ...models.utils import Promise, CODE
+from ...telemetry import telemetry_manager, HistogramMetricName
+
+StageFunc = Callable[[dict[str, Any]], Awaitable[Promise[Any]]]
+
+
+@dataclass
+class Stage:
+    """A step of a modal pipeline.
+
+    `func` gets the results of the finished stages by name. A stage fails if
+    it rejects or raises. A failed required stage fails the pipeline, a failed
+    optional stage is logged and its result is None.
+    """
+
+    name: str
+    func: StageFunc
+    deps: list[str] = field(default_factory=list)
+    required: bool = True
+
+
+async def run_pipeline(modal: str, stages: list[Stage]) -> Promise[dict[str, Any]]:
+    """Run every stage once its dependencies are done, independent stages run
+    concurrently. Return the results of all stages by name."""
+    stage_maps = {s.name: s for s in stages}
+    for s in stages:
+        for d in s.deps:
+            assert d in stage_maps, f"Unknown dependency {d} of stage {s.name}"
+    results: dict[str, Any] = {}
+    timings: dict[str, float] = {}
+    tasks: dict[str, asyncio.Task] = {}
+
+    async def run_stage(stage: Stage) -> Promise[Any]:
+        for d in stage.deps:
+            p = await tasks[d]
+            if not p.ok():
+                return p
+        start = time.perf_counter()
+        try:
+            p = await stage.func(results)
+        except Exception as e:
+            LOG.error(
+                f"Stage {stage.name} of {modal} raised: {e}, {traceback.format_exc()}"
+            )
+            p = Promise.reject(
+                CODE.INTERNAL_SERVER_ERROR, f"Stage {stage.name} raised: {e}"
+            )
+        timings[stage.name] = (time.perf_counter() - start) * 1000
+        telemetry_manager.record_histogram_metric(
+            HistogramMetricName.PIPELINE_STAGE_LATENCY_MS,
+            timings[stage.name],
+            {"modal": modal, "stage": stage.name},
+        )
+        if not p.ok() and not stage.required:
+            LOG.error(f"Stage {stage.name} of {modal} failed: {p.msg()}")
+            p = Promise.resolve(None)
+        if p.ok():
+            results[stage.name] = p.data()
+        return p
+
+    for s in stages:
+        tasks[s.name] = asyncio.create_task(run_stage(s))
+    try:
+        for s in stages:
+            p = await tasks[s.name]
+            if not p.ok():
+                return p
+    finally:
+        for task in tasks.values():
+            task.cancel()
+        LOG.info(
+            f"{modal} pipeline: "
+            + ", ".join(f"{name} {ms:.0f}ms" for name, ms in timings.items())
+        )
+    return Promise.resolve(results)
@@ -3,9 +3,7 @@ from ....env import CONFIG, LOG
 from ....models.utils import Promise
 from ....models.blob import Blob, BlobType, TranscriptBlob
 from ....llms import llm_complete
-from ....prompts.profile_init_utils import read_out_profile_config
-from ...project import get_project_profile_config
-from ....prompts.profile_init_utils import read_out_event_tags
+from ...project_config import get_project_config
 from ....prompts.utils import tag_chat_blobs_in_order_xml
 from .types import FactResponse, PROMPTS
 
@@ -14,28 +12,21 @@ async def entry_summary(
     user_id: str, project_id: str, blobs: list[Blob]
 ) -> Promise[str]:
     assert all(b.type == BlobType.transcript for b in blobs), "All blobs must be transcript blobs"
-    p = await get_project_profile_config(project_id)
+    p = await get_project_config(project_id)
     if not p.ok():
         return p
-    project_profiles = p.data()
-    USE_LANGUAGE = project_profiles.language or CONFIG.language
-    project_profiles_slots = read_out_profile_config(
-        project_profiles, PROMPTS[USE_LANGUAGE]["profile"].CANDIDATE_PROFILE_TOPICS
-    )
-    prompt = PROMPTS[USE_LANGUAGE]["entry_summary"]
-    event_tags = read_out_event_tags(project_profiles)
-    event_attriubtes_str = "\n".join(
-        [f"- {et.name}({et.description})" for et in event_tags]
-    )
-    profile_topics_str = PROMPTS[USE_LANGUAGE]["profile"].get_prompt(
-        project_profiles_slots
-    )
+    project_config = p.data()
+    prompt = PROMPTS[project_config.language]["entry_summary"]
     # 对于TranscriptBlob，使用transcripts字段的内容
     transcript_contents = "\n\n".join([f"<transcript>{' '.join([t.content for t in b.transcripts])}</transcript>" for b in blobs])
     r = await llm_complete(
         project_id,
         prompt.pack_input(transcript_contents),
-        system_prompt=prompt.get_prompt(profile_topics_str, event_attriubtes_str),
+        system_prompt=project_config.system_prompt(
+            prompt,
+            project_config.profile_topics_prompt,
+            project_config.event_tags_prompt,
+        ),
         temperature=0.2,  # precise
         model=CONFIG.summary_llm_model,
         **prompt.get_kwargs(),
@@ -1,15 +1,21 @@
+import numpy as np
 from pydantic import ValidationError
+from sqlalchemy import select
 from ...models.utils import Promise
 from ...models.database import GeneralBlob, UserProfile
 from ...models.blob import OpenAICompatibleMessage
-from ...models.response import CODE, IdData, IdsData, UserProfilesData
+from ...models.response import CODE, IdData, IdsData, ProfileData, UserProfilesData
 from ...utils import truncate_string, find_list_int_or_none
 from ...env import LOG, CONFIG
 from ...prompts import pick_related_profiles as pick_prompt
 from ...llms import llm_complete
+from ...llms.embeddings import get_embedding
+from ...connectors import AsyncSession
+from ..profile import embed_user_profiles
 
 
 async def filter_profiles_with_chats(
+    user_id: str,
     project_id: str,
     profiles: UserProfilesData,
     chats: list[OpenAICompatibleMessage],
@@ -17,8 +23,119 @@ async def filter_profiles_with_chats(
     max_value_token_size: int = 10,
     max_previous_chats: int = 4,
     max_filter_num: int = 10,
-) -> Promise[list[UserProfile]]:
-    """Filter profiles with chats"""
+) -> Promise[list[ProfileData]]:
+    """Pick the profiles related to the recent chats, see `profile_filter_mode`"""
+    mode = CONFIG.profile_filter_mode if CONFIG.enable_event_embedding else "llm"
+    if mode == "llm":
+        return await pick_profiles_with_llm(
+            project_id,
+            profiles,
+            chats,
+            only_topics=only_topics,
+            max_value_token_size=max_value_token_size,
+            max_previous_chats=max_previous_chats,
+            max_filter_num=max_filter_num,
+        )
+    p = await rank_profiles_with_chats(
+        user_id,
+        project_id,
+        profiles,
+        chats,
+        only_topics=only_topics,
+        max_previous_chats=max_previous_chats,
+        max_filter_num=(
+            max_filter_num
+            if mode == "embedding"
+            else max(CONFIG.profile_filter_candidates, max_filter_num)
+        ),
+    )
+    if not p.ok() or mode == "embedding":
+        return p
+    return await pick_profiles_with_llm(
+        project_id,
+        UserProfilesData(profiles=p.data()),
+        chats,
+        max_value_token_size=max_value_token_size,
+        max_previous_chats=max_previous_chats,
+        max_filter_num=max_filter_num,
+    )
+
+
+def cosine_distance(a: np.ndarray, b: np.ndarray) -> float:
+    return 1 - float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+
+
+async def rank_profiles_with_chats(
+    user_id: str,
+    project_id: str,
+    profiles: UserProfilesData,
+    chats: list[OpenAICompatibleMessage],
+    only_topics: list[str] | None = None,
+    max_previous_chats: int = 4,
+    max_filter_num: int = 10,
+) -> Promise[list[ProfileData]]:
+    """Return the `max_filter_num` profiles nearest to the recent chats.
+
+    The embeddings are stored with the profiles, profiles without one are
+    embedded and stored here.
+    """
+    if only_topics:
+        only_topics = set(t.strip() for t in only_topics)
+    candidates = [
+        p
+        for p in profiles.profiles
+        if not only_topics or p.attributes["topic"].strip() in only_topics
+    ]
+    if not len(chats) or not len(candidates):
+        return Promise.reject(CODE.BAD_REQUEST, "No chats or profiles to filter")
+    chats = chats[-(max_previous_chats + 1) :]
+    p = await get_embedding(
+        project_id,
+        ["\n".join(m.content for m in chats)],
+        phase="query",
+        model=CONFIG.embedding_model,
+    )
+    if not p.ok():
+        LOG.error(f"Failed to embed chats: {p.msg()}")
+        return p
+    query_embedding = p.data()[0]
+
+    distance = UserProfile.embedding.cosine_distance(query_embedding)
+    async with AsyncSession() as session:
+        rows = (
+            await session.execute(
+                select(UserProfile.id, distance.label("distance")).where(
+                    UserProfile.user_id == user_id,
+                    UserProfile.project_id == project_id,
+                    UserProfile.id.in_([c.id for c in candidates]),
+                )
+            )
+        ).all()
+    distances = {row.id: row.distance for row in rows if row.distance is not None}
+    missing = [c for c in candidates if c.id not in distances]
+    if missing:
+        p = await embed_user_profiles(user_id, project_id, missing)
+        if p.ok():
+            for c, embedding in zip(missing, p.data()):
+                distances[c.id] = cosine_distance(query_embedding, embedding)
+        else:
+            LOG.error(f"Failed to embed profiles of user {user_id}: {p.msg()}")
+    ranked = sorted(
+        [c for c in candidates if c.id in distances], key=lambda c: distances[c.id]
+    )
+    return Promise.resolve(ranked[:max_filter_num])
+
+
+async def pick_profiles_with_llm(
+    project_id: str,
+    profiles: UserProfilesData,
+    chats: list[OpenAICompatibleMessage],
+    only_topics: list[str] | None = None,
+    max_value_token_size: int = 10,
+    max_previous_chats: int = 4,
+    max_filter_num: int = 10,
+) -> Promise[list[ProfileData]]:
+    """Let the LLM pick the profiles related to the recent chats"""
     if not len(chats) or not len(profiles.profiles):
         return Promise.reject(CODE.BAD_REQUEST, "No chats or profiles to filter")
     chats = chats[-(max_previous_chats + 1) :]
@@ -1,10 +1,29 @@
-from pydantic import ValidationError
+import uuid
+import numpy as np
+from sqlalchemy import (
+    select,
+    delete,
+    insert,
+    update,
+    values,
+    column,
+    func,
+    bindparam,
+)
+from sqlalchemy.dialects.postgresql import UUID, JSONB, TEXT, INTEGER
+from pgvector.sqlalchemy import Vector
 from ..models.utils import Promise
 from ..models.database import GeneralBlob, UserProfile
-from ..models.response import CODE, IdData, IdsData, UserProfilesData
-from ..connectors import Session, get_redis_client
-from ..utils import get_encoded_tokens
-from ..env import LOG, CONFIG
+from ..models.response import CODE, IdData, IdsData, ProfileData, UserProfilesData
+from ..connectors import AsyncSession
+from ..utils import profile_token_size, profile_str_repr
+from ..llms.embeddings import get_embedding
+from .profile_cache import (
+    get_cached_user_profiles,
+    set_cached_user_profiles,
+    profile_write_lock,
+)
+from ..env import CONFIG, LOG
 
 
 async def truncate_profiles(
@@ -63,8 +82,7 @@ async def truncate_profiles(
         current_length = 0
         use_index = 0
         for max_i, p in enumerate(profiles.profiles):
-            single_p = f"{p.attributes.get('topic')}::{p.attributes.get('sub_topic')}: {p.content}"
-            current_length += len(get_encoded_tokens(single_p))
+            current_length += profile_data_token_size(p)
             if current_length > max_token_size:
                 break
             use_index = max_i
@@ -73,44 +91,175 @@ async def truncate_profiles(
 
 
 async def get_user_profiles(user_id: str, project_id: str) -> Promise[UserProfilesData]:
-    async with get_redis_client() as redis_client:
-        user_profiles = await redis_client.get(
-            f"user_profiles::{project_id}::{user_id}"
-        )
-        if user_profiles:
-            try:
-                return Promise.resolve(
-                    UserProfilesData.model_validate_json(user_profiles)
-                )
-            except ValidationError as e:
-                LOG.error(f"Invalid user profiles: {e}")
-                await redis_client.delete(f"user_profiles::{project_id}::{user_id}")
-    with Session() as session:
-        user_profiles = (
-            session.query(UserProfile)
+    async def load() -> UserProfilesData:
+        async with AsyncSession() as session:
+            return await load_user_profiles(session, user_id, project_id)
+
+    return Promise.resolve(await get_cached_user_profiles(user_id, project_id, load))
+
+
+async def load_user_profiles(
+    session, user_id: str, project_id: str
+) -> UserProfilesData:
+    user_profiles = (
+        await session.scalars(
+            select(UserProfile)
             .filter_by(user_id=user_id, project_id=project_id)
             .order_by(UserProfile.updated_at.desc())
-            .all()
         )
-        results = []
-        for up in user_profiles:
-            results.append(
-                {
-                    "id": up.id,
-                    "content": up.content,
-                    "attributes": up.attributes,
-                    "created_at": up.created_at,
-                    "updated_at": up.updated_at,
-                }
+    ).all()
+    results = []
+    for up in user_profiles:
+        results.append(
+            {
+                "id": up.id,
+                "content": up.content,
+                "attributes": up.attributes,
+                "created_at": up.created_at,
+                "updated_at": up.updated_at,
+                # Rows written before token sizes were stored are counted
+                # once here, the cache keeps the count
+                "token_size": (
+                    up.token_size
+                    if up.token_size is not None
+                    else profile_token_size(up.content, up.attributes)
+                ),
+            }
+        )
+    return UserProfilesData(profiles=results)
+
+
+def profile_data_token_size(profile: ProfileData) -> int:
+    if profile.token_size is not None:
+        return profile.token_size
+    return profile_token_size(profile.content, profile.attributes)
+
+
+async def bulk_update_profiles(
+    session,
+    user_id: str,
+    project_id: str,
+    profile_ids: list[str],
+    contents: list[str],
+    attributes: list[dict | None],
+) -> list[str]:
+    """Update profiles with one `UPDATE ... FROM (VALUES ...)`, a None
+    attribute keeps the current one and leaves the token size to be counted
+    on read. The embeddings are cleared until the new contents are embedded.
+    Return the ids of the updated profiles."""
+    if not len(profile_ids):
+        return []
+    new_values = (
+        values(
+            column("id", UUID(as_uuid=True)),
+            column("content", TEXT),
+            column("attributes", JSONB(none_as_null=True)),
+            column("token_size", INTEGER),
+            name="new_values",
+        ).data(
+            [
+                (
+                    uuid.UUID(str(profile_id)),
+                    content,
+                    attribute,
+                    (
+                        profile_token_size(content, attribute)
+                        if attribute is not None
+                        else None
+                    ),
+                )
+                for profile_id, content, attribute in zip(
+                    profile_ids, contents, attributes
+                )
+            ]
+        )
+    )
+    result = await session.execute(
+        update(UserProfile)
+        .where(
+            UserProfile.id == new_values.c.id,
+            UserProfile.user_id == user_id,
+            UserProfile.project_id == project_id,
+        )
+        .values(
+            content=new_values.c.content,
+            attributes=func.coalesce(new_values.c.attributes, UserProfile.attributes),
+            token_size=new_values.c.token_size,
+            embedding=None,
+        )
+        .returning(UserProfile.id)
+    )
+    updated_ids = set(result.scalars().all())
+    for profile_id in profile_ids:
+        if uuid.UUID(str(profile_id)) not in updated_ids:
+            LOG.error(f"Profile {profile_id} not found for user {user_id}")
+    return [
+        profile_id
+        for profile_id in profile_ids
+        if uuid.UUID(str(profile_id)) in updated_ids
+    ]
+
+
+async def embed_user_profiles(
+    user_id: str, project_id: str, profiles: list[ProfileData]
+) -> Promise[np.ndarray]:
+    """Embed the context lines of the profiles and store the embeddings.
+
+    A profile whose content changed since it was read keeps the embedding
+    of the newer write. Return the embeddings in the order of `profiles`.
+    """
+    p = await get_embedding(
+        project_id,
+        [profile_str_repr(pf.content, pf.attributes) for pf in profiles],
+        phase="document",
+        model=CONFIG.embedding_model,
+    )
+    if not p.ok():
+        return p
+    embeddings = p.data()
+    if embeddings.shape[-1] != CONFIG.embedding_dim:
+        return Promise.reject(
+            CODE.INTERNAL_SERVER_ERROR,
+            f"Embedding dimension mismatch! Expected {CONFIG.embedding_dim}, got {embeddings.shape[-1]}.",
+        )
+    profiles_table = UserProfile.__table__
+    async with AsyncSession() as session:
+        await session.execute(
+            update(profiles_table)
+            .where(
+                profiles_table.c.id == bindparam("b_id"),
+                profiles_table.c.user_id == user_id,
+                profiles_table.c.project_id == project_id,
+                profiles_table.c.content == bindparam("b_content"),
             )
-    return_profiles = UserProfilesData(profiles=results)
-    async with get_redis_client() as redis_client:
-        await redis_client.set(
-            f"user_profiles::{project_id}::{user_id}",
-            return_profiles.model_dump_json(),
-            ex=CONFIG.cache_user_profiles_ttl,
+            .values(
+                embedding=bindparam(
+                    "b_embedding", type_=Vector(dim=CONFIG.embedding_dim)
+                )
+            ),
+            [
+                {"b_id": pf.id, "b_content": pf.content, "b_embedding": embedding}
+                for pf, embedding in zip(profiles, embeddings)
+            ],
         )
-    return Promise.resolve(return_profiles)
+        await session.commit()
+    return Promise.resolve(embeddings)
+
+
+async def embed_written_profiles(
+    user_id: str, project_id: str, profiles: UserProfilesData, profile_ids: list
+):
+    """Embed the written profiles after their commit. Failures are logged,
+    the profiles without embeddings are embedded when they're next ranked."""
+    if not CONFIG.enable_event_embedding or not len(profile_ids):
+        return
+    written_ids = {str(profile_id) for profile_id in profile_ids}
+    written = [pf for pf in profiles.profiles if str(pf.id) in written_ids]
+    if not len(written):
+        return
+    p = await embed_user_profiles(user_id, project_id, written)
+    if not p.ok():
+        LOG.error(f"Failed to embed profiles of user {user_id}: {p.msg()}")
 
 
 async def add_user_profiles(
@@ -122,18 +271,24 @@ async def add_user_profiles(
     assert len(profiles) == len(
         attributes
     ), "Length of profiles, attributes must be equal"
-    with Session() as session:
-        db_profiles = [
-            UserProfile(
-                user_id=user_id, project_id=project_id, content=content, attributes=attr
-            )
-            for content, attr in zip(profiles, attributes)
-        ]
-        session.add_all(db_profiles)
-        session.commit()
-        profile_ids = [profile.id for profile in db_profiles]
-    async with get_redis_client() as redis_client:
-        await redis_client.delete(f"user_profiles::{project_id}::{user_id}")
+    async with profile_write_lock(user_id, project_id):
+        async with AsyncSession() as session:
+            db_profiles = [
+                UserProfile(
+                    user_id=user_id,
+                    project_id=project_id,
+                    content=content,
+                    attributes=attr,
+                    token_size=profile_token_size(content, attr),
+                )
+                for content, attr in zip(profiles, attributes)
+            ]
+            session.add_all(db_profiles)
+            fresh_profiles = await load_user_profiles(session, user_id, project_id)
+            await session.commit()
+            profile_ids = [profile.id for profile in db_profiles]
+        await set_cached_user_profiles(user_id, project_id, fresh_profiles)
+    await embed_written_profiles(user_id, project_id, fresh_profiles, profile_ids)
     return Promise.resolve(IdsData(ids=profile_ids))
 
 
@@ -150,57 +305,119 @@ async def update_user_profiles(
     assert len(profile_ids) == len(
         attributes
     ), "Length of profile_ids, attributes must be equal"
-    with Session() as session:
-        db_profiles = []
-        for profile_id, content, attribute in zip(profile_ids, contents, attributes):
-            db_profile = (
-                session.query(UserProfile)
-                .filter_by(id=profile_id, user_id=user_id, project_id=project_id)
-                .one_or_none()
+    async with profile_write_lock(user_id, project_id):
+        async with AsyncSession() as session:
+            updated_ids = await bulk_update_profiles(
+                session, user_id, project_id, profile_ids, contents, attributes
             )
-            if db_profile is None:
-                LOG.error(f"Profile {profile_id} not found for user {user_id}")
-                continue
-            db_profile.content = content
-            if attribute is not None:
-                db_profile.attributes = attribute
-            db_profiles.append(profile_id)
-        session.commit()
-    async with get_redis_client() as redis_client:
-        await redis_client.delete(f"user_profiles::{project_id}::{user_id}")
-    return Promise.resolve(IdsData(ids=db_profiles))
+            fresh_profiles = await load_user_profiles(session, user_id, project_id)
+            await session.commit()
+        await set_cached_user_profiles(user_id, project_id, fresh_profiles)
+    await embed_written_profiles(user_id, project_id, fresh_profiles, updated_ids)
+    return Promise.resolve(IdsData(ids=updated_ids))
+
+
+async def apply_profile_changes(
+    user_id: str,
+    project_id: str,
+    adds: list[dict],
+    updates: list[dict],
+    delete_ids: list[str],
+) -> Promise[tuple[IdsData, IdsData, IdsData]]:
+    """Add, update and delete profiles of a user in one transaction, with a
+    bulk INSERT, one UPDATE and one DELETE. The fresh profiles are written to
+    the cache instead of invalidating it.
+
+    `adds` items have `content` and `attributes`, `updates` items also have
+    `profile_id`. Return the added, updated and deleted profile ids.
+    """
+    if not (len(adds) or len(updates) or len(delete_ids)):
+        return Promise.resolve((IdsData(ids=[]), IdsData(ids=[]), IdsData(ids=[])))
+    LOG.info(
+        f"Applying profile changes for user {user_id}: "
+        f"{len(adds)} added, {len(updates)} updated, {len(delete_ids)} deleted"
+    )
+    add_ids = [uuid.uuid4() for _ in adds]
+    async with profile_write_lock(user_id, project_id):
+        async with AsyncSession() as session:
+            if len(adds):
+                await session.execute(
+                    insert(UserProfile),
+                    [
+                        {
+                            "id": profile_id,
+                            "user_id": user_id,
+                            "project_id": project_id,
+                            "content": ap["content"],
+                            "attributes": ap["attributes"],
+                            "token_size": profile_token_size(
+                                ap["content"], ap["attributes"]
+                            ),
+                        }
+                        for profile_id, ap in zip(add_ids, adds)
+                    ],
+                )
+            update_ids = await bulk_update_profiles(
+                session,
+                user_id,
+                project_id,
+                [up["profile_id"] for up in updates],
+                [up["content"] for up in updates],
+                [up["attributes"] for up in updates],
+            )
+            if len(delete_ids):
+                await session.execute(
+                    delete(UserProfile).where(
+                        UserProfile.id.in_(delete_ids),
+                        UserProfile.user_id == user_id,
+                        UserProfile.project_id == project_id,
+                    )
+                )
+            # Read the result inside the transaction, so the cache matches this write
+            fresh_profiles = await load_user_profiles(session, user_id, project_id)
+            await session.commit()
+        await set_cached_user_profiles(user_id, project_id, fresh_profiles)
+    await embed_written_profiles(
+        user_id, project_id, fresh_profiles, add_ids + update_ids
+    )
+    return Promise.resolve(
+        (IdsData(ids=add_ids), IdsData(ids=update_ids), IdsData(ids=delete_ids))
+    )
 
 
 async def delete_user_profile(
     user_id: str, project_id: str, profile_id: str
 ) -> Promise[None]:
-    with Session() as session:
-        db_profile = (
-            session.query(UserProfile)
-            .filter_by(id=profile_id, user_id=user_id, project_id=project_id)
-            .one_or_none()
-        )
-        if db_profile is None:
-            return Promise.reject(
-                CODE.NOT_FOUND, f"Profile {profile_id} not found for user {user_id}"
+    async with profile_write_lock(user_id, project_id):
+        async with AsyncSession() as session:
+            result = await session.execute(
+                delete(UserProfile).filter_by(
+                    id=profile_id, user_id=user_id, project_id=project_id
+                )
             )
-        session.delete(db_profile)
-        session.commit()
-    async with get_redis_client() as redis_client:
-        await redis_client.delete(f"user_profiles::{project_id}::{user_id}")
+            if result.rowcount == 0:
+                return Promise.reject(
+                    CODE.NOT_FOUND, f"Profile {profile_id} not found for user {user_id}"
+                )
+            fresh_profiles = await load_user_profiles(session, user_id, project_id)
+            await session.commit()
+        await set_cached_user_profiles(user_id, project_id, fresh_profiles)
     return Promise.resolve(None)
 
 
 async def delete_user_profiles(
     user_id: str, project_id: str, profile_ids: list[str]
 ) -> Promise[IdsData]:
-    with Session() as session:
-        session.query(UserProfile).filter(
-            UserProfile.id.in_(profile_ids),
-            UserProfile.user_id == user_id,
-            UserProfile.project_id == project_id,
-        ).delete(synchronize_session=False)
-        session.commit()
-    async with get_redis_client() as redis_client:
-        await redis_client.delete(f"user_profiles::{project_id}::{user_id}")
+    async with profile_write_lock(user_id, project_id):
+        async with AsyncSession() as session:
+            await session.execute(
+                delete(UserProfile).where(
+                    UserProfile.id.in_(profile_ids),
+                    UserProfile.user_id == user_id,
+                    UserProfile.project_id == project_id,
+                )
+            )
+            fresh_profiles = await load_user_profiles(session, user_id, project_id)
+            await session.commit()
+        await set_cached_user_profiles(user_id, project_id, fresh_profiles)
     return Promise.resolve(IdsData(ids=profile_ids))
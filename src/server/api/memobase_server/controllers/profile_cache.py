@@ -0,0 +1,323 @@
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Awaitable, Callable
+from pydantic import ValidationError
+from ..env import CONFIG, LOG
+from ..connectors import get_redis_client, get_redis_binary_client
+from ..models.response import UserProfilesData
+from ..telemetry import telemetry_manager, CounterMetricName
+from ..utils import user_lock
+
+ProfilesLoader = Callable[[], Awaitable[UserProfilesData]]
+
+# (project_id, user_id) -> (expire_at, version, encoded profiles), least
+# recently used first. Encoded, so every hit decodes a copy the caller can
+# modify. Both tiers keep the model JSON, pydantic-core decodes it fastest
+_LOCAL_PROFILES: OrderedDict[tuple[str, str], tuple[float, int, bytes]] = (
+    OrderedDict()
+)
+# (project_id, user_id, version) -> the database load running in this process
+_LOADING: dict[tuple[str, str, int | None], asyncio.Task] = {}
+# Keep the background revalidations referenced until they finish
+_REVALIDATIONS: set[asyncio.Task] = set()
+
+FILL_LOCK_TTL = 10
+FILL_POLL_INTERVAL = 0.05
+PROFILE_WRITE_LOCK_TIMEOUT = 30
+PROFILE_WRITE_LOCK_BLOCKING_TIMEOUT = 30
+
+# KEYS[1] is the cached entry, KEYS[2] the version counter of the user.
+# ARGV[1] is the version the profiles were read at, or -1 to bump the counter
+# and write at the new version. A read older than the counter raced with a
+# write and is dropped. Return the written version, or -1 if dropped.
+SET_PROFILES_SCRIPT = """
+local version
+if tonumber(ARGV[1]) < 0 then
+    version = redis.call('INCR', KEYS[2])
+else
+    version = tonumber(redis.call('GET', KEYS[2]) or '0')
+    if tonumber(ARGV[1]) ~= version then
+        return -1
+    end
+end
+redis.call('HSET', KEYS[1], 'version', version, 'cached_at', ARGV[2], 'data', ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+redis.call('EXPIRE', KEYS[2], ARGV[5])
+return version
+"""
+
+
+def profile_cache_key(user_id: str, project_id: str) -> str:
+    return f"memobase::user_profiles::{project_id}::{user_id}"
+
+
+def profile_version_key(user_id: str, project_id: str) -> str:
+    return f"memobase::user_profiles_version::{project_id}::{user_id}"
+
+
+def profile_fill_lock_key(user_id: str, project_id: str) -> str:
+    return f"memobase::user_profiles_fill::{project_id}::{user_id}"
+
+
+def profile_write_lock(user_id: str, project_id: str):
+    """Serialize the profile writes of one user with their write-through.
+
+    Hold it from the transaction that reads the fresh profiles until
+    `set_cached_user_profiles`, so writes reach the cache in commit order.
+    """
+    return user_lock(
+        user_id,
+        project_id,
+        "profiles",
+        lock_timeout=PROFILE_WRITE_LOCK_TIMEOUT,
+        blocking_timeout=PROFILE_WRITE_LOCK_BLOCKING_TIMEOUT,
+    )
+
+
+def _set_local(user_id: str, project_id: str, data: bytes, version: int):
+    """Keep the profiles cached at `version` in memory, unless a live entry
+    of a newer version is there already."""
+    if CONFIG.cache_user_profiles_local_size <= 0 or version < 0:
+        return
+    key = (project_id, user_id)
+    now = time.monotonic()
+    local = _LOCAL_PROFILES.get(key)
+    if local is not None and local[0] > now and local[1] > version:
+        return
+    _LOCAL_PROFILES[key] = (
+        now + CONFIG.cache_user_profiles_local_ttl,
+        version,
+        data,
+    )
+    _LOCAL_PROFILES.move_to_end(key)
+    while len(_LOCAL_PROFILES) > CONFIG.cache_user_profiles_local_size:
+        _LOCAL_PROFILES.popitem(last=False)
+
+
+def _encode(profiles: UserProfilesData) -> bytes:
+    return profiles.model_dump_json().encode()
+
+
+def _decode(data: bytes) -> UserProfilesData | None:
+    """Return None if the entry is invalid, like entries cached before a
+    model change. They're reloaded"""
+    try:
+        # pydantic-core parses and validates the JSON in one pass, faster
+        # than building the models without validation
+        return UserProfilesData.model_validate_json(data)
+    except ValidationError as e:
+        LOG.error(f"Invalid cached user profiles: {e}")
+        return None
+
+
+def _count_hit(tier: str):
+    telemetry_manager.increment_counter_metric(
+        CounterMetricName.PROFILE_CACHE_HITS, 1, {"tier": tier}
+    )
+
+
+async def _read_cached(
+    user_id: str, project_id: str
+) -> tuple[int | None, tuple[UserProfilesData, bytes, float] | None]:
+    """Return the current version of the user, and the cached profiles, their
+    encoding and cache time if they were cached at that version.
+
+    The version is None if Redis can't be read.
+    """
+    try:
+        async with get_redis_binary_client() as redis_client:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                pipe.get(profile_version_key(user_id, project_id))
+                pipe.hgetall(profile_cache_key(user_id, project_id))
+                version, entry = await pipe.execute()
+    except Exception as e:
+        LOG.warning(f"User profiles cache lookup failed: {e}")
+        return None, None
+    version = int(version or 0)
+    if not entry or int(entry.get(b"version", -1)) != version:
+        return version, None
+    profiles = _decode(entry.get(b"data", b""))
+    if profiles is None:
+        return version, None
+    return version, (profiles, entry[b"data"], float(entry.get(b"cached_at", 0)))
+
+
+async def _write_cached(
+    user_id: str, project_id: str, data: bytes, version: int
+) -> int:
+    """Write the profiles read at `version`, -1 bumps the version. Return the
+    written version, or -1 if the write was dropped."""
+    try:
+        async with get_redis_binary_client() as redis_client:
+            set_script = redis_client.register_script(SET_PROFILES_SCRIPT)
+            return int(
+                await set_script(
+                    keys=[
+                        profile_cache_key(user_id, project_id),
+                        profile_version_key(user_id, project_id),
+                    ],
+                    args=[
+                        version,
+                        time.time(),
+                        data,
+                        CONFIG.cache_user_profiles_ttl,
+                        # The counter outlives every entry cached at its versions
+                        CONFIG.cache_user_profiles_ttl * 2,
+                    ],
+                )
+            )
+    except Exception as e:
+        LOG.warning(f"User profiles cache write failed: {e}")
+        return -1
+
+
+async def _fill(
+    user_id: str,
+    project_id: str,
+    version: int | None,
+    loader: ProfilesLoader,
+    wait_for_others: bool = True,
+) -> tuple[UserProfilesData | None, int]:
+    """Load the profiles from the database and cache them at `version`.
+
+    Only the process holding the fill lock loads, the others poll the cache
+    for its write until `cache_user_profiles_fill_timeout` and then load
+    themselves. Without `wait_for_others`, return None instead of waiting.
+    Return the profiles and the version they're cached at, -1 if they
+    weren't cached because a write bumped the version meanwhile.
+    """
+    if version is None:
+        return await loader(), -1
+    lock_key = profile_fill_lock_key(user_id, project_id)
+    try:
+        async with get_redis_client() as redis_client:
+            acquired = await redis_client.set(lock_key, 1, nx=True, ex=FILL_LOCK_TTL)
+    except Exception as e:
+        LOG.warning(f"User profiles fill lock failed: {e}")
+        acquired = True
+    if not acquired:
+        if not wait_for_others:
+            return None, -1
+        deadline = time.monotonic() + CONFIG.cache_user_profiles_fill_timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(FILL_POLL_INTERVAL)
+            version, cached = await _read_cached(user_id, project_id)
+            if cached is not None:
+                return cached[0], version
+        profiles = await loader()
+        if version is None:
+            return profiles, -1
+        written = await _write_cached(
+            user_id, project_id, _encode(profiles), version
+        )
+        return profiles, written
+    try:
+        profiles = await loader()
+        written = await _write_cached(
+            user_id, project_id, _encode(profiles), version
+        )
+    finally:
+        try:
+            async with get_redis_client() as redis_client:
+                await redis_client.delete(lock_key)
+        except Exception as e:
+            LOG.warning(f"User profiles fill unlock failed: {e}")
+    return profiles, written
+
+
+def _start_fill(
+    user_id: str,
+    project_id: str,
+    version: int | None,
+    loader: ProfilesLoader,
+    wait_for_others: bool = True,
+) -> asyncio.Task:
+    """Start a fill, or join the one running in this process at `version`"""
+    key = (project_id, user_id, version)
+    task = _LOADING.get(key)
+    if task is None:
+        task = asyncio.create_task(
+            _fill(user_id, project_id, version, loader, wait_for_others)
+        )
+        _LOADING[key] = task
+        task.add_done_callback(lambda _: _LOADING.pop(key, None))
+    return task
+
+
+async def _revalidate(
+    user_id: str, project_id: str, version: int, loader: ProfilesLoader
+):
+    try:
+        profiles, written = await _start_fill(
+            user_id, project_id, version, loader, wait_for_others=False
+        )
+    except Exception as e:
+        LOG.warning(f"Failed to revalidate user profiles of {user_id}: {e}")
+        return
+    if profiles is not None:
+        _set_local(user_id, project_id, _encode(profiles), written)
+
+
+async def get_cached_user_profiles(
+    user_id: str, project_id: str, loader: ProfilesLoader
+) -> UserProfilesData:
+    """Read the profiles from memory, then Redis, then `loader`.
+
+    An entry is only used if it was cached at the current version of the
+    user. Entries older than `cache_user_profiles_fresh_ttl` are served while
+    one request reloads them in the background. A missing entry is loaded
+    once and shared by the concurrent readers. Return a copy the caller can
+    modify.
+    """
+    local = _LOCAL_PROFILES.get((project_id, user_id))
+    if local is not None and local[0] > time.monotonic():
+        _LOCAL_PROFILES.move_to_end((project_id, user_id))
+        _count_hit("local")
+        return _decode(local[2])
+
+    version, cached = await _read_cached(user_id, project_id)
+    if cached is not None:
+        profiles, data, cached_at = cached
+        if time.time() - cached_at > CONFIG.cache_user_profiles_fresh_ttl:
+            task = asyncio.create_task(
+                _revalidate(user_id, project_id, version, loader)
+            )
+            _REVALIDATIONS.add(task)
+            task.add_done_callback(_REVALIDATIONS.discard)
+        _set_local(user_id, project_id, data, version)
+        _count_hit("redis")
+        return profiles
+
+    telemetry_manager.increment_counter_metric(CounterMetricName.PROFILE_CACHE_MISSES, 1)
+    # Don't cancel the load shared with other readers
+    profiles, written = await asyncio.shield(
+        _start_fill(user_id, project_id, version, loader)
+    )
+    if profiles is None:
+        # Joined a background revalidation that yielded to another process
+        profiles, written = await loader(), -1
+    # The loaded profiles are shared with the other readers
+    data = _encode(profiles)
+    # Profiles loaded while a write bumped the version may be older than it
+    _set_local(user_id, project_id, data, written)
+    return _decode(data)
+
+
+async def set_cached_user_profiles(
+    user_id: str, project_id: str, profiles: UserProfilesData
+):
+    """Write through the profiles of a committed write under a new version of
+    the user, so entries cached before the write are no longer served. Call
+    it under the `profile_write_lock` of the write.
+
+    Other processes may serve their in-memory copy for up to
+    `cache_user_profiles_local_ttl` seconds.
+    """
+    data = _encode(profiles)
+    version = await _write_cached(user_id, project_id, data, -1)
+    if version < 0:
+        # Don't serve what was cached before this write
+        _LOCAL_PROFILES.pop((project_id, user_id), None)
+        return
+    _set_local(user_id, project_id, data, version)
@@ -0,0 +1,165 @@
+import time
+import asyncio
+from hashlib import sha256
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from types import ModuleType
+from sqlalchemy import select
+from ..env import CONFIG, LOG, ProfileConfig
+from ..types import UserProfileTopic, EventTag
+from ..models.database import Project
+from ..models.utils import Promise, CODE
+from ..connectors import AsyncSession, get_redis_client
+from ..prompts import user_profile_topics, zh_user_profile_topics
+from ..prompts.utils import attribute_unify
+from ..prompts.profile_init_utils import read_out_profile_config, read_out_event_tags
+
+# Publish a project id here after changing its profile config
+PROJECT_CONFIG_INVALIDATE_CHANNEL = "memobase::project_config::invalidate"
+
+PROFILE_TOPICS_PROMPTS = {"en": user_profile_topics, "zh": zh_user_profile_topics}
+
+# project_id -> (expire_at, project config), least recently used first
+_LOCAL_PROJECT_CONFIGS: OrderedDict[str, tuple[float, "ProjectConfig"]] = (
+    OrderedDict()
+)
+# sha256 of the config string -> project config, projects sharing a config
+# string share its parsed config and prompts
+_CONFIGS_BY_HASH: OrderedDict[bytes, "ProjectConfig"] = OrderedDict()
+
+
+@dataclass
+class ProjectConfig:
+    """The parsed profile config of a project and the prompt fragments built
+    from it. Shared by all requests of the project, don't modify it."""
+
+    config: ProfileConfig
+    language: str
+    strict_mode: bool
+    profile_slots: list[UserProfileTopic]
+    # Unified (topic, sub_topic) of the slots, the only ones kept in strict mode
+    allowed_topic_subtopics: set[tuple[str, str]]
+    profile_topics_prompt: str
+    event_tags: list[EventTag]
+    event_tags_prompt: str
+    _system_prompts: dict[tuple, str] = field(default_factory=dict, repr=False)
+
+    @classmethod
+    def build(cls, config: ProfileConfig) -> "ProjectConfig":
+        language = config.language or CONFIG.language
+        profile_topics = PROFILE_TOPICS_PROMPTS[language]
+        profile_slots = read_out_profile_config(
+            config, profile_topics.CANDIDATE_PROFILE_TOPICS
+        )
+        event_tags = read_out_event_tags(config)
+        return cls(
+            config=config,
+            language=language,
+            strict_mode=(
+                config.profile_strict_mode
+                if config.profile_strict_mode is not None
+                else CONFIG.profile_strict_mode
+            ),
+            profile_slots=profile_slots,
+            allowed_topic_subtopics={
+                (attribute_unify(ps.topic), attribute_unify(st["name"]))
+                for ps in profile_slots
+                for st in ps.sub_topics
+            },
+            profile_topics_prompt=profile_topics.get_prompt(profile_slots),
+            event_tags=event_tags,
+            event_tags_prompt="\n".join(
+                [f"- {et.name}({et.description})" for et in event_tags]
+            ),
+        )
+
+    def system_prompt(self, prompt: ModuleType, *fragments: str) -> str:
+        """`prompt.get_prompt(*fragments)`, rendered once per prompt"""
+        key = (prompt.__name__, *fragments)
+        if key not in self._system_prompts:
+            self._system_prompts[key] = prompt.get_prompt(*fragments)
+        return self._system_prompts[key]
+
+
+def _config_from_string(profile_config: str | None) -> ProjectConfig:
+    digest = sha256((profile_config or "").encode()).digest()
+    project_config = _CONFIGS_BY_HASH.get(digest)
+    if project_config is None:
+        project_config = ProjectConfig.build(
+            ProfileConfig.load_config_string(profile_config)
+            if profile_config
+            else ProfileConfig()
+        )
+        _CONFIGS_BY_HASH[digest] = project_config
+    _CONFIGS_BY_HASH.move_to_end(digest)
+    while len(_CONFIGS_BY_HASH) > max(CONFIG.project_config_local_size, 1):
+        _CONFIGS_BY_HASH.popitem(last=False)
+    return project_config
+
+
+async def get_project_config(project_id: str) -> Promise[ProjectConfig]:
+    """Read the profile config of a project and its prompt fragments.
+
+    Served from memory for `project_config_local_ttl` seconds, entries are
+    dropped earlier when the project is invalidated through
+    `PROJECT_CONFIG_INVALIDATE_CHANNEL`. Reloads only query the config
+    string, it's parsed again only if it changed.
+    """
+    now = time.monotonic()
+    local = _LOCAL_PROJECT_CONFIGS.get(project_id)
+    if local is not None and local[0] > now:
+        _LOCAL_PROJECT_CONFIGS.move_to_end(project_id)
+        return Promise.resolve(local[1])
+    async with AsyncSession() as session:
+        p = (
+            await session.execute(
+                select(Project.profile_config).filter(
+                    Project.project_id == project_id
+                )
+            )
+        ).one_or_none()
+    if not p:
+        return Promise.reject(CODE.NOT_FOUND, "Project not found")
+    project_config = _config_from_string(p.profile_config)
+    if CONFIG.project_config_local_size > 0:
+        _LOCAL_PROJECT_CONFIGS[project_id] = (
+            now + CONFIG.project_config_local_ttl,
+            project_config,
+        )
+        _LOCAL_PROJECT_CONFIGS.move_to_end(project_id)
+        while len(_LOCAL_PROJECT_CONFIGS) > CONFIG.project_config_local_size:
+            _LOCAL_PROJECT_CONFIGS.popitem(last=False)
+    return Promise.resolve(project_config)
+
+
+def drop_local_project_config(project_id: str | None = None):
+    """Drop the cached config of a project, or of all projects"""
+    if project_id is None:
+        _LOCAL_PROJECT_CONFIGS.clear()
+    else:
+        _LOCAL_PROJECT_CONFIGS.pop(project_id, None)
+
+
+async def invalidate_project_config(project_id: str):
+    """Call after changing the profile config of a project, every process
+    reloads it on its next use."""
+    drop_local_project_config(project_id)
+    async with get_redis_client() as client:
+        await client.publish(PROJECT_CONFIG_INVALIDATE_CHANNEL, project_id)
+
+
+async def listen_project_config_invalidation(stop_event: asyncio.Event):
+    """Drop the cached configs of the projects published to
+    `PROJECT_CONFIG_INVALIDATE_CHANNEL`, until `stop_event` is set."""
+    async with get_redis_client() as client:
+        async with client.pubsub() as pubsub:
+            await pubsub.subscribe(PROJECT_CONFIG_INVALIDATE_CHANNEL)
+            # Entries cached while not subscribed may have missed their message
+            drop_local_project_config()
+            while not stop_event.is_set():
+                message = await pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=1.0
+                )
+                if message is not None:
+                    LOG.info(f"Invalidate the config of project {message['data']}")
+                    drop_local_project_config(message["data"])
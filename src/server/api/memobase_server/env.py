@@ -39,6 +39,13 @@ class ProjectStatus:
     suspended = "suspended"
 
 
+class FlushJobStatus:
+    pending = "pending"
+    processing = "processing"
+    done = "done"
+    failed = "failed"
+
+
 USAGE_TOKEN_LIMIT_MAP = {
     ProjectStatus.active: int(os.getenv("USAGE_TOKEN_LIMIT_ACTIVE", -1)),
     ProjectStatus.pro: int(os.getenv("USAGE_TOKEN_LIMIT_PRO", -1)),
@@ -73,10 +80,44 @@ class Config:
     system_prompt: str = None
     buffer_flush_interval: int = 60 * 60  # 1 hour
     max_chat_blob_buffer_token_size: int = 1024
+    max_insert_many_blobs: int = 1000
     max_profile_subtopics: int = 15
     max_pre_profile_token_size: int = 128
     llm_tab_separator: str = "::"
     cache_user_profiles_ttl: int = 60 * 20  # 20 minutes
+    # Cached profiles older than this are served while they are reloaded
+    cache_user_profiles_fresh_ttl: int = 60
+    cache_user_profiles_local_size: int = 1_000
+    cache_user_profiles_local_ttl: float = 2.0
+    cache_user_profiles_fill_timeout: float = 1.0
+    # Project secrets and statuses cached in each process, changes are
+    # published to drop them earlier, see `invalidate_project_auth`
+    auth_local_cache_ttl: int = 60
+    auth_local_cache_size: int = 10_000
+    # Parsed project profile configs and their prompts cached in each process,
+    # changes are published to drop them earlier, see `invalidate_project_config`
+    project_config_local_ttl: int = 60
+    project_config_local_size: int = 10_000
+    billing_cache_ttl: int = 60
+    billing_local_cache_ttl: int = 5
+    billing_flush_interval: float = 5.0
+    telemetry_flush_interval: float = 1.0
+    telemetry_batch_size: int = 1000
+
+    # Async DB pool of each process, size it to the concurrent requests + workers
+    async_db_pool_size: int = 20
+    async_db_max_overflow: int = 20
+
+    # Buffer flush workers
+    buffer_flush_in_background: bool = True
+    flush_worker_num: int = 2
+    flush_worker_poll_interval: float = 1.0
+    flush_job_timeout: int = 60 * 10  # 10 minutes
+    flush_job_max_attempts: int = 3
+    flush_job_retry_delay: float = 5.0
+    buffer_sweep_interval: int = 60  # 0 to disable the idle buffer sweeper
+    buffer_sweep_batch_size: int = 100
+    buffer_sweep_concurrency: int = 4
 
     # LLM
     language: Literal["en", "zh"] = "en"
@@ -87,6 +128,21 @@ class Config:
     llm_openai_default_header: dict[str, str] = None
     best_llm_model: str = "gpt-4o-mini"
     summary_llm_model: str = None
+    # Cache completions of these prompt ids, e.g. ["extract_profile", "merge_profile"]
+    llm_cache_prompt_ids: list[str] = field(default_factory=list)
+    llm_cache_ttl: int = 24 * 3600
+    llm_cache_max_entries: int = 100_000
+    # In-flight LLM calls of one process, overall and per project
+    llm_max_concurrency: int = 32
+    llm_project_max_concurrency: int = 8
+    # Request/token per minute budgets shared by all processes through Redis
+    llm_rpm_limit: Optional[int] = None
+    llm_tpm_limit: Optional[int] = None
+    llm_project_rpm_limit: Optional[int] = None
+    llm_project_tpm_limit: Optional[int] = None
+    llm_rate_max_wait: float = 60.0
+    llm_max_retries: int = 3
+    llm_retry_base_delay: float = 1.0
 
     enable_event_embedding: bool = True
     embedding_provider: Literal["openai", "jina"] = "openai"
@@ -95,11 +151,34 @@ class Config:
     embedding_dim: int = 1536
     embedding_model: str = "text-embedding-3-small"
     embedding_max_token_size: int = 8192
+    # Micro-batching of concurrent embedding calls, 0 to disable
+    embedding_batch_wait_ms: float = 5.0
+    embedding_batch_max_size: int = 256
+    embedding_batch_max_tokens: int = 100_000
+    # Embedding cache, keyed by the model, phase and sha256 of the text
+    enable_embedding_cache: bool = True
+    embedding_cache_local_size: int = 2_000
+    embedding_cache_ttl: int = 7 * 24 * 3600
+    embedding_cache_max_entries: int = 50_000
+    # HNSW search of event embeddings, see pgvector's hnsw.ef_search/iterative_scan
+    event_search_ef_search: int = 100
+    # Needs pgvector >= 0.8, set to None on older versions
+    event_search_iterative_scan: Optional[Literal["strict_order", "relaxed_order"]] = (
+        "relaxed_order"
+    )
 
     additional_user_profiles: list[dict] = field(default_factory=list)
     overwrite_user_profiles: Optional[list[dict]] = None
     profile_strict_mode: bool = False
     profile_validate_mode: bool = True
+    # Facts merged by one LLM call, 1 to merge every fact on its own
+    profile_merge_batch_size: int = 10
+    # How `chats` pick the related profiles of a context: "embedding" ranks
+    # them by similarity, "embedding_llm" lets the LLM pick among the nearest
+    # `profile_filter_candidates`, "llm" lets the LLM pick among all of them.
+    # Without `enable_event_embedding` the LLM picks among all of them
+    profile_filter_mode: Literal["embedding", "embedding_llm", "llm"] = "embedding"
+    profile_filter_candidates: int = 30
 
     enable_event_summary: bool = True
     minimum_chats_token_size_for_event_summary: int = 256
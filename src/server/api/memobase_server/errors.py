@@ -1,2 +1,6 @@
 class ExternalAPIError(Exception):
     pass
+
+
+class UserLockTimeout(TimeoutError):
+    """A blocking `user_lock` wasn't acquired in time"""
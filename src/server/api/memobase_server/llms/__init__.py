@@ -1,4 +1,5 @@
 import time
+import asyncio
 from ..prompts.utils import convert_response_to_json
 from ..utils import get_encoded_tokens
 from ..env import CONFIG, LOG
@@ -9,12 +10,25 @@ from ..telemetry import telemetry_manager, CounterMetricName, HistogramMetricNam
 
 from .openai_model_llm import openai_complete
 from .doubao_cache_llm import doubao_cache_complete
+from .cache import (
+    is_cacheable_prompt,
+    llm_cache_key,
+    get_cached_completion,
+    set_cached_completion,
+)
+from .scheduler import (
+    llm_slot,
+    prompt_priority,
+    wait_for_rate_budget,
+    record_output_tokens,
+    is_rate_limit_error,
+    retry_delay,
+)
 
 FACTORIES = {"openai": openai_complete, "doubao_cache": doubao_cache_complete}
 assert CONFIG.llm_style in FACTORIES, f"Unsupported LLM style: {CONFIG.llm_style}"
 
 
-# TODO: add TPM/Rate limiter
 async def llm_complete(
     project_id,
     prompt,
@@ -27,26 +41,52 @@ async def llm_complete(
     use_model = model or CONFIG.best_llm_model
     if json_mode:
         kwargs["response_format"] = {"type": "json_object"}
-    try:
-        start_time = time.time()
-        results = await FACTORIES[CONFIG.llm_style](
-            use_model,
-            prompt,
-            system_prompt=system_prompt,
-            history_messages=history_messages,
-            **kwargs,
+    prompt_id = kwargs.get("prompt_id", None)
+    cache_key = None
+    if is_cacheable_prompt(prompt_id):
+        cache_key = llm_cache_key(
+            use_model, prompt, system_prompt, history_messages, kwargs
         )
-        latency = (time.time() - start_time) * 1000
-    except Exception as e:
-        LOG.error(f"Error in llm_complete: {e}")
-        return Promise.reject(CODE.SERVICE_UNAVAILABLE, f"Error in llm_complete: {e}")
-
+        cached = await get_cached_completion(cache_key, prompt_id)
+        if cached is not None:
+            # Served without a LLM call, so nothing is billed
+            return parse_completion(cached, json_mode)
     in_tokens = len(
         get_encoded_tokens(
-            prompt + system_prompt + "\n".join([m["content"] for m in history_messages])
+            prompt
+            + (system_prompt or "")
+            + "\n".join([m["content"] for m in history_messages])
         )
     )
+    try:
+        async with llm_slot(project_id, prompt_priority(prompt_id)):
+            for attempt in range(CONFIG.llm_max_retries + 1):
+                await wait_for_rate_budget(project_id, in_tokens)
+                try:
+                    start_time = time.time()
+                    results = await FACTORIES[CONFIG.llm_style](
+                        use_model,
+                        prompt,
+                        system_prompt=system_prompt,
+                        history_messages=history_messages,
+                        **kwargs,
+                    )
+                    latency = (time.time() - start_time) * 1000
+                    break
+                except Exception as e:
+                    if attempt == CONFIG.llm_max_retries or not is_rate_limit_error(e):
+                        raise
+                    delay = retry_delay(attempt)
+                    LOG.warning(
+                        f"LLM rate limited ({prompt_id}), retry {attempt + 1} in {delay:.1f}s: {e}"
+                    )
+                    await asyncio.sleep(delay)
+    except Exception as e:
+        LOG.error(f"Error in llm_complete: {e}")
+        return Promise.reject(CODE.SERVICE_UNAVAILABLE, f"Error in llm_complete: {e}")
+
     out_tokens = len(get_encoded_tokens(results))
+    await record_output_tokens(project_id, out_tokens)
 
     await project_cost_token_billing(project_id, in_tokens, out_tokens)
 
@@ -71,6 +111,14 @@ async def llm_complete(
         {"project_id": project_id},
     )
 
+    p = parse_completion(results, json_mode)
+    # Don't cache an unparsable response, a retry should ask the LLM again
+    if cache_key is not None and p.ok():
+        await set_cached_completion(cache_key, results)
+    return p
+
+
+def parse_completion(results: str, json_mode: bool) -> Promise[str | dict]:
     if not json_mode:
         return Promise.resolve(results)
     parse_dict = convert_response_to_json(results)
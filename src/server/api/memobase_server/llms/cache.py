@@ -0,0 +1,69 @@
+import json
+import hashlib
+from ..env import CONFIG, LOG
+from ..connectors import get_redis_client
+from ..utils import set_capped_cache
+from ..telemetry import telemetry_manager, CounterMetricName
+
+LLM_CACHE_INDEX_KEY = "memobase::llm_cache::index"
+
+
+def is_cacheable_prompt(prompt_id: str | None) -> bool:
+    return prompt_id is not None and prompt_id in CONFIG.llm_cache_prompt_ids
+
+
+def llm_cache_key(
+    model: str,
+    prompt: str,
+    system_prompt: str | None,
+    history_messages: list[dict],
+    kwargs: dict,
+) -> str:
+    payload = json.dumps(
+        {
+            "llm_style": CONFIG.llm_style,
+            "model": model,
+            "system_prompt": system_prompt,
+            "prompt": prompt,
+            "history_messages": history_messages,
+            "kwargs": kwargs,
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str,
+    )
+    digest = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    return f"memobase::llm_cache::{digest}"
+
+
+async def get_cached_completion(key: str, prompt_id: str) -> str | None:
+    try:
+        async with get_redis_client() as redis_client:
+            cached = await redis_client.get(key)
+    except Exception as e:
+        LOG.warning(f"LLM cache lookup failed: {e}")
+        cached = None
+    telemetry_manager.increment_counter_metric(
+        (
+            CounterMetricName.LLM_CACHE_HITS
+            if cached is not None
+            else CounterMetricName.LLM_CACHE_MISSES
+        ),
+        1,
+        {"prompt_id": prompt_id},
+    )
+    return cached
+
+
+async def set_cached_completion(key: str, completion: str):
+    try:
+        async with get_redis_client() as redis_client:
+            await set_capped_cache(
+                redis_client,
+                LLM_CACHE_INDEX_KEY,
+                {key: completion},
+                CONFIG.llm_cache_ttl,
+                CONFIG.llm_cache_max_entries,
+            )
+    except Exception as e:
+        LOG.warning(f"LLM cache write failed: {e}")
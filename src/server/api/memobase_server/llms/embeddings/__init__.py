@@ -9,7 +9,9 @@ from ...models.database import DEFAULT_PROJECT_ID
 from .jina_embedding import jina_embedding
 from .openai_embedding import openai_embedding
 from ...telemetry import telemetry_manager, HistogramMetricName, CounterMetricName
-from ...utils import get_encoded_tokens
+from ...utils import get_encoded_tokens, get_decoded_tokens
+from .batcher import EmbeddingBatcher
+from .cache import embedding_cache_key, get_cached_embeddings, set_cached_embeddings
 
 FACTORIES = {"openai": openai_embedding, "jina": jina_embedding}
 assert (
@@ -17,11 +19,27 @@ assert (
 ), f"Unsupported embedding provider: {CONFIG.embedding_provider}"
 
 
+async def call_provider(
+    model: str, texts: list[str], phase: Literal["query", "document"]
+) -> np.ndarray:
+    """One request to the embedding provider, batched or not"""
+    telemetry_manager.increment_counter_metric(
+        CounterMetricName.EMBEDDING_API_CALLS, 1, {"phase": phase}
+    )
+    return await FACTORIES[CONFIG.embedding_provider](model, texts, phase)
+
+
+EMBEDDING_BATCHER = EmbeddingBatcher(call_provider)
+
+
 async def check_embedding_sanity():
     if not CONFIG.enable_event_embedding:
         LOG.info("Event embedding is disabled, skipping sanity check.")
         return
-    r = await get_embedding(DEFAULT_PROJECT_ID, ["Hello, world!"])
+    # Skip the cache, the check must reach the provider
+    r = await _embed_texts(
+        DEFAULT_PROJECT_ID, ["Hello, world!"], "document", CONFIG.embedding_model
+    )
     if not r.ok():
         raise ValueError(
             "Embedding API check failed! Make sure the embedding API key is valid."
@@ -42,14 +60,47 @@ async def get_embedding(
     model: str = None,
 ) -> Promise[np.ndarray]:
     model = model or CONFIG.embedding_model
+    if not CONFIG.enable_embedding_cache:
+        return await _embed_texts(project_id, texts, phase, model)
+    keys = [embedding_cache_key(model, phase, text) for text in texts]
+    vectors = await get_cached_embeddings(list(dict.fromkeys(keys)))
+    missing = {key: text for key, text in zip(keys, texts) if key not in vectors}
+    if missing:
+        p = await _embed_texts(project_id, list(missing.values()), phase, model)
+        if not p.ok():
+            return p
+        fresh = dict(zip(missing.keys(), p.data()))
+        await set_cached_embeddings(fresh)
+        vectors.update(fresh)
+    return Promise.resolve(np.stack([vectors[key] for key in keys]))
+
+
+async def _embed_texts(
+    project_id: str,
+    texts: list[str],
+    phase: Literal["query", "document"],
+    model: str,
+) -> Promise[np.ndarray]:
+    truncated_texts, token_sizes = [], []
+    for text in texts:
+        tokens = get_encoded_tokens(text)
+        if len(tokens) > CONFIG.embedding_max_token_size:
+            tokens = tokens[: CONFIG.embedding_max_token_size]
+            text = get_decoded_tokens(tokens)
+        truncated_texts.append(text)
+        token_sizes.append(len(tokens))
+    texts = truncated_texts
     try:
         start_time = time.time()
-        results = await FACTORIES[CONFIG.embedding_provider](model, texts, phase)
+        if CONFIG.embedding_batch_wait_ms > 0:
+            results = await EMBEDDING_BATCHER.embed(model, texts, token_sizes, phase)
+        else:
+            results = await call_provider(model, texts, phase)
         latency_ms = (time.time() - start_time) * 1000
     except Exception as e:
         LOG.error(f"Error in get_embedding: {e} {format_exc()}")
         return Promise.reject(CODE.SERVICE_UNAVAILABLE, f"Error in get_embedding: {e}")
-    embedding_tokens = len(get_encoded_tokens("\n".join(texts)))
+    embedding_tokens = sum(token_sizes)
     telemetry_manager.increment_counter_metric(
         CounterMetricName.EMBEDDING_TOKENS,
         embedding_tokens,
@@ -0,0 +1,89 @@
+import asyncio
+import numpy as np
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Literal
+from ...env import CONFIG, LOG
+
+EmbeddingFunc = Callable[[str, list[str], str], Awaitable[np.ndarray]]
+
+
+@dataclass
+class PendingBatch:
+    texts: list[str] = field(default_factory=list)
+    futures: list[asyncio.Future] = field(default_factory=list)
+    token_size: int = 0
+    timer: asyncio.TimerHandle | None = None
+
+
+class EmbeddingBatcher:
+    """Collect texts of concurrent callers and embed them in one provider call.
+
+    A batch is sent after `embedding_batch_wait_ms`, or right away once it
+    holds `embedding_batch_max_size` texts or `embedding_batch_max_tokens`
+    tokens. Each caller gets its own rows of the returned array.
+    """
+
+    def __init__(self, embed_func: EmbeddingFunc):
+        self._embed_func = embed_func
+        # (model, phase) -> the batch waiting to be sent
+        self._pending: dict[tuple[str, str], PendingBatch] = {}
+        self._running: set[asyncio.Task] = set()
+
+    async def embed(
+        self,
+        model: str,
+        texts: list[str],
+        token_sizes: list[int],
+        phase: Literal["query", "document"],
+    ) -> np.ndarray:
+        loop = asyncio.get_running_loop()
+        key = (model, phase)
+        futures = []
+        for text, token_size in zip(texts, token_sizes):
+            batch = self._pending.get(key)
+            if batch is not None and (
+                batch.token_size + token_size > CONFIG.embedding_batch_max_tokens
+            ):
+                self._send(key)
+                batch = None
+            if batch is None:
+                batch = PendingBatch()
+                batch.timer = loop.call_later(
+                    CONFIG.embedding_batch_wait_ms / 1000, self._send, key
+                )
+                self._pending[key] = batch
+            future = loop.create_future()
+            batch.texts.append(text)
+            batch.futures.append(future)
+            batch.token_size += token_size
+            futures.append(future)
+            if len(batch.texts) >= CONFIG.embedding_batch_max_size:
+                self._send(key)
+        return np.stack(await asyncio.gather(*futures))
+
+    def _send(self, key: tuple[str, str]):
+        batch = self._pending.pop(key, None)
+        if batch is None:
+            return
+        batch.timer.cancel()
+        task = asyncio.create_task(self._run(key, batch))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, key: tuple[str, str], batch: PendingBatch):
+        model, phase = key
+        try:
+            results = await self._embed_func(model, batch.texts, phase)
+            if len(results) != len(batch.texts):
+                raise ValueError(
+                    f"Expect {len(batch.texts)} embeddings, got {len(results)}"
+                )
+        except Exception as e:
+            LOG.error(f"Embedding batch of {len(batch.texts)} texts failed: {e}")
+            for future in batch.futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for future, row in zip(batch.futures, results):
+            if not future.done():
+                future.set_result(row)
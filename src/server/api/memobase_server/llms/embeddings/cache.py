@@ -0,0 +1,91 @@
+import hashlib
+import numpy as np
+from collections import OrderedDict
+from ...env import CONFIG, LOG
+from ...connectors import get_redis_binary_client
+from ...utils import set_capped_cache
+from ...telemetry import telemetry_manager, CounterMetricName
+
+# cache key -> float32 vector, least recently used first
+_LOCAL_EMBEDDINGS: OrderedDict[str, np.ndarray] = OrderedDict()
+
+EMBEDDING_CACHE_INDEX_KEY = "memobase::embedding_cache::index"
+
+
+def embedding_cache_key(model: str, phase: str, text: str) -> str:
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    return f"memobase::embedding_cache::{CONFIG.embedding_provider}::{model}::{CONFIG.embedding_dim}::{phase}::{digest}"
+
+
+def _set_local(key: str, vector: np.ndarray):
+    if CONFIG.embedding_cache_local_size <= 0:
+        return
+    _LOCAL_EMBEDDINGS[key] = vector
+    _LOCAL_EMBEDDINGS.move_to_end(key)
+    while len(_LOCAL_EMBEDDINGS) > CONFIG.embedding_cache_local_size:
+        _LOCAL_EMBEDDINGS.popitem(last=False)
+
+
+async def get_cached_embeddings(keys: list[str]) -> dict[str, np.ndarray]:
+    """Look up the keys in memory, then in Redis. Return the found vectors.
+
+    Redis errors are logged and count as misses.
+    """
+    found = {}
+    for key in keys:
+        if key in _LOCAL_EMBEDDINGS:
+            _LOCAL_EMBEDDINGS.move_to_end(key)
+            found[key] = _LOCAL_EMBEDDINGS[key]
+    local_hits = len(found)
+
+    remote_keys = [key for key in keys if key not in found]
+    if remote_keys:
+        try:
+            async with get_redis_binary_client() as redis_client:
+                values = await redis_client.mget(remote_keys)
+        except Exception as e:
+            LOG.warning(f"Embedding cache lookup failed: {e}")
+            values = [None] * len(remote_keys)
+        for key, value in zip(remote_keys, values):
+            if value is None:
+                continue
+            vector = np.frombuffer(value, dtype=np.float32)
+            found[key] = vector
+            _set_local(key, vector)
+
+    if local_hits:
+        telemetry_manager.increment_counter_metric(
+            CounterMetricName.EMBEDDING_CACHE_HITS, local_hits, {"tier": "local"}
+        )
+    if len(found) > local_hits:
+        telemetry_manager.increment_counter_metric(
+            CounterMetricName.EMBEDDING_CACHE_HITS,
+            len(found) - local_hits,
+            {"tier": "redis"},
+        )
+    if len(keys) > len(found):
+        telemetry_manager.increment_counter_metric(
+            CounterMetricName.EMBEDDING_CACHE_MISSES, len(keys) - len(found)
+        )
+    return found
+
+
+async def set_cached_embeddings(vectors: dict[str, np.ndarray]):
+    if not vectors:
+        return
+    vectors = {
+        key: np.asarray(vector, dtype=np.float32) for key, vector in vectors.items()
+    }
+    for key, vector in vectors.items():
+        _set_local(key, vector)
+    try:
+        async with get_redis_binary_client() as redis_client:
+            await set_capped_cache(
+                redis_client,
+                EMBEDDING_CACHE_INDEX_KEY,
+                {key: vector.tobytes() for key, vector in vectors.items()},
+                CONFIG.embedding_cache_ttl,
+                CONFIG.embedding_cache_max_entries,
+            )
+    except Exception as e:
+        LOG.warning(f"Embedding cache write failed: {e}")
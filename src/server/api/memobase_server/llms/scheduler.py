@@ -0,0 +1,179 @@
+import time
+import heapq
+import random
+import asyncio
+import itertools
+from contextlib import asynccontextmanager
+from ..env import CONFIG, LOG
+from ..connectors import get_redis_client
+
+INTERACTIVE = 0
+BACKGROUND = 1
+# Prompts on the request path of the API, they go ahead of the flushes
+INTERACTIVE_PROMPT_IDS = {"pick_related_profiles"}
+
+# KEYS are token buckets, ARGV[1] is now, then (capacity per minute, amount)
+# for each bucket. Take the amounts from all buckets or from none, and return
+# the seconds to wait for the bucket that is shortest of budget.
+# ARGV[2] == 1 takes the amounts regardless, for costs known after the call.
+TAKE_BUCKETS_SCRIPT = """
+local now = tonumber(ARGV[1])
+local force = tonumber(ARGV[2]) == 1
+local levels = {}
+local wait = 0
+for i = 1, #KEYS do
+    local capacity = tonumber(ARGV[1 + i * 2])
+    local amount = tonumber(ARGV[2 + i * 2])
+    local bucket = redis.call('HMGET', KEYS[i], 'level', 'ts')
+    local level = tonumber(bucket[1]) or capacity
+    local ts = tonumber(bucket[2]) or now
+    level = math.min(capacity, level + (now - ts) * capacity / 60)
+    levels[i] = level
+    if level < math.min(amount, capacity) then
+        wait = math.max(wait, (math.min(amount, capacity) - level) * 60 / capacity)
+    end
+end
+if wait > 0 and not force then
+    return tostring(wait)
+end
+for i = 1, #KEYS do
+    redis.call('HSET', KEYS[i], 'level', levels[i] - tonumber(ARGV[2 + i * 2]), 'ts', now)
+    redis.call('EXPIRE', KEYS[i], 120)
+end
+return '0'
+"""
+
+
+def prompt_priority(prompt_id: str | None) -> int:
+    return INTERACTIVE if prompt_id in INTERACTIVE_PROMPT_IDS else BACKGROUND
+
+
+class PrioritySemaphore:
+    """A semaphore that wakes the waiters of lower priority values first."""
+
+    def __init__(self, value: int):
+        self.max_value = value
+        self._value = value
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+
+    def idle(self) -> bool:
+        return self._value == self.max_value and not self._waiters
+
+    async def acquire(self, priority: int):
+        if self._value > 0 and not self._waiters:
+            self._value -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Woken up and cancelled at once, pass the slot on
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._value += 1
+
+
+_GLOBAL_SEMAPHORE: PrioritySemaphore | None = None
+_PROJECT_SEMAPHORES: dict[str, PrioritySemaphore] = {}
+
+
+@asynccontextmanager
+async def llm_slot(project_id: str, priority: int):
+    """Hold one of the in-flight LLM slots of this process and of the project."""
+    global _GLOBAL_SEMAPHORE
+    if _GLOBAL_SEMAPHORE is None:
+        _GLOBAL_SEMAPHORE = PrioritySemaphore(CONFIG.llm_max_concurrency)
+    project_semaphore = _PROJECT_SEMAPHORES.get(project_id)
+    if project_semaphore is None:
+        project_semaphore = PrioritySemaphore(CONFIG.llm_project_max_concurrency)
+        _PROJECT_SEMAPHORES[project_id] = project_semaphore
+    # The project slot first, so a busy project doesn't hold the global slots
+    await project_semaphore.acquire(priority)
+    try:
+        await _GLOBAL_SEMAPHORE.acquire(priority)
+        try:
+            yield
+        finally:
+            _GLOBAL_SEMAPHORE.release()
+    finally:
+        project_semaphore.release()
+        if project_semaphore.idle():
+            _PROJECT_SEMAPHORES.pop(project_id, None)
+
+
+def _rate_buckets(
+    project_id: str, tokens: int, requests: int = 1
+) -> tuple[list[str], list[int]]:
+    keys, args = [], []
+    for scope, rpm, tpm in (
+        ("global", CONFIG.llm_rpm_limit, CONFIG.llm_tpm_limit),
+        (
+            f"project::{project_id}",
+            CONFIG.llm_project_rpm_limit,
+            CONFIG.llm_project_tpm_limit,
+        ),
+    ):
+        if rpm is not None:
+            keys.append(f"memobase::llm_rate::{scope}::rpm")
+            args.extend([rpm, requests])
+        if tpm is not None:
+            keys.append(f"memobase::llm_rate::{scope}::tpm")
+            args.extend([tpm, tokens])
+    return keys, args
+
+
+async def wait_for_rate_budget(project_id: str, tokens: int):
+    """Take one request and `tokens` tokens from the Redis token buckets of the
+    RPM/TPM limits, waiting until they refill. Shared by all processes."""
+    keys, args = _rate_buckets(project_id, tokens)
+    if not keys:
+        return
+    deadline = time.monotonic() + CONFIG.llm_rate_max_wait
+    async with get_redis_client() as redis_client:
+        take_script = redis_client.register_script(TAKE_BUCKETS_SCRIPT)
+        while True:
+            wait = float(
+                await take_script(keys=keys, args=[time.time(), 0, *args])
+            )
+            if wait <= 0:
+                return
+            if time.monotonic() + wait > deadline:
+                LOG.warning(
+                    f"LLM rate budget of project {project_id} exhausted, sending anyway"
+                )
+                await take_script(keys=keys, args=[time.time(), 1, *args])
+                return
+            # Jitter so that waiting processes don't retry in lockstep
+            await asyncio.sleep(wait + random.uniform(0, 0.1))
+
+
+async def record_output_tokens(project_id: str, tokens: int):
+    """Charge the output tokens, only known after the call, to the TPM buckets."""
+    if CONFIG.llm_tpm_limit is None and CONFIG.llm_project_tpm_limit is None:
+        return
+    keys, args = _rate_buckets(project_id, tokens, requests=0)
+    try:
+        async with get_redis_client() as redis_client:
+            take_script = redis_client.register_script(TAKE_BUCKETS_SCRIPT)
+            await take_script(keys=keys, args=[time.time(), 1, *args])
+    except Exception as e:
+        LOG.warning(f"Failed to record LLM output tokens: {e}")
+
+
+def is_rate_limit_error(e: Exception) -> bool:
+    return getattr(e, "status_code", None) == 429 or "RateLimit" in type(e).__name__
+
+
+def retry_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, CONFIG.llm_retry_base_delay * 2**attempt)
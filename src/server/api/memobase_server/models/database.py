@@ -6,6 +6,8 @@ from sqlalchemy import (
     text,
     VARCHAR,
     Integer,
+    BigInteger,
+    Identity,
     ForeignKey,
     TIMESTAMP,
     Table,
@@ -28,7 +30,14 @@ from sqlalchemy.orm import (
 from sqlalchemy.sql import func
 from sqlalchemy import event
 from .blob import BlobType
-from ..env import ProjectStatus, BillingStatus, BILLING_REFILL_AMOUNT_MAP, CONFIG, LOG
+from ..env import (
+    ProjectStatus,
+    BillingStatus,
+    FlushJobStatus,
+    BILLING_REFILL_AMOUNT_MAP,
+    CONFIG,
+    LOG,
+)
 from sqlalchemy.orm.attributes import get_history
 from pgvector.sqlalchemy import Vector
 
@@ -287,6 +296,11 @@ class BufferZone(Base):
     # Specific columns
     blob_type: Mapped[str] = mapped_column(VARCHAR(255), nullable=False)
     token_size: Mapped[int] = mapped_column(Integer, nullable=False)
+    # Insert order of the buffers, assigned by the DB. Blobs are flushed in
+    # this order, inserts don't need to be serialized to keep it
+    seq: Mapped[int] = mapped_column(
+        BigInteger, Identity(), nullable=False, init=False
+    )
 
     # Relationships
     user_id: Mapped[UUID] = mapped_column(
@@ -303,6 +317,13 @@ class BufferZone(Base):
         VARCHAR(64),
         default=DEFAULT_PROJECT_ID,
     )
+
+    # Set when a flush claims this buffer, NULL means waiting in the buffer
+    flush_id: Mapped[Optional[UUID]] = mapped_column(
+        UUID(as_uuid=True),
+        nullable=True,
+        default=None,
+    )
     user: Mapped[User] = relationship(
         "User",
         back_populates="related_buffers",
@@ -323,6 +344,8 @@ class BufferZone(Base):
         Index(
             "idx_buffer_zones_user_id_blob_type", "user_id", "project_id", "blob_type"
         ),
+        Index("idx_buffer_zones_flush_id", "flush_id"),
+        Index("idx_buffer_zones_created_at", "created_at"),
         ForeignKeyConstraint(
             ["user_id", "project_id"],
             ["users.id", "users.project_id"],
@@ -345,6 +368,69 @@ class BufferZone(Base):
         self.blob_type = self.blob_type.value
 
 
+@REG.mapped_as_dataclass
+class BufferFlushJob(Base):
+    __tablename__ = "buffer_flush_jobs"
+
+    # Specific columns
+    blob_type: Mapped[str] = mapped_column(VARCHAR(255), nullable=False)
+
+    # Relationships
+    user_id: Mapped[UUID] = mapped_column(
+        UUID(as_uuid=True),
+        nullable=False,
+    )
+
+    project_id: Mapped[str] = mapped_column(
+        VARCHAR(64),
+        default=DEFAULT_PROJECT_ID,
+    )
+
+    status: Mapped[str] = mapped_column(
+        VARCHAR(16), nullable=False, default=FlushJobStatus.pending
+    )
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    # A pending job isn't claimed before this time, set when it's retried
+    run_after: Mapped[Optional[datetime]] = mapped_column(
+        TIMESTAMP(timezone=True), nullable=True, default=None
+    )
+    result: Mapped[Optional[dict]] = mapped_column(JSONB, nullable=True, default=None)
+    error: Mapped[Optional[str]] = mapped_column(TEXT, nullable=True, default=None)
+
+    __table_args__ = (
+        PrimaryKeyConstraint("id", "project_id"),
+        Index("idx_buffer_flush_jobs_status_created_at", "status", "created_at"),
+        # At most one pending job per buffer, it flushes everything once started
+        Index(
+            "uq_buffer_flush_jobs_pending",
+            "user_id",
+            "project_id",
+            "blob_type",
+            unique=True,
+            postgresql_where=text(f"status = '{FlushJobStatus.pending}'"),
+        ),
+        Index(
+            "idx_buffer_flush_jobs_user_id_blob_type",
+            "user_id",
+            "project_id",
+            "blob_type",
+        ),
+        ForeignKeyConstraint(
+            ["user_id", "project_id"],
+            ["users.id", "users.project_id"],
+            ondelete="CASCADE",
+            onupdate="CASCADE",
+        ),
+    )
+
+    # validate
+    def __post_init__(self):
+        assert isinstance(
+            self.blob_type, BlobType
+        ), f"Invalid blob type: {self.blob_type}"
+        self.blob_type = self.blob_type.value
+
+
 @REG.mapped_as_dataclass
 class UserProfile(Base):
     __tablename__ = "user_profiles"
@@ -365,6 +451,17 @@ class UserProfile(Base):
         default=DEFAULT_PROJECT_ID,
     )
 
+    # Tokens of the profile's context line, NULL until the next write of older rows
+    token_size: Mapped[Optional[int]] = mapped_column(
+        Integer, nullable=True, default=None
+    )
+    # Embedding of the profile's context line, written after the profile is
+    # committed and cleared when its content changes. Deferred, profile reads
+    # don't need it
+    embedding: Mapped[Vector] = mapped_column(
+        Vector(dim=CONFIG.embedding_dim), nullable=True, default=None, deferred=True
+    )
+
     user: Mapped[User] = relationship(
         "User",
         back_populates="related_user_profiles",
@@ -415,6 +512,11 @@ class UserEvent(Base):
         Vector(dim=CONFIG.embedding_dim), nullable=True, default=None
     )
 
+    # Tokens of the event in the context, NULL until the next write of older rows
+    token_size: Mapped[Optional[int]] = mapped_column(
+        Integer, nullable=True, default=None
+    )
+
     __table_args__ = (
         PrimaryKeyConstraint("id", "project_id"),
         Index("idx_user_events_user_id_project_id", "user_id", "project_id"),
@@ -425,6 +527,20 @@ class UserEvent(Base):
             ondelete="CASCADE",
             onupdate="CASCADE",
         ),
+        *(
+            # pgvector can't build HNSW indexes over 2000 dimensions
+            [
+                Index(
+                    "idx_user_events_embedding_hnsw",
+                    "embedding",
+                    postgresql_using="hnsw",
+                    postgresql_with={"m": 16, "ef_construction": 64},
+                    postgresql_ops={"embedding": "vector_cosine_ops"},
+                )
+            ]
+            if CONFIG.embedding_dim <= 2000
+            else []
+        ),
     )
 
     @classmethod
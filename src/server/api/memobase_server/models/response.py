@@ -63,6 +63,22 @@ class ChatModalResponse(BaseModel):
     )
 
 
+class FlushJobData(BaseModel):
+    id: UUID = Field(..., description="The flush job's unique identifier")
+    blob_type: str = Field(..., description="The buffer type this job flushes")
+    status: str = Field(
+        ..., description="Job status, one of pending/processing/done/failed"
+    )
+    chat_results: Optional[list[ChatModalResponse]] = Field(
+        None, description="List of chat modal data, available when the job is done"
+    )
+    error: Optional[str] = Field(None, description="Error message if the job failed")
+    created_at: datetime = Field(None, description="Timestamp when the job was created")
+    updated_at: datetime = Field(
+        None, description="Timestamp when the job was last updated"
+    )
+
+
 class ProfileData(BaseModel):
     id: UUID = Field(..., description="The profile's unique identifier")
     content: str = Field(..., description="User profile content value")
@@ -76,6 +92,9 @@ class ProfileData(BaseModel):
         None,
         description="User profile attributes in JSON, containing 'topic', 'sub_topic'",
     )
+    token_size: Optional[int] = Field(
+        None, description="Token count of the profile in the user context"
+    )
 
 
 class ProfileDelta(BaseModel):
@@ -109,6 +128,9 @@ class UserEventData(BaseModel):
         None, description="Timestamp when the event was last updated"
     )
     similarity: Optional[float] = Field(None, description="Similarity score")
+    token_size: Optional[int] = Field(
+        None, description="Token count of the event in the user context"
+    )
 
 
 class ContextData(BaseModel):
@@ -160,6 +182,16 @@ class BillingData(BaseModel):
     )
 
 
+class UserBlobData(BlobData):
+    user_id: UUID = Field(..., description="The ID of the user to insert the blob for")
+
+
+class BlobInsertManyRequest(BaseModel):
+    blobs: list[UserBlobData] = Field(
+        ..., description="The blobs to insert, can belong to different users"
+    )
+
+
 class UserContextImport(BaseModel):
     context: str = Field(
         ..., description="The user context you want to import to Memobase"
@@ -233,13 +265,49 @@ class ChatModalAPIResponse(BaseResponse):
     )
 
 
+class BufferInsertData(BaseModel):
+    chat_results: list[ChatModalResponse] = Field(
+        default_factory=list, description="List of chat modal data"
+    )
+    flush_job_ids: list[UUID] = Field(
+        default_factory=list,
+        description="IDs of the buffer flush jobs triggered by this insert",
+    )
+
+
 class BlobInsertData(IdData):
     chat_results: Optional[list[ChatModalResponse]] = Field(
         None, description="List of chat modal data"
     )
+    flush_job_ids: Optional[list[UUID]] = Field(
+        None,
+        description="IDs of the buffer flush jobs triggered by this insert, poll them for chat results",
+    )
+
+
+class BlobInsertManyData(IdsData):
+    chat_results: Optional[list[ChatModalResponse]] = Field(
+        None, description="List of chat modal data"
+    )
+    flush_job_ids: Optional[list[UUID]] = Field(
+        None,
+        description="IDs of the buffer flush jobs triggered by this insert, poll them for chat results",
+    )
+
+
+class FlushJobResponse(BaseResponse):
+    data: Optional[FlushJobData] = Field(
+        None, description="Response containing flush job data"
+    )
 
 
 class BlobInsertResponse(BaseResponse):
     data: Optional[BlobInsertData] = Field(
         None, description="Response containing blob insert data"
     )
+
+
+class BlobInsertManyResponse(BaseResponse):
+    data: Optional[BlobInsertManyData] = Field(
+        None, description="Response containing the inserted blob ids in request order"
+    )
@@ -208,6 +208,28 @@ That's all, now perform your job.
 """
 
 
+BATCH_ADD_KWARGS = {
+    "prompt_id": "merge_profile_batch",
+}
+
+BATCH_MERGE_FACTS_PROMPT = """
+## Batch mode
+In this task you will be given several numbered memo pairs at once, each one inside `<memo index="N">` and in the input format above.
+Handle every pair on its own with the guidelines above, the pairs don't affect each other.
+
+Think step by step for all pairs first, then output one result line for every pair after `---`, prefixed with its index:
+<template>
+THOUGHT
+---
+- 1{tab}UPDATE{tab}MEMO
+- 2{tab}ABORT{tab}invalid
+...
+</template>
+Each line must start with `- `, then the index of the pair, then `UPDATE{tab}MEMO` or `ABORT{tab}invalid` as described above.
+Never skip a pair, the output must contain exactly one line for each index.
+"""
+
+
 def get_input(
     topic, subtopic, old_memo, new_memo, update_instruction=None, topic_description=None
 ):
@@ -261,5 +283,34 @@ def get_kwargs() -> dict:
     return ADD_KWARGS
 
 
+def get_batch_input(memos: list[dict]) -> str:
+    """Pack memo pairs, each with the arguments of `get_input`, into one input"""
+    today = datetime.now().astimezone(CONFIG.timezone).strftime("%Y-%m-%d")
+    sections = [
+        f"""<memo index="{i}">
+## Update Instruction
+{memo.get("update_instruction") or "NONE"}
+### Topic Description
+{memo.get("topic_description") or "NONE"}
+## User Topic
+{memo["topic"]}, {memo["subtopic"]}
+## Old Memo
+{memo.get("old_memo") or "NONE"}
+## New Memo
+{memo["new_memo"]}
+</memo>"""
+        for i, memo in enumerate(memos, start=1)
+    ]
+    return f"Today is {today}.\n" + "\n".join(sections)
+
+
+def get_batch_prompt() -> str:
+    return get_prompt() + BATCH_MERGE_FACTS_PROMPT.format(tab=CONFIG.llm_tab_separator)
+
+
+def get_batch_kwargs() -> dict:
+    return BATCH_ADD_KWARGS
+
+
 if __name__ == "__main__":
     print(get_prompt())
@@ -156,6 +156,36 @@ def parse_string_into_merge_action(results: str) -> dict | None:
     }
 
 
+def parse_string_into_merge_actions(results: str, size: int) -> list[dict] | None:
+    """Parse the `- INDEX{tab}ACTION{tab}MEMO` lines of a batched merge.
+
+    Return the actions ordered by index, or None unless every index of
+    1..size has a valid line.
+    """
+    if "---" in results:
+        results = results.split("---")[-1]
+    actions = {}
+    for line in results.split("\n"):
+        if not line.startswith("- "):
+            continue
+        parts = line[2:].split(CONFIG.llm_tab_separator)
+        if not len(parts) == 3:
+            continue
+        try:
+            index = int(parts[0].strip())
+        except ValueError:
+            continue
+        if not 1 <= index <= size or index in actions:
+            continue
+        actions[index] = {
+            "action": parts[1].upper().strip(),
+            "memo": parts[2].strip(),
+        }
+    if len(actions) != size:
+        return None
+    return [actions[i] for i in range(1, size + 1)]
+
+
 def pack_profiles_into_string(profiles: AIUserProfiles) -> str:
     lines = [
         f"- {attribute_unify(p.topic)}{CONFIG.llm_tab_separator}{attribute_unify(p.sub_topic)}{CONFIG.llm_tab_separator}{p.memo.strip()}"
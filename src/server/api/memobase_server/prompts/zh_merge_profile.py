@@ -207,6 +207,28 @@ THOUGHT
 """
 
 
+BATCH_ADD_KWARGS = {
+    "prompt_id": "zh_merge_profile_batch",
+}
+
+BATCH_MERGE_FACTS_PROMPT = """
+## 批量模式
+这次你会一次收到多组带编号的备忘录，每组都在`<memo index="N">`中，格式同上面的输入格式。
+按照上面的指导原则分别处理每一组，各组之间互不影响。
+
+先对所有组逐步思考，然后在`---`之后为每一组输出一行结果，以该组的编号开头：
+<template>
+THOUGHT
+---
+- 1{tab}UPDATE{tab}MEMO
+- 2{tab}ABORT{tab}invalid
+...
+</template>
+每一行必须以`- `开头，然后是该组的编号，然后按上面的说明输出`UPDATE{tab}MEMO`或`ABORT{tab}invalid`。
+不要跳过任何一组，每个编号必须恰好有一行输出。
+"""
+
+
 def get_input(
     topic, subtopic, old_memo, new_memo, update_instruction=None, topic_description=None
 ):
@@ -260,5 +282,34 @@ def get_kwargs() -> dict:
     return ADD_KWARGS
 
 
+def get_batch_input(memos: list[dict]) -> str:
+    """Pack memo pairs, each with the arguments of `get_input`, into one input"""
+    today = datetime.now().astimezone(CONFIG.timezone).strftime("%Y-%m-%d")
+    sections = [
+        f"""<memo index="{i}">
+## 更新说明
+{memo.get("update_instruction") or "NONE"}
+### 主题描述
+{memo.get("topic_description") or "NONE"}
+## 用户主题
+{memo["topic"]}, {memo["subtopic"]}
+## 旧备忘录
+{memo.get("old_memo") or "NONE"}
+## 新备忘录
+{memo["new_memo"]}
+</memo>"""
+        for i, memo in enumerate(memos, start=1)
+    ]
+    return f"今天是{today}。\n" + "\n".join(sections)
+
+
+def get_batch_prompt() -> str:
+    return get_prompt() + BATCH_MERGE_FACTS_PROMPT.format(tab=CONFIG.llm_tab_separator)
+
+
+def get_batch_kwargs() -> dict:
+    return BATCH_ADD_KWARGS
+
+
 if __name__ == "__main__":
     print(get_prompt())
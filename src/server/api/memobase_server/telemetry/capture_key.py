@@ -1,7 +1,18 @@
+import time
+from collections import defaultdict
 from datetime import datetime
+from ..env import CONFIG, LOG
 from ..connectors import get_redis_client, PROJECT_ID
 from ..models.database import DEFAULT_PROJECT_ID
 
+# The EXPIRE of a key is sent once in this period per process
+EXPIRE_REFRESH_SECONDS = 60 * 60
+
+# (key, expire_seconds) -> pending increment, written by `flush_int_keys`
+_PENDING_INCRS: dict[tuple[str, int], int] = defaultdict(int)
+# key -> the last time its EXPIRE was sent
+_EXPIRE_SENT_AT: dict[str, float] = {}
+
 
 def date_key():
     return datetime.now().strftime("%Y-%m-%d")
@@ -15,33 +26,88 @@ def head_key(project_id: str):
     return f"memobase_telemetry::{PROJECT_ID}::{project_id}"
 
 
+def stage_int_key(name: str, value: int, expire_days: int, project_id: str):
+    key = f"{head_key(project_id)}::{name}::{date_key()}"
+    key_month = f"{head_key(project_id)}::{name}::{month_key()}"
+    _PENDING_INCRS[(key, expire_days * 24 * 60 * 60)] += value
+    _PENDING_INCRS[(key_month, 30 * expire_days * 24 * 60 * 60)] += value
+
+
 async def capture_int_key(
     name: str,
     value: int = 1,
     expire_days: int = 14,
     project_id: str = DEFAULT_PROJECT_ID,
 ):
-    key = f"{head_key(project_id)}::{name}::{date_key()}"
-    key_month = f"{head_key(project_id)}::{name}::{month_key()}"
-    async with get_redis_client() as r_c:
-        await r_c.incrby(key, value)
-        await r_c.incrby(key_month, value)
-        await r_c.expire(key, expire_days * 24 * 60 * 60)
-        await r_c.expire(key_month, 30 * expire_days * 24 * 60 * 60)
+    stage_int_key(name, value, expire_days, project_id)
+    if len(_PENDING_INCRS) >= CONFIG.telemetry_batch_size:
+        await flush_int_keys()
+
+
+async def capture_int_keys(
+    values: dict[tuple[str, str], int], expire_days: int = 14
+):
+    """Increase many (name, project_id) keys"""
+    for (name, project_id), value in values.items():
+        stage_int_key(name, value, expire_days, project_id)
+    if len(_PENDING_INCRS) >= CONFIG.telemetry_batch_size:
+        await flush_int_keys()
+
+
+async def flush_int_keys():
+    """Send the coalesced increments in one MULTI/EXEC"""
+    if not _PENDING_INCRS:
+        return
+    pending = dict(_PENDING_INCRS)
+    _PENDING_INCRS.clear()
+    now = time.time()
+    need_expire = {
+        key
+        for key, _ in pending
+        if now - _EXPIRE_SENT_AT.get(key, 0) > EXPIRE_REFRESH_SECONDS
+    }
+    try:
+        async with get_redis_client() as r_c:
+            async with r_c.pipeline(transaction=True) as pipe:
+                for (key, expire_seconds), value in pending.items():
+                    pipe.incrby(key, value)
+                    if key in need_expire:
+                        pipe.expire(key, expire_seconds)
+                await pipe.execute()
+    except Exception as e:
+        # MULTI/EXEC applied nothing, retry them in the next flush
+        for k, value in pending.items():
+            _PENDING_INCRS[k] += value
+        LOG.error(f"Failed to flush telemetry keys: {e}")
+        return
+    for key in need_expire:
+        _EXPIRE_SENT_AT[key] = now
+    for key, sent_at in list(_EXPIRE_SENT_AT.items()):
+        if now - sent_at > EXPIRE_REFRESH_SECONDS:
+            del _EXPIRE_SENT_AT[key]
 
 
 async def get_int_key(
     name: str, project_id: str = DEFAULT_PROJECT_ID, in_month: bool = False
 ) -> int:
-    if in_month:
-        key = f"{head_key(project_id)}::{name}::{month_key()}"
-    else:
-        key = f"{head_key(project_id)}::{name}::{date_key()}"
+    return (await get_int_keys([name], project_id, in_month))[0]
+
+
+async def get_int_keys(
+    names: list[str], project_id: str = DEFAULT_PROJECT_ID, in_month: bool = False
+) -> list[int]:
+    suffix = month_key() if in_month else date_key()
+    keys = [f"{head_key(project_id)}::{name}::{suffix}" for name in names]
     async with get_redis_client() as r_c:
-        return int((await r_c.get(key)) or 0)
+        return [int(v or 0) for v in await r_c.mget(keys)]
 
 
 if __name__ == "__main__":
     import asyncio
 
-    print(asyncio.run(capture_int_key("test_key")))
+    async def main():
+        await capture_int_key("test_key")
+        await flush_int_keys()
+        print(await get_int_key("test_key"))
+
+    asyncio.run(main())
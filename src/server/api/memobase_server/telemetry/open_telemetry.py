@@ -35,7 +35,14 @@ class CounterMetricName(Enum):
     LLM_INVOCATIONS = "llm_invocations_total"
     LLM_TOKENS_INPUT = "llm_input_tokens_total"
     LLM_TOKENS_OUTPUT = "llm_output_tokens_total"
+    LLM_CACHE_HITS = "llm_cache_hits_total"
+    LLM_CACHE_MISSES = "llm_cache_misses_total"
     EMBEDDING_TOKENS = "embedding_tokens_total"
+    EMBEDDING_API_CALLS = "embedding_api_calls_total"
+    EMBEDDING_CACHE_HITS = "embedding_cache_hits_total"
+    EMBEDDING_CACHE_MISSES = "embedding_cache_misses_total"
+    PROFILE_CACHE_HITS = "profile_cache_hits_total"
+    PROFILE_CACHE_MISSES = "profile_cache_misses_total"
 
     def get_description(self) -> str:
         """Get the description for this metric."""
@@ -45,7 +52,14 @@ class CounterMetricName(Enum):
             CounterMetricName.LLM_INVOCATIONS: "Total number of LLM invocations",
             CounterMetricName.LLM_TOKENS_INPUT: "Total number of input tokens",
             CounterMetricName.LLM_TOKENS_OUTPUT: "Total number of output tokens",
+            CounterMetricName.LLM_CACHE_HITS: "Total number of LLM completions served by the cache",
+            CounterMetricName.LLM_CACHE_MISSES: "Total number of cacheable LLM completions missed by the cache",
             CounterMetricName.EMBEDDING_TOKENS: "Total number of embedding tokens",
+            CounterMetricName.EMBEDDING_API_CALLS: "Total number of embedding provider calls",
+            CounterMetricName.EMBEDDING_CACHE_HITS: "Total number of texts served by the embedding cache",
+            CounterMetricName.EMBEDDING_CACHE_MISSES: "Total number of texts missed by the embedding cache",
+            CounterMetricName.PROFILE_CACHE_HITS: "Total number of user profile reads served by the cache",
+            CounterMetricName.PROFILE_CACHE_MISSES: "Total number of user profile reads loaded from the database",
         }
         return descriptions[self]
 
@@ -60,6 +74,7 @@ class HistogramMetricName(Enum):
     LLM_LATENCY_MS = "llm_latency"
     EMBEDDING_LATENCY_MS = "embedding_latency"
     REQUEST_LATENCY_MS = "request_latency"
+    PIPELINE_STAGE_LATENCY_MS = "pipeline_stage_latency"
 
     def get_description(self) -> str:
         """Get the description for this metric."""
@@ -67,6 +82,7 @@ class HistogramMetricName(Enum):
             HistogramMetricName.LLM_LATENCY_MS: "Latency of the LLM in milliseconds",
             HistogramMetricName.EMBEDDING_LATENCY_MS: "Latency of the embedding in milliseconds",
             HistogramMetricName.REQUEST_LATENCY_MS: "Latency of the request in milliseconds",
+            HistogramMetricName.PIPELINE_STAGE_LATENCY_MS: "Latency of a stage of the buffer flush pipeline in milliseconds",
         }
         return descriptions[self]
 
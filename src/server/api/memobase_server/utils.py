@@ -1,9 +1,10 @@
 import re
+import time
 import yaml
 import json
 from typing import cast
 from datetime import timezone, datetime
-from functools import wraps
+from contextlib import asynccontextmanager
 from pydantic import ValidationError
 from .env import ENCODER, LOG, CONFIG, ProfileConfig
 from .models.blob import Blob, BlobType, ChatBlob, DocBlob, OpenAICompatibleMessage
@@ -11,12 +12,37 @@ from .models.database import GeneralBlob
 from .models.response import UserEventData, EventData
 from .models.utils import Promise, CODE
 from .connectors import get_redis_client, PROJECT_ID
+from .errors import UserLockTimeout
 
 LIST_INT_REGEX = re.compile(r"\[\s*(?:\d+(?:\s*,\s*\d+)*\s*)?\]")
 
+# KEYS[1] is the index of cached keys scored by expire time, KEYS[2:] the
+# keys to set and ARGV[4:] their values. The earliest expiring entries are
+# evicted once the index holds more than ARGV[3] keys.
+SET_CAPPED_CACHE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local ttl = tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+for i = 2, #KEYS do
+    redis.call('SET', KEYS[i], ARGV[i + 2], 'EX', ttl)
+    redis.call('ZADD', KEYS[1], now + ttl, KEYS[i])
+end
+local overflow = redis.call('ZCARD', KEYS[1]) - tonumber(ARGV[3])
+if overflow > 0 then
+    local evicted = redis.call('ZPOPMIN', KEYS[1], overflow)
+    for i = 1, #evicted, 2 do
+        redis.call('DEL', evicted[i])
+    end
+end
+return overflow
+"""
+
 
 def event_str_repr(event: UserEventData) -> str:
-    event_data = event.event_data
+    return event_data_str_repr(event.event_data)
+
+
+def event_data_str_repr(event_data: EventData) -> str:
     if event_data.event_tip is None:
         profile_deltas = [
             f"- {ed.attributes['topic']}::{ed.attributes['sub_topic']}: {ed.content}"
@@ -85,6 +111,21 @@ def get_decoded_tokens(tokens: list[int]) -> str:
     return ENCODER.decode(tokens)
 
 
+def profile_str_repr(content: str, attributes: dict | None) -> str:
+    attributes = attributes or {}
+    return f"{attributes.get('topic')}::{attributes.get('sub_topic')}: {content}"
+
+
+def profile_token_size(content: str, attributes: dict | None) -> int:
+    """Token count of the profile's line in the context, stored with the profile"""
+    return len(get_encoded_tokens(profile_str_repr(content, attributes)))
+
+
+def event_token_size(event_data: EventData) -> int:
+    """Token count of the event in the context, stored with the event"""
+    return len(get_encoded_tokens(event_data_str_repr(event_data)))
+
+
 def truncate_string(content: str, max_tokens: int) -> str:
     tokens = get_encoded_tokens(content)
     tailing = "" if len(tokens) <= max_tokens else "..."
@@ -167,35 +208,59 @@ def seconds_from_now(dt: datetime):
     return (datetime.now().astimezone() - dt.astimezone()).seconds
 
 
-def user_id_lock(scope, lock_timeout=128, blocking_timeout=32):
-    def __user_id_lock(func):
-        @wraps(func)
-        async def wrapper(user_id, *args, **kwargs):
-            lock_key = f"user_lock:{PROJECT_ID}:{scope}:{user_id}"
-            async with get_redis_client() as redis_client:
-                lock = redis_client.lock(
-                    lock_key, timeout=lock_timeout, blocking_timeout=blocking_timeout
+async def set_capped_cache(
+    redis_client,
+    index_key: str,
+    values: dict[str, str | bytes],
+    ttl: int,
+    max_entries: int,
+):
+    """Set cache entries with a TTL, keeping at most `max_entries` keys under
+    `index_key`."""
+    set_script = redis_client.register_script(SET_CAPPED_CACHE_SCRIPT)
+    await set_script(
+        keys=[index_key, *values.keys()],
+        args=[int(time.time()), ttl, max_entries, *values.values()],
+    )
+
+
+@asynccontextmanager
+async def user_lock(
+    user_id: str,
+    project_id: str,
+    scope: str,
+    lock_timeout: float = 128,
+    blocking_timeout: float = 32,
+    blocking: bool = True,
+):
+    """Hold the lock of one user of a project in `scope`.
+
+    Yield whether the lock was acquired, only False without `blocking`.
+    Raise UserLockTimeout if a blocking acquire times out.
+    """
+    lock_key = f"user_lock:{PROJECT_ID}:{project_id}:{scope}:{user_id}"
+    async with get_redis_client() as redis_client:
+        lock = redis_client.lock(
+            lock_key, timeout=lock_timeout, blocking_timeout=blocking_timeout
+        )
+        acquired = False
+        try:
+            acquired = await lock.acquire(blocking=blocking)
+            if not acquired and blocking:
+                raise UserLockTimeout(
+                    f"Could not acquire lock for user {user_id} in scope {scope}"
+                )
+            yield acquired
+        finally:
+            try:
+                if acquired and await lock.locked():
+                    await lock.release()
+            except Exception as e:
+                LOG.error(
+                    f"Error releasing lock for user {user_id} in scope {scope}: {e}"
                 )
-                try:
-                    if not await lock.acquire(blocking=True):
-                        raise TimeoutError(
-                            f"Could not acquire lock for user {user_id} in scope {scope}"
-                        )
-                    return await func(user_id, *args, **kwargs)
-                finally:
-                    try:
-                        if await lock.locked():
-                            await lock.release()
-                    except Exception as e:
-                        LOG.error(
-                            f"Error releasing lock for user {user_id} in scope {scope}: {e}"
-                        )
-                        # Consider forcing lock release or implementing a recovery mechanism
-                        # raise RuntimeError(f"Lock release failed: {e}") from e
-
-        return wrapper
-
-    return __user_id_lock
+                # Consider forcing lock release or implementing a recovery mechanism
+                # raise RuntimeError(f"Lock release failed: {e}") from e
 
 
 def is_valid_profile_config(profile_config: str | None) -> Promise[None]:
@@ -0,0 +1,44 @@
+import asyncio
+from ..env import LOG, CONFIG
+from ..controllers import full as controllers
+from .flush_worker import flush_worker_loop
+from .buffer_sweeper import buffer_sweeper_loop
+from .billing_flusher import billing_flush_loop
+from .telemetry_flusher import telemetry_flush_loop
+from .auth_listener import auth_invalidation_loop
+from .config_listener import project_config_invalidation_loop
+from ..telemetry.capture_key import flush_int_keys
+
+_STOP_EVENT: asyncio.Event | None = None
+_TASKS: list[asyncio.Task] = []
+
+
+def start_background_workers(
+    flush_worker_num: int, sweep_buffers: bool = True, listen_auth: bool = False
+):
+    global _STOP_EVENT
+    _STOP_EVENT = asyncio.Event()
+    _TASKS.append(asyncio.create_task(billing_flush_loop(_STOP_EVENT)))
+    _TASKS.append(asyncio.create_task(telemetry_flush_loop(_STOP_EVENT)))
+    # Both the API and the flush workers read the project configs
+    _TASKS.append(
+        asyncio.create_task(project_config_invalidation_loop(_STOP_EVENT))
+    )
+    if listen_auth:
+        _TASKS.append(asyncio.create_task(auth_invalidation_loop(_STOP_EVENT)))
+    for i in range(flush_worker_num):
+        _TASKS.append(asyncio.create_task(flush_worker_loop(i, _STOP_EVENT)))
+    LOG.info(f"Started {flush_worker_num} flush workers")
+    if sweep_buffers and CONFIG.buffer_sweep_interval > 0:
+        _TASKS.append(asyncio.create_task(buffer_sweeper_loop(_STOP_EVENT)))
+
+
+async def stop_background_workers():
+    if _STOP_EVENT is None:
+        return
+    _STOP_EVENT.set()
+    await asyncio.gather(*_TASKS, return_exceptions=True)
+    _TASKS.clear()
+    # Write the token costs of the last flush jobs
+    await controllers.billing.flush_token_billing()
+    await flush_int_keys()
@@ -0,0 +1,13 @@
+import asyncio
+from ..env import CONFIG, LOG
+from ..controllers import full as controllers
+from .flush_worker import wait_or_stop
+
+
+async def billing_flush_loop(stop_event: asyncio.Event):
+    while not stop_event.is_set():
+        await wait_or_stop(stop_event, CONFIG.billing_flush_interval)
+        try:
+            await controllers.billing.flush_token_billing()
+        except Exception as e:
+            LOG.error(f"Token billing flusher error: {e}")
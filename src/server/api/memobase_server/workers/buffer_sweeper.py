@@ -0,0 +1,61 @@
+import asyncio
+from ..env import CONFIG, LOG
+from ..models.blob import BlobType
+from ..connectors import get_redis_client
+from ..controllers import full as controllers
+from .flush_worker import wait_or_stop
+
+SWEEPER_LOCK_KEY = "memobase::buffer_sweeper::lock"
+
+
+async def flush_idle_buffer(user_id: str, project_id: str, blob_type: BlobType):
+    if CONFIG.buffer_flush_in_background:
+        p = await controllers.flush_job.enqueue_flush_job(
+            user_id, project_id, blob_type
+        )
+    else:
+        p = await controllers.buffer.wait_insert_done_then_flush(
+            user_id, project_id, blob_type
+        )
+    if not p.ok():
+        LOG.error(f"Failed to flush idle {blob_type} buffer of {user_id}: {p.msg()}")
+
+
+async def sweep_idle_buffers() -> int:
+    """Flush at most `buffer_sweep_batch_size` idle buffers, return the count"""
+    async with get_redis_client() as redis_client:
+        # Only one sweeper runs across all the processes in a sweep interval
+        acquired = await redis_client.set(
+            SWEEPER_LOCK_KEY, 1, nx=True, ex=max(CONFIG.buffer_sweep_interval, 1)
+        )
+    if not acquired:
+        return 0
+    p = await controllers.buffer.get_idle_buffers(CONFIG.buffer_sweep_batch_size)
+    if not p.ok():
+        LOG.error(f"Failed to find idle buffers: {p.msg()}")
+        return 0
+    idle_buffers = p.data()
+    semaphore = asyncio.Semaphore(CONFIG.buffer_sweep_concurrency)
+
+    async def _flush(b):
+        async with semaphore:
+            try:
+                await flush_idle_buffer(b.user_id, b.project_id, BlobType(b.blob_type))
+            except Exception as e:
+                LOG.error(f"Error flushing idle buffer of {b.user_id}: {e}")
+
+    await asyncio.gather(*[_flush(b) for b in idle_buffers])
+    if idle_buffers:
+        LOG.info(f"Swept {len(idle_buffers)} idle buffers")
+    return len(idle_buffers)
+
+
+async def buffer_sweeper_loop(stop_event: asyncio.Event):
+    LOG.info("Idle buffer sweeper started")
+    while not stop_event.is_set():
+        try:
+            await sweep_idle_buffers()
+        except Exception as e:
+            LOG.error(f"Idle buffer sweeper error: {e}")
+        await wait_or_stop(stop_event, CONFIG.buffer_sweep_interval)
+    LOG.info("Idle buffer sweeper stopped")
@@ -0,0 +1,13 @@
+import asyncio
+from ..env import LOG
+from ..controllers.project_config import listen_project_config_invalidation
+from .flush_worker import wait_or_stop
+
+
+async def project_config_invalidation_loop(stop_event: asyncio.Event):
+    while not stop_event.is_set():
+        try:
+            await listen_project_config_invalidation(stop_event)
+        except Exception as e:
+            LOG.error(f"Project config invalidation listener error: {e}")
+            await wait_or_stop(stop_event, 1.0)
@@ -0,0 +1,53 @@
+import asyncio
+import traceback
+from ..env import CONFIG, LOG
+from ..errors import UserLockTimeout
+from ..controllers import full as controllers
+
+
+async def wait_or_stop(stop_event: asyncio.Event, timeout: float):
+    try:
+        await asyncio.wait_for(stop_event.wait(), timeout=timeout)
+    except asyncio.TimeoutError:
+        pass
+
+
+async def process_flush_job(job: dict):
+    job_id, project_id = job["id"], job["project_id"]
+    try:
+        p = await controllers.buffer.flush_buffer(
+            job["user_id"], project_id, job["blob_type"]
+        )
+    except UserLockTimeout as e:
+        # Another flush of this user is still running, try it later
+        LOG.warning(f"Flush job {job_id} is blocked: {e}")
+        await controllers.flush_job.retry_flush_job(job_id, project_id)
+        return
+    except Exception as e:
+        LOG.error(f"Error in flush job {job_id}: {e}, {traceback.format_exc()}")
+        await controllers.flush_job.finish_flush_job(
+            job_id, project_id, error=f"Error in flush job: {e}"
+        )
+        return
+    if not p.ok():
+        await controllers.flush_job.finish_flush_job(
+            job_id, project_id, error=p.msg()
+        )
+        return
+    await controllers.flush_job.finish_flush_job(job_id, project_id, result=p.data())
+    LOG.info(f"Flush job {job_id} done")
+
+
+async def flush_worker_loop(worker_id: int, stop_event: asyncio.Event):
+    LOG.info(f"Flush worker {worker_id} started")
+    while not stop_event.is_set():
+        try:
+            p = await controllers.flush_job.claim_flush_job()
+            if not p.ok() or p.data() is None:
+                await wait_or_stop(stop_event, CONFIG.flush_worker_poll_interval)
+                continue
+            await process_flush_job(p.data())
+        except Exception as e:
+            LOG.error(f"Flush worker {worker_id} error: {e}")
+            await wait_or_stop(stop_event, CONFIG.flush_worker_poll_interval)
+    LOG.info(f"Flush worker {worker_id} stopped")
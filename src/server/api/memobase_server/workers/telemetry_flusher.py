@@ -0,0 +1,13 @@
+import asyncio
+from ..env import CONFIG, LOG
+from ..telemetry.capture_key import flush_int_keys
+from .flush_worker import wait_or_stop
+
+
+async def telemetry_flush_loop(stop_event: asyncio.Event):
+    while not stop_event.is_set():
+        await wait_or_stop(stop_event, CONFIG.telemetry_flush_interval)
+        try:
+            await flush_int_keys()
+        except Exception as e:
+            LOG.error(f"Telemetry flusher error: {e}")
@@ -3,6 +3,9 @@ import asyncio
 from api import app
 from memobase_server.env import CONFIG
 from fastapi.testclient import TestClient
+from sqlalchemy.pool import NullPool
+from sqlalchemy.ext.asyncio import create_async_engine
+from memobase_server import connectors
 
 PREFIX = "/api/v1"
 CONFIG.profile_strict_mode = False
@@ -12,6 +15,13 @@ CONFIG.event_tags = [
     {"name": "goal", "description": "Record the current goal of user"},
 ]
 CONFIG.enable_event_embedding = True
+# The modal tests mock one merge response per fact
+CONFIG.profile_merge_batch_size = 1
+# TestClient and the async tests run on different event loops,
+# asyncpg connections can't be shared between them
+connectors.AsyncSession.configure(
+    bind=create_async_engine(connectors.ASYNC_DB_ENGINE.url, poolclass=NullPool)
+)
 # @pytest.fixture(scope="session")
 # def event_loop():
 #     try:
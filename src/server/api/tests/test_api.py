@@ -1,4 +1,5 @@
 import os
+from datetime import timedelta
 import pytest
 import numpy as np
 from unittest.mock import patch, Mock, AsyncMock
@@ -590,3 +591,261 @@ async def test_api_event_search(
     d = response.json()
     assert response.status_code == 200
     assert d["errno"] == 0
+
+
+@pytest.mark.asyncio
+async def test_api_user_flush_job(
+    client,
+    db_env,
+    mock_llm_complete,
+    mock_llm_validate_complete,
+    mock_event_summary_llm_complete,
+    mock_entry_summary_llm_complete,
+    mock_event_get_embedding,
+):
+    from memobase_server.workers.flush_worker import process_flush_job
+
+    response = client.post(f"{PREFIX}/users", json={})
+    d = response.json()
+    assert response.status_code == 200
+    assert d["errno"] == 0
+    u_id = d["data"]["id"]
+
+    response = client.post(
+        f"{PREFIX}/blobs/insert/{u_id}",
+        json={
+            "blob_type": "chat",
+            "blob_data": {
+                "messages": [
+                    {"role": "user", "content": "hello, I'm Gus"},
+                    {"role": "assistant", "content": "hi"},
+                ]
+            },
+        },
+    )
+    d = response.json()
+    assert response.status_code == 200
+    assert d["errno"] == 0
+
+    p = await controllers.buffer_summary.get_buffer_summary(
+        u_id, DEFAULT_PROJECT_ID, BlobType.chat
+    )
+    assert p.ok()
+    assert p.data().blob_count == 1 and p.data().token_size > 0
+
+    p = await controllers.flush_job.enqueue_flush_job(
+        u_id, DEFAULT_PROJECT_ID, BlobType.chat
+    )
+    assert p.ok()
+    job_id = p.data().id
+    p = await controllers.flush_job.enqueue_flush_job(
+        u_id, DEFAULT_PROJECT_ID, BlobType.chat
+    )
+    assert p.ok() and p.data().id == job_id
+
+    response = client.get(f"{PREFIX}/users/buffer/jobs/{u_id}/{job_id}")
+    d = response.json()
+    assert d["errno"] == 0
+    assert d["data"]["status"] == "pending"
+    assert d["data"]["chat_results"] is None
+
+    p = await controllers.flush_job.claim_flush_job()
+    assert p.ok() and p.data() is not None
+    await process_flush_job(p.data())
+
+    response = client.get(f"{PREFIX}/users/buffer/jobs/{u_id}/{job_id}")
+    d = response.json()
+    assert d["errno"] == 0
+    assert d["data"]["status"] == "done"
+    assert len(d["data"]["chat_results"]) == 1
+    p = await controllers.buffer.get_buffer_capacity(
+        u_id, DEFAULT_PROJECT_ID, BlobType.chat
+    )
+    assert p.ok() and p.data() == 0
+
+    response = client.delete(f"{PREFIX}/users/{u_id}")
+    d = response.json()
+    assert response.status_code == 200
+    assert d["errno"] == 0
+
+
+@pytest.mark.asyncio
+async def test_api_user_flush_job_blocked(client, db_env):
+    import asyncio
+    from sqlalchemy import update
+    from memobase_server.connectors import Session
+    from memobase_server.errors import UserLockTimeout
+    from memobase_server.models.database import BufferFlushJob
+    from memobase_server.workers.flush_worker import process_flush_job
+
+    response = client.post(f"{PREFIX}/users", json={})
+    d = response.json()
+    assert d["errno"] == 0
+    u_id = d["data"]["id"]
+
+    # Concurrent enqueues share one pending job
+    results = await asyncio.gather(
+        *[
+            controllers.flush_job.enqueue_flush_job(
+                u_id, DEFAULT_PROJECT_ID, BlobType.chat
+            )
+            for _ in range(4)
+        ]
+    )
+    assert all(p.ok() for p in results)
+    assert len({p.data().id for p in results}) == 1
+    job_id = results[0].data().id
+
+    # Waiting for another flush of the user never fails the job
+    for _ in range(CONFIG.flush_job_max_attempts + 1):
+        p = await controllers.flush_job.claim_flush_job()
+        assert p.ok() and p.data()["id"] == job_id
+        with patch(
+            "memobase_server.controllers.buffer.flush_buffer",
+            AsyncMock(side_effect=UserLockTimeout("locked")),
+        ):
+            await process_flush_job(p.data())
+        # and the job isn't claimed again before its retry delay
+        p = await controllers.flush_job.claim_flush_job()
+        assert p.ok() and p.data() is None
+        with Session() as session:
+            session.execute(
+                update(BufferFlushJob)
+                .filter_by(id=job_id)
+                .values(run_after=None)
+            )
+            session.commit()
+
+    response = client.get(f"{PREFIX}/users/buffer/jobs/{u_id}/{job_id}")
+    d = response.json()
+    assert d["errno"] == 0
+    assert d["data"]["status"] == "pending"
+
+    # Other timeouts inside the flush are errors, not a busy lock
+    p = await controllers.flush_job.claim_flush_job()
+    assert p.ok() and p.data()["id"] == job_id
+    with patch(
+        "memobase_server.controllers.buffer.flush_buffer",
+        AsyncMock(side_effect=TimeoutError("LLM timed out")),
+    ):
+        await process_flush_job(p.data())
+    response = client.get(f"{PREFIX}/users/buffer/jobs/{u_id}/{job_id}")
+    assert response.json()["data"]["status"] == "failed"
+
+    response = client.delete(f"{PREFIX}/users/{u_id}")
+    assert response.json()["errno"] == 0
+
+
+@pytest.mark.asyncio
+async def test_api_sweep_idle_buffers(client, db_env):
+    from memobase_server.connectors import Session
+    from memobase_server.models.database import BufferZone
+
+    response = client.post(f"{PREFIX}/users", json={})
+    d = response.json()
+    assert d["errno"] == 0
+    u_id = d["data"]["id"]
+
+    response = client.post(
+        f"{PREFIX}/blobs/insert/{u_id}",
+        json={
+            "blob_type": "chat",
+            "blob_data": {"messages": [{"role": "user", "content": "hello"}]},
+        },
+    )
+    assert response.json()["errno"] == 0
+
+    p = await controllers.buffer.get_idle_buffers(1000)
+    assert p.ok() and u_id not in [str(b.user_id) for b in p.data()]
+
+    with Session() as session:
+        for buffer in session.query(BufferZone).filter_by(user_id=u_id).all():
+            buffer.created_at = buffer.created_at - timedelta(
+                seconds=CONFIG.buffer_flush_interval + 10
+            )
+        session.commit()
+    p = await controllers.buffer.get_idle_buffers(1000)
+    assert p.ok() and u_id in [str(b.user_id) for b in p.data()]
+
+    response = client.delete(f"{PREFIX}/users/{u_id}")
+    assert response.json()["errno"] == 0
+
+
+def test_blob_insert_many_api(client, db_env):
+    user_ids = []
+    for _ in range(2):
+        response = client.post(f"{PREFIX}/users", json={})
+        d = response.json()
+        assert d["errno"] == 0
+        user_ids.append(d["data"]["id"])
+
+    blobs = [
+        {
+            "user_id": u_id,
+            "blob_type": "doc",
+            "blob_data": {"content": f"Hello {i}"},
+        }
+        for i, u_id in enumerate(user_ids + user_ids)
+    ]
+    response = client.post(f"{PREFIX}/blobs/insert_many", json={"blobs": blobs})
+    d = response.json()
+    assert response.status_code == 200
+    assert d["errno"] == 0
+    assert len(d["data"]["ids"]) == 4
+
+    for i, bid in enumerate(d["data"]["ids"]):
+        response = client.get(f"{PREFIX}/blobs/{user_ids[i % 2]}/{bid}")
+        d = response.json()
+        assert d["errno"] == 0
+        assert d["data"]["blob_data"]["content"] == f"Hello {i}"
+
+    for u_id in user_ids:
+        response = client.get(f"{PREFIX}/users/blobs/{u_id}/doc")
+        assert len(response.json()["data"]["ids"]) == 2
+        response = client.delete(f"{PREFIX}/users/{u_id}")
+        assert response.json()["errno"] == 0
+
+
+@pytest.mark.asyncio
+async def test_api_project_token_auth(client, db_env):
+    from uuid import uuid4
+    from sqlalchemy import update, delete
+    from memobase_server.connectors import Session
+    from memobase_server.models.database import Project
+    from memobase_server.auth.token import invalidate_project_auth
+
+    project_id = f"test-{uuid4().hex[:8]}"
+    secret = f"sk-{project_id}-{uuid4().hex}"
+    with Session() as session:
+        session.add(Project(project_id=project_id, project_secret=secret))
+        session.commit()
+
+    try:
+        client.headers.update({"Authorization": f"Bearer {secret}"})
+        response = client.get(f"{PREFIX}/users/{uuid4()}")
+        assert response.status_code != 401
+        # Served from the auth cache of this process
+        response = client.get(f"{PREFIX}/users/{uuid4()}")
+        assert response.status_code != 401
+
+        client.headers.update({"Authorization": f"Bearer {secret}x"})
+        response = client.get(f"{PREFIX}/users/{uuid4()}")
+        assert response.status_code == 401
+
+        with Session() as session:
+            session.execute(
+                update(Project)
+                .where(Project.project_id == project_id)
+                .values(status="suspended")
+            )
+            session.commit()
+        await invalidate_project_auth(project_id)
+        client.headers.update({"Authorization": f"Bearer {secret}"})
+        response = client.get(f"{PREFIX}/users/{uuid4()}")
+        assert response.status_code == 401
+        assert "suspended" in response.json()["errmsg"]
+    finally:
+        with Session() as session:
+            session.execute(delete(Project).where(Project.project_id == project_id))
+            session.commit()
+        await invalidate_project_auth(project_id)
@@ -42,6 +42,14 @@ MERGE_FACTS = [
     "- UPDATE::Feels bored with high school",
 ]
 
+BATCH_MERGE_FACTS = """The old level is outdated, the others are new.
+---
+- 1::UPDATE::Gus
+- 2::UPDATE::user likes Chinese and Japanese food
+- 3::UPDATE::High School
+- 4::UPDATE::Feels bored with high school
+"""
+
 ORGANIZE_FACTS = """
 - foods::Chinese food
 """
@@ -87,6 +95,35 @@ def mock_merge_llm_complete():
         yield mock_llm
 
 
+@pytest.fixture
+def mock_batch_merge_llm_complete():
+    with patch("memobase_server.controllers.modal.chat.merge.llm_complete") as mock_llm:
+        mock_client1 = AsyncMock()
+        mock_client1.ok = Mock(return_value=True)
+        mock_client1.data = Mock(return_value=BATCH_MERGE_FACTS)
+
+        mock_llm.side_effect = [mock_client1]
+        yield mock_llm
+
+
+@pytest.fixture
+def mock_failed_batch_merge_llm_complete():
+    with patch("memobase_server.controllers.modal.chat.merge.llm_complete") as mock_llm:
+        mock_failed = AsyncMock()
+        mock_failed.ok = Mock(return_value=False)
+        mock_failed.msg = Mock(return_value="Request timed out")
+
+        mock_clients = []
+        for fact in MERGE_FACTS:
+            mock_client = AsyncMock()
+            mock_client.ok = Mock(return_value=True)
+            mock_client.data = Mock(return_value=fact)
+            mock_clients.append(mock_client)
+
+        mock_llm.side_effect = [mock_failed, *mock_clients]
+        yield mock_llm
+
+
 @pytest.fixture
 def mock_organize_llm_complete():
     with patch(
@@ -216,6 +253,9 @@ async def test_chat_buffer_modal(
     assert len(p.data().profiles) == 4
     print(p.data())
 
+    # Token sizes are stored at write time
+    assert all(pf.token_size for pf in p.data().profiles)
+
     p = await controllers.profile.truncate_profiles(p.data(), topk=2)
     assert p.ok()
     assert len(p.data().profiles) == 2
@@ -223,6 +263,7 @@ async def test_chat_buffer_modal(
     p = await controllers.event.get_user_events(u_id, DEFAULT_PROJECT_ID)
     assert p.ok()
     assert len(p.data().events) == 1
+    assert p.data().events[0].token_size
 
     p = await controllers.buffer.get_buffer_capacity(
         u_id, DEFAULT_PROJECT_ID, BlobType.chat
@@ -376,3 +417,136 @@ async def test_chat_organize_modal(
     assert mock_extract_llm_complete.await_count == 1
     assert mock_merge_llm_complete.await_count == 4
     assert mock_organize_llm_complete.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_chat_batch_merge_modal(
+    db_env,
+    mock_extract_llm_complete,
+    mock_batch_merge_llm_complete,
+    mock_event_summary_llm_complete,
+    mock_entry_summary_llm_complete,
+    mock_event_get_embedding,
+):
+    CONFIG.profile_merge_batch_size = 10
+    p = await controllers.user.create_user(res.UserData(), DEFAULT_PROJECT_ID)
+    assert p.ok()
+    u_id = p.data().id
+
+    blob = res.BlobData(
+        blob_type=BlobType.chat,
+        blob_data={
+            "messages": [
+                {"role": "user", "content": "Hello, this is Gus, how are you?"},
+                {"role": "user", "content": "I really dig into Chinese food"},
+                {"role": "user", "content": "high school is really boring."},
+            ]
+        },
+    )
+    p = await controllers.blob.insert_blob(u_id, DEFAULT_PROJECT_ID, blob)
+    assert p.ok()
+    await controllers.buffer.insert_blob_to_buffer(
+        u_id, DEFAULT_PROJECT_ID, p.data().id, blob.to_blob()
+    )
+    p = await controllers.profile.add_user_profiles(
+        u_id, DEFAULT_PROJECT_ID, PROFILES, PROFILE_ATTRS
+    )
+    assert p.ok()
+    try:
+        await controllers.buffer.flush_buffer(u_id, DEFAULT_PROJECT_ID, BlobType.chat)
+    finally:
+        CONFIG.profile_merge_batch_size = 1
+
+    p = await controllers.profile.get_user_profiles(u_id, DEFAULT_PROJECT_ID)
+    assert p.ok() and len(p.data().profiles) == len(PROFILES) + 2
+    profiles = sorted(p.data().profiles, key=lambda x: x.content)
+    assert dict_contains(
+        profiles[-2].attributes, {"topic": "interest", "sub_topic": "foods"}
+    )
+    assert profiles[-2].content == "user likes Chinese and Japanese food"
+
+    p = await controllers.user.delete_user(u_id, DEFAULT_PROJECT_ID)
+    assert p.ok()
+
+    assert mock_extract_llm_complete.await_count == 1
+    assert mock_batch_merge_llm_complete.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_chat_batch_merge_fallback_modal(
+    db_env,
+    mock_extract_llm_complete,
+    mock_failed_batch_merge_llm_complete,
+    mock_event_summary_llm_complete,
+    mock_entry_summary_llm_complete,
+    mock_event_get_embedding,
+):
+    CONFIG.profile_merge_batch_size = 10
+    p = await controllers.user.create_user(res.UserData(), DEFAULT_PROJECT_ID)
+    assert p.ok()
+    u_id = p.data().id
+
+    blob = res.BlobData(
+        blob_type=BlobType.chat,
+        blob_data={
+            "messages": [
+                {"role": "user", "content": "Hello, this is Gus, how are you?"},
+                {"role": "user", "content": "I really dig into Chinese food"},
+                {"role": "user", "content": "high school is really boring."},
+            ]
+        },
+    )
+    p = await controllers.blob.insert_blob(u_id, DEFAULT_PROJECT_ID, blob)
+    assert p.ok()
+    await controllers.buffer.insert_blob_to_buffer(
+        u_id, DEFAULT_PROJECT_ID, p.data().id, blob.to_blob()
+    )
+    p = await controllers.profile.add_user_profiles(
+        u_id, DEFAULT_PROJECT_ID, PROFILES, PROFILE_ATTRS
+    )
+    assert p.ok()
+    try:
+        await controllers.buffer.flush_buffer(u_id, DEFAULT_PROJECT_ID, BlobType.chat)
+    finally:
+        CONFIG.profile_merge_batch_size = 1
+
+    # The failed batch is merged fact by fact, no fact is dropped
+    p = await controllers.profile.get_user_profiles(u_id, DEFAULT_PROJECT_ID)
+    assert p.ok() and len(p.data().profiles) == len(PROFILES) + 2
+    profiles = sorted(p.data().profiles, key=lambda x: x.content)
+    assert profiles[-2].content == "user likes Chinese and Japanese food"
+
+    p = await controllers.user.delete_user(u_id, DEFAULT_PROJECT_ID)
+    assert p.ok()
+
+    assert mock_extract_llm_complete.await_count == 1
+    assert mock_failed_batch_merge_llm_complete.await_count == 1 + len(MERGE_FACTS)
+
+
+@pytest.mark.asyncio
+async def test_organize_empty_response():
+    import uuid
+    from memobase_server.env import ProfileConfig
+    from memobase_server.controllers.modal.chat.organize import (
+        plan_organize_profiles,
+    )
+
+    profiles = [
+        res.ProfileData(
+            id=uuid.uuid4(),
+            content="Chinese food",
+            attributes={"topic": "interest", "sub_topic": f"foods{i}"},
+        )
+        for i in range(CONFIG.max_profile_subtopics + 1)
+    ]
+    with patch(
+        "memobase_server.controllers.modal.chat.organize.llm_complete"
+    ) as mock_llm:
+        mock_client = AsyncMock()
+        mock_client.ok = Mock(return_value=True)
+        mock_client.data = Mock(return_value="")
+        mock_llm.side_effect = [mock_client]
+
+        # An organize response without sub topics fails, it doesn't raise
+        p = await plan_organize_profiles(DEFAULT_PROJECT_ID, profiles, ProfileConfig())
+    assert not p.ok()
@@ -1,8 +1,21 @@
 import pytest
-from memobase_server import controllers
+import asyncio
+import numpy as np
+from unittest.mock import patch
+from memobase_server import controllers, connectors
+from memobase_server.env import CONFIG
+from memobase_server.utils import user_lock, profile_token_size
+from memobase_server.connectors import get_redis_client
+from memobase_server.prompts import event_tagging
 from memobase_server.models import response as res
-from memobase_server.models.blob import BlobType
+from memobase_server.models.utils import Promise
+from memobase_server.models.blob import BlobType, DocBlob, OpenAICompatibleMessage
 from memobase_server.models.database import DEFAULT_PROJECT_ID
+from memobase_server.controllers import profile_cache, project_config
+from memobase_server.controllers.modal.pipeline import Stage, run_pipeline
+from memobase_server.controllers.post_process.profile import (
+    filter_profiles_with_chats,
+)
 
 
 @pytest.mark.asyncio
@@ -133,3 +146,557 @@ async def test_user_blob_curd(db_env):
         u_id, DEFAULT_PROJECT_ID, BlobType.chat
     )
     assert len(p.data().ids) == 0
+
+
+@pytest.mark.asyncio
+async def test_apply_profile_changes(db_env):
+    p = await controllers.user.create_user(res.UserData(), DEFAULT_PROJECT_ID)
+    assert p.ok()
+    u_id = p.data().id
+
+    p = await controllers.profile.add_user_profiles(
+        u_id,
+        DEFAULT_PROJECT_ID,
+        ["user is 23 years old", "user likes tea"],
+        [
+            {"topic": "basic_info", "sub_topic": "age"},
+            {"topic": "interest", "sub_topic": "drinks"},
+        ],
+    )
+    assert p.ok()
+    age_id, drinks_id = p.data().ids
+
+    p = await controllers.profile.apply_profile_changes(
+        u_id,
+        DEFAULT_PROJECT_ID,
+        [
+            {
+                "content": "Gus",
+                "attributes": {"topic": "basic_info", "sub_topic": "name"},
+            }
+        ],
+        [{"profile_id": age_id, "content": "user is 24 years old", "attributes": None}],
+        [drinks_id],
+    )
+    assert p.ok()
+    add_ids, update_ids, delete_ids = p.data()
+    assert len(add_ids.ids) == 1
+    assert update_ids.ids == [age_id]
+    assert delete_ids.ids == [drinks_id]
+
+    # Served from the cache written by apply_profile_changes
+    p = await controllers.profile.get_user_profiles(u_id, DEFAULT_PROJECT_ID)
+    assert p.ok()
+    profiles = {pf.id: pf for pf in p.data().profiles}
+    assert set(profiles) == {add_ids.ids[0], age_id}
+    assert profiles[age_id].content == "user is 24 years old"
+    assert profiles[age_id].attributes["sub_topic"] == "age"
+
+    p = await controllers.user.delete_user(u_id, DEFAULT_PROJECT_ID)
+    assert p.ok()
+
+
+@pytest.mark.asyncio
+async def test_user_profiles_cache(db_env):
+    p = await controllers.user.create_user(res.UserData(), DEFAULT_PROJECT_ID)
+    assert p.ok()
+    u_id = p.data().id
+
+    p = await controllers.profile.add_user_profiles(
+        u_id,
+        DEFAULT_PROJECT_ID,
+        ["user likes tea"],
+        [{"topic": "interest", "sub_topic": "drinks"}],
+    )
+    assert p.ok()
+    drinks_id = p.data().ids[0]
+
+    # Readers get copies, modifying one doesn't touch the cache
+    p = await controllers.profile.get_user_profiles(u_id, DEFAULT_PROJECT_ID)
+    p.data().profiles[0].content = "modified"
+    p = await controllers.profile.get_user_profiles(u_id, DEFAULT_PROJECT_ID)
+    assert p.data().profiles[0].content == "user likes tea"
+
+    # Writes go through to the cache of the other processes
+    p = await controllers.profile.update_user_profiles(
+        u_id, DEFAULT_PROJECT_ID, [drinks_id], ["user likes coffee"], [None]
+    )
+    assert p.ok()
+    profile_cache._LOCAL_PROFILES.clear()
+    p = await controllers.profile.get_user_profiles(u_id, DEFAULT_PROJECT_ID)
+    assert p.data().profiles[0].content == "user likes coffee"
+
+    # An entry cached before the latest version is reloaded
+    async with get_redis_client() as redis_client:
+        await redis_client.incr(
+            profile_cache.profile_version_key(u_id, DEFAULT_PROJECT_ID)
+        )
+    profile_cache._LOCAL_PROFILES.clear()
+    p = await controllers.profile.get_user_profiles(u_id, DEFAULT_PROJECT_ID)
+    assert p.data().profiles[0].content == "user likes coffee"
+
+    p = await controllers.user.delete_user(u_id, DEFAULT_PROJECT_ID)
+    assert p.ok()
+
+
+@pytest.mark.asyncio
+async def test_user_profiles_cache_versions(db_env):
+    p = await controllers.user.create_user(res.UserData(), DEFAULT_PROJECT_ID)
+    assert p.ok()
+    u_id = p.data().id
+    p = await controllers.profile.add_user_profiles(
+        u_id,
+        DEFAULT_PROJECT_ID,
+        ["user likes tea"],
+        [{"topic": "interest", "sub_topic": "drinks"}],
+    )
+    assert p.ok()
+    version, cached = await profile_cache._read_cached(u_id, DEFAULT_PROJECT_ID)
+    assert version > 0 and cached is not None
+    profiles = cached[0]
+
+    # A read older than the latest write is dropped
+    stale = profiles.model_copy(deep=True)
+    stale.profiles[0].content = "user likes coffee"
+    written = await profile_cache._write_cached(
+        u_id, DEFAULT_PROJECT_ID, stale.model_dump_json().encode(), version - 1
+    )
+    assert written == -1
+    _, cached = await profile_cache._read_cached(u_id, DEFAULT_PROJECT_ID)
+    assert cached[0].profiles[0].content == "user likes tea"
+
+    loads = []
+
+    async def loader():
+        loads.append(True)
+        return profiles
+
+    async def invalidate_and_lock() -> int:
+        profile_cache._LOCAL_PROFILES.clear()
+        async with get_redis_client() as redis_client:
+            await redis_client.set(
+                profile_cache.profile_fill_lock_key(u_id, DEFAULT_PROJECT_ID),
+                1,
+                ex=10,
+            )
+            return await redis_client.incr(
+                profile_cache.profile_version_key(u_id, DEFAULT_PROJECT_ID)
+            )
+
+    # Another process holds the fill lock, its fill is served without loading
+    version = await invalidate_and_lock()
+    task = asyncio.create_task(
+        profile_cache.get_cached_user_profiles(u_id, DEFAULT_PROJECT_ID, loader)
+    )
+    await asyncio.sleep(0.2)
+    assert not task.done()
+    filled = profiles.model_copy(deep=True)
+    filled.profiles[0].content = "user likes juice"
+    written = await profile_cache._write_cached(
+        u_id, DEFAULT_PROJECT_ID, filled.model_dump_json().encode(), version
+    )
+    assert written == version
+    result = await task
+    assert result.profiles[0].content == "user likes juice"
+    assert not loads
+
+    # The other process never fills, the waiter loads after the fill timeout
+    await invalidate_and_lock()
+    with patch.object(CONFIG, "cache_user_profiles_fill_timeout", 0.2):
+        result = await profile_cache.get_cached_user_profiles(
+            u_id, DEFAULT_PROJECT_ID, loader
+        )
+    assert result.profiles[0].content == "user likes tea"
+    assert len(loads) == 1
+
+    async with get_redis_client() as redis_client:
+        await redis_client.delete(
+            profile_cache.profile_fill_lock_key(u_id, DEFAULT_PROJECT_ID)
+        )
+
+    # A write lands while a reader loads, the stale load stays out of memory
+    async def racing_loader():
+        fresh = profiles.model_copy(deep=True)
+        fresh.profiles[0].content = "user likes water"
+        await profile_cache.set_cached_user_profiles(u_id, DEFAULT_PROJECT_ID, fresh)
+        return profiles
+
+    profile_cache._LOCAL_PROFILES.clear()
+    async with get_redis_client() as redis_client:
+        await redis_client.incr(
+            profile_cache.profile_version_key(u_id, DEFAULT_PROJECT_ID)
+        )
+    result = await profile_cache.get_cached_user_profiles(
+        u_id, DEFAULT_PROJECT_ID, racing_loader
+    )
+    assert result.profiles[0].content == "user likes tea"
+    result = await profile_cache.get_cached_user_profiles(
+        u_id, DEFAULT_PROJECT_ID, loader
+    )
+    assert result.profiles[0].content == "user likes water"
+    p = await controllers.user.delete_user(u_id, DEFAULT_PROJECT_ID)
+    assert p.ok()
+
+
+@pytest.mark.asyncio
+async def test_buffer_insert_order(db_env):
+    p = await controllers.user.create_user(res.UserData(), DEFAULT_PROJECT_ID)
+    assert p.ok()
+    u_id = p.data().id
+
+    blobs = []
+    for i in range(5):
+        blob = DocBlob(content=f"Hello {i}")
+        p = await controllers.blob.insert_blob(
+            u_id,
+            DEFAULT_PROJECT_ID,
+            res.BlobData(blob_type=BlobType.doc, blob_data={"content": blob.content}),
+        )
+        assert p.ok()
+        blobs.append((p.data().id, blob))
+
+    # Inserts don't wait for a running flush of the same user
+    async with user_lock(u_id, DEFAULT_PROJECT_ID, "flush_buffer"):
+        for blob in blobs:
+            p = await controllers.buffer.insert_blob_to_buffer(
+                u_id, DEFAULT_PROJECT_ID, *blob
+            )
+            assert p.ok()
+        p = await controllers.buffer.flush_buffer(
+            u_id, DEFAULT_PROJECT_ID, BlobType.chat, wait=False
+        )
+        assert p.ok() and p.data() is None
+
+    p = await controllers.buffer.get_buffer_capacity(
+        u_id, DEFAULT_PROJECT_ID, BlobType.doc
+    )
+    assert p.data() == 5
+    p = await controllers.buffer.claim_buffer(u_id, DEFAULT_PROJECT_ID, BlobType.doc)
+    assert p.ok()
+    _, blob_buffers = p.data()
+    assert [b.blob_id for b in blob_buffers] == [b[0] for b in blobs]
+    assert [b.seq for b in blob_buffers] == sorted(b.seq for b in blob_buffers)
+
+    # Concurrent inserts are all counted in the summary
+    await asyncio.gather(
+        *[
+            controllers.buffer.insert_blob_to_buffer(u_id, DEFAULT_PROJECT_ID, *blob)
+            for blob in blobs
+        ]
+    )
+    p = await controllers.buffer_summary.get_buffer_summary(
+        u_id, DEFAULT_PROJECT_ID, BlobType.doc
+    )
+    assert p.data().blob_count == 5
+
+    p = await controllers.user.delete_user(u_id, DEFAULT_PROJECT_ID)
+    assert p.ok()
+
+
+@pytest.mark.asyncio
+async def test_project_config_cache(db_env):
+    p = await controllers.project.update_project_profile_config(
+        DEFAULT_PROJECT_ID, "language: zh\nevent_tags:\n  - name: emotion"
+    )
+    assert p.ok()
+    p = await project_config.get_project_config(DEFAULT_PROJECT_ID)
+    assert p.ok()
+    pc = p.data()
+    assert pc.language == "zh"
+    assert [et.name for et in pc.event_tags] == ["emotion"]
+    assert pc.system_prompt(event_tagging, pc.event_tags_prompt) is pc.system_prompt(
+        event_tagging, pc.event_tags_prompt
+    )
+
+    # Served from memory until the config is updated
+    p = await project_config.get_project_config(DEFAULT_PROJECT_ID)
+    assert p.data() is pc
+    p = await controllers.project.update_project_profile_config(
+        DEFAULT_PROJECT_ID, None
+    )
+    assert p.ok()
+    p = await controllers.project.get_project_profile_config(DEFAULT_PROJECT_ID)
+    assert p.ok()
+    assert p.data().language is None
+    p = await project_config.get_project_config(DEFAULT_PROJECT_ID)
+    assert p.data().language == CONFIG.language
+
+
+@pytest.mark.asyncio
+async def test_profile_filter_with_chats(db_env):
+    keywords = ["tea", "guitar", "Shanghai"]
+
+    async def fake_get_embedding(project_id, texts, phase="document", model=None):
+        vectors = np.zeros((len(texts), CONFIG.embedding_dim))
+        for i, text in enumerate(texts):
+            for j, keyword in enumerate(keywords):
+                if keyword in text:
+                    vectors[i, j] = 1
+            vectors[i, -1] = 0.1
+        return Promise.resolve(vectors)
+
+    with patch(
+        "memobase_server.controllers.profile.get_embedding", fake_get_embedding
+    ), patch(
+        "memobase_server.controllers.post_process.profile.get_embedding",
+        fake_get_embedding,
+    ), patch.object(CONFIG, "profile_filter_mode", "embedding"):
+        p = await controllers.user.create_user(res.UserData(), DEFAULT_PROJECT_ID)
+        assert p.ok()
+        u_id = p.data().id
+
+        p = await controllers.profile.add_user_profiles(
+            u_id,
+            DEFAULT_PROJECT_ID,
+            ["user likes tea", "user plays guitar", "user lives in Shanghai"],
+            [
+                {"topic": "interest", "sub_topic": "drinks"},
+                {"topic": "interest", "sub_topic": "music"},
+                {"topic": "contact_info", "sub_topic": "city"},
+            ],
+        )
+        assert p.ok()
+        tea_id, guitar_id, city_id = p.data().ids
+
+        p = await controllers.profile.get_user_profiles(u_id, DEFAULT_PROJECT_ID)
+        p = await filter_profiles_with_chats(
+            u_id,
+            DEFAULT_PROJECT_ID,
+            p.data(),
+            [OpenAICompatibleMessage(role="user", content="Any guitar lessons?")],
+            max_filter_num=1,
+        )
+        assert p.ok()
+        assert [pf.id for pf in p.data()] == [guitar_id]
+
+        # An updated profile is ranked by its new content
+        p = await controllers.profile.update_user_profiles(
+            u_id, DEFAULT_PROJECT_ID, [tea_id], ["user learns guitar"], [None]
+        )
+        assert p.ok()
+        p = await controllers.profile.get_user_profiles(u_id, DEFAULT_PROJECT_ID)
+        p = await filter_profiles_with_chats(
+            u_id,
+            DEFAULT_PROJECT_ID,
+            p.data(),
+            [OpenAICompatibleMessage(role="user", content="Any guitar lessons?")],
+            only_topics=["interest"],
+        )
+        assert p.ok()
+        assert {pf.id for pf in p.data()} == {tea_id, guitar_id}
+
+        p = await controllers.user.delete_user(u_id, DEFAULT_PROJECT_ID)
+        assert p.ok()
+
+
+@pytest.mark.asyncio
+async def test_user_context(db_env):
+    p = await controllers.user.create_user(res.UserData(), DEFAULT_PROJECT_ID)
+    assert p.ok()
+    u_id = p.data().id
+
+    with patch.object(CONFIG, "enable_event_embedding", False):
+        p = await controllers.profile.add_user_profiles(
+            u_id,
+            DEFAULT_PROJECT_ID,
+            ["user likes tea"],
+            [{"topic": "interest", "sub_topic": "drinks"}],
+        )
+        assert p.ok()
+        p = await controllers.event.append_user_event(
+            u_id,
+            DEFAULT_PROJECT_ID,
+            {"event_tip": "user went hiking", "profile_delta": []},
+        )
+    assert p.ok()
+
+    async def get_context(max_token_size: int, profile_event_ratio: float) -> str:
+        p = await controllers.context.get_user_context(
+            u_id,
+            DEFAULT_PROJECT_ID,
+            max_token_size,
+            prefer_topics=None,
+            only_topics=None,
+            max_subtopic_size=None,
+            topic_limits={},
+            profile_event_ratio=profile_event_ratio,
+            require_event_summary=False,
+            chats=[],
+            event_similarity_threshold=0.2,
+        )
+        assert p.ok()
+        return p.data().context
+
+    # The events get the tokens left by the profiles
+    context = await get_context(1000, 0.5)
+    assert "user likes tea" in context and "user went hiking" in context
+    profile_tokens = profile_token_size(
+        "user likes tea", {"topic": "interest", "sub_topic": "drinks"}
+    )
+    context = await get_context(profile_tokens, 1.0)
+    assert "user likes tea" in context and "user went hiking" not in context
+
+    p = await controllers.user.delete_user(u_id, DEFAULT_PROJECT_ID)
+    assert p.ok()
+
+
+@pytest.mark.asyncio
+async def test_flush_token_billing_retry(db_env):
+    pending = controllers.billing._PENDING_TOKEN_COSTS
+    p = await controllers.billing.flush_token_billing()
+    assert p.ok()
+
+    await controllers.billing.project_cost_token_billing(DEFAULT_PROJECT_ID, 10, 5)
+    with patch(
+        "memobase_server.controllers.billing.AsyncSession",
+        side_effect=RuntimeError("DB is down"),
+    ):
+        p = await controllers.billing.flush_token_billing()
+    assert not p.ok()
+    # The costs are kept for the next flush
+    assert pending[DEFAULT_PROJECT_ID] == [10, 5]
+
+    p = await controllers.billing.flush_token_billing()
+    assert p.ok()
+    assert DEFAULT_PROJECT_ID not in pending
+
+
+@pytest.mark.asyncio
+async def test_search_user_events_of_many_users(db_env):
+    async def fake_get_embedding(project_id, texts, phase="document", model=None):
+        return Promise.resolve(np.ones((len(texts), CONFIG.embedding_dim)))
+
+    topk = 5
+    user_ids = []
+    with patch(
+        "memobase_server.controllers.event.get_embedding", fake_get_embedding
+    ), patch.object(CONFIG, "enable_event_embedding", True):
+        for _ in range(3):
+            p = await controllers.user.create_user(res.UserData(), DEFAULT_PROJECT_ID)
+            assert p.ok()
+            u_id = p.data().id
+            user_ids.append(u_id)
+            for i in range(topk):
+                p = await controllers.event.append_user_event(
+                    u_id,
+                    DEFAULT_PROJECT_ID,
+                    {"event_tip": f"user went hiking {i}", "profile_delta": []},
+                )
+                assert p.ok()
+
+        # ef_search sees too few candidates, the iterative scan or, without
+        # it, the exact scan finds them all
+        for iterative_scan in ["relaxed_order", None]:
+            with patch.object(CONFIG, "event_search_ef_search", 1), patch.object(
+                CONFIG, "event_search_iterative_scan", iterative_scan
+            ):
+                for u_id in user_ids:
+                    p = await controllers.event.get_user_events(
+                        u_id, DEFAULT_PROJECT_ID, topk=topk
+                    )
+                    assert p.ok()
+                    user_event_ids = {e.id for e in p.data().events}
+                    p = await controllers.event.search_user_events(
+                        u_id, DEFAULT_PROJECT_ID, "hiking", topk=topk
+                    )
+                    assert p.ok()
+                    assert len(p.data().events) == topk
+                    assert {e.id for e in p.data().events} == user_event_ids
+
+                    # The threshold is applied to the nearest events
+                    p = await controllers.event.search_user_events(
+                        u_id,
+                        DEFAULT_PROJECT_ID,
+                        "hiking",
+                        topk=topk,
+                        similarity_threshold=1.5,
+                    )
+                    assert p.ok() and p.data().events == []
+
+    for u_id in user_ids:
+        p = await controllers.user.delete_user(u_id, DEFAULT_PROJECT_ID)
+        assert p.ok()
+
+
+@pytest.mark.asyncio
+async def test_pipeline_optional_stage_raises():
+    async def extract(results):
+        return Promise.resolve(["fact"])
+
+    async def organize(results):
+        raise RuntimeError("LLM response is broken")
+
+    async def merge(results):
+        return Promise.resolve(len(results["extract"]))
+
+    p = await run_pipeline(
+        "test",
+        [
+            Stage("extract", extract),
+            Stage("organize", organize, deps=["extract"], required=False),
+            Stage("merge", merge, deps=["extract"]),
+        ],
+    )
+    assert p.ok()
+    assert p.data() == {"extract": ["fact"], "organize": None, "merge": 1}
+
+    # A required stage that raises fails the pipeline
+    p = await run_pipeline(
+        "test",
+        [
+            Stage("extract", extract),
+            Stage("organize", organize, deps=["extract"]),
+            Stage("merge", merge, deps=["extract"]),
+        ],
+    )
+    assert not p.ok()
+
+
+@pytest.mark.asyncio
+async def test_profile_writes_reach_cache_in_order(db_env):
+    p = await controllers.user.create_user(res.UserData(), DEFAULT_PROJECT_ID)
+    assert p.ok()
+    u_id = p.data().id
+    p = await controllers.profile.add_user_profiles(
+        u_id,
+        DEFAULT_PROJECT_ID,
+        ["user likes tea"],
+        [{"topic": "interest", "sub_topic": "drinks"}],
+    )
+    assert p.ok()
+    profile_id = p.data().ids[0]
+
+    # The first write-through is slow, the other write must not overtake it
+    set_cached = profile_cache.set_cached_user_profiles
+    slowed = []
+
+    async def slow_set_cached(user_id, project_id, profiles):
+        if not slowed:
+            slowed.append(True)
+            await asyncio.sleep(0.2)
+        await set_cached(user_id, project_id, profiles)
+
+    with patch(
+        "memobase_server.controllers.profile.set_cached_user_profiles",
+        slow_set_cached,
+    ):
+        results = await asyncio.gather(
+            *[
+                controllers.profile.update_user_profiles(
+                    u_id, DEFAULT_PROJECT_ID, [profile_id], [content], [None]
+                )
+                for content in ["user likes coffee", "user likes juice"]
+            ]
+        )
+    assert all(p.ok() for p in results)
+
+    async with connectors.AsyncSession() as session:
+        stored = await controllers.profile.load_user_profiles(
+            session, u_id, DEFAULT_PROJECT_ID
+        )
+    p = await controllers.profile.get_user_profiles(u_id, DEFAULT_PROJECT_ID)
+    assert p.ok()
+    assert p.data().profiles[0].content == stored.profiles[0].content
+
+    p = await controllers.user.delete_user(u_id, DEFAULT_PROJECT_ID)
+    assert p.ok()
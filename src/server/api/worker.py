@@ -0,0 +1,36 @@
+import memobase_server.env
+
+# Done setting up env
+
+import asyncio
+import signal
+import argparse
+from memobase_server.connectors import close_connection, init_redis_pool
+from memobase_server.env import LOG, CONFIG
+from memobase_server.workers import start_background_workers, stop_background_workers
+
+
+async def main(flush_worker_num: int):
+    init_redis_pool()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    start_background_workers(flush_worker_num)
+    LOG.info(f"Start Memobase Worker {memobase_server.__version__} 🖼️")
+    await stop.wait()
+    await stop_background_workers()
+    await close_connection()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memobase buffer flush worker")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=CONFIG.flush_worker_num,
+        help="Number of flush jobs processed concurrently in this process",
+    )
+    args = parser.parse_args()
+    asyncio.run(main(args.concurrency))